@@ -10,7 +10,7 @@ import io
 
 from django.conf import settings
 
-from .models import Card, Service, ServiceEntry, Feedback, Attendance, AuditLog, JobCard, IndustrialAMC
+from .models import Card, Service, ServiceEntry, Feedback, Attendance, AuditLog, JobCard, IndustrialAMC, ServiceMilestone, ReportSnapshot, CardSearchToken, NotificationOutbox, ExportJob
 from .utils import generate_otp, hash_otp, otp_expiry_time
 
 
@@ -21,4 +21,9 @@ admin.site.register(IndustrialAMC)
 admin.site.register(ServiceEntry)
 admin.site.register(Feedback)
 admin.site.register(Attendance)
-admin.site.register(AuditLog)
\ No newline at end of file
+admin.site.register(AuditLog)
+admin.site.register(ServiceMilestone)
+admin.site.register(ReportSnapshot)
+admin.site.register(CardSearchToken)
+admin.site.register(NotificationOutbox)
+admin.site.register(ExportJob)
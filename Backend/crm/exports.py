@@ -0,0 +1,497 @@
+# crm/exports.py
+"""
+Streamed CSV exports and background export jobs.
+
+Rows are read as plain tuples (`values_list`, joins done in the same query)
+in keyset pages of EXPORT_CHUNK_SIZE, and written out as they arrive, so
+the first bytes leave immediately and memory stays flat however long the
+history is. Keyset pages are used instead of `.iterator()` because the
+MySQL driver buffers the whole result set client-side.
+
+Larger pulls go through ExportJob: the API stores the job, a Celery task
+(crm.tasks.run_export_job) writes the same rows as CSV / XLSX / Parquet
+under MEDIA_ROOT/exports/ and the admin polls and downloads the file. A
+periodic sweep fails the jobs whose worker died, and deletes the files
+once they are CRM_EXPORT_RETENTION_DAYS old.
+"""
+import csv
+import json
+import os
+import zlib
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Attendance, Card, ExportJob, JobCard, Service
+from .reports import REPORT_BUILDERS, refresh_snapshot, valid_snapshot
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_CHUNK_SIZE = getattr(settings, "CRM_EXPORT_CHUNK_SIZE", 2000)
+
+EXPORT_DIR = "exports"
+
+# a job not finished this long after it was queued / started is given up
+EXPORT_JOB_TIMEOUT = timedelta(seconds=getattr(settings, "CRM_EXPORT_JOB_TIMEOUT", 60 * 60))
+
+# finished files are deleted after this many days
+EXPORT_RETENTION = timedelta(days=getattr(settings, "CRM_EXPORT_RETENTION_DAYS", 7))
+
+FILE_EXTENSIONS = {
+    "csv": "csv",
+    "xlsx": "xlsx",
+    "parquet": "parquet",
+}
+
+
+# -----------------------------
+# Rows
+# -----------------------------
+def keyset_values(queryset, fields, order_field="id", chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    values_list tuples of `fields`, ordered by (order_field, id), read in
+    keyset pages. Both fields must be in `fields`.
+    """
+    order = fields.index(order_field)
+    pk = fields.index("id")
+
+    queryset = queryset.order_by(*dict.fromkeys((order_field, "id")))
+    last = None
+
+    while True:
+        page = queryset
+        if last is not None:
+            if order_field == "id":
+                page = page.filter(id__gt=last[pk])
+            else:
+                page = page.filter(
+                    Q(**{f"{order_field}__gt": last[order]})
+                    | Q(**{order_field: last[order], "id__gt": last[pk]})
+                )
+
+        rows = list(page.values_list(*fields)[:chunk_size])
+        yield from rows
+
+        if len(rows) < chunk_size:
+            return
+
+        last = rows[-1]
+
+
+def export_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+# (CSV header, values_list field)
+SERVICE_EXPORT_COLUMNS = [
+    ("id", "id"),
+    ("card_id", "card_id"),
+    ("customer", "card__customer_id"),
+    ("service_type", "service_type"),
+    ("status", "status"),
+    ("scheduled_at", "scheduled_at"),
+    ("assigned_to", "assigned_to_id"),
+    ("amount_charged", "amount_charged"),
+    ("created_at", "created_at"),
+]
+
+CARD_EXPORT_COLUMNS = [
+    ("id", "id"),
+    ("model", "model"),
+    ("customer", "customer_id"),
+    ("customer_code", "customer__customer_code"),
+    ("customer_name", "customer_name"),
+    ("phone", "customer__phone"),
+    ("card_type", "card_type"),
+    ("address", "address"),
+    ("city", "city"),
+    ("postal_code", "postal_code"),
+    ("date_of_installation", "date_of_installation"),
+    ("warranty_start_date", "warranty_start_date"),
+    ("warranty_end_date", "warranty_end_date"),
+    ("amc_start_date", "amc_start_date"),
+    ("amc_end_date", "amc_end_date"),
+    ("created_at", "created_at"),
+]
+
+JOB_CARD_EXPORT_COLUMNS = [
+    ("id", "id"),
+    ("service_id", "service_id"),
+    ("customer", "customer_id"),
+    ("customer_name", "customer__name"),
+    ("part_name", "part_name"),
+    ("serial_number", "serial_number"),
+    ("status", "status"),
+    ("staff", "staff__name"),
+    ("get_from_customer_at", "get_from_customer_at"),
+    ("received_office_at", "received_office_at"),
+    ("repair_completed_at", "repair_completed_at"),
+    ("reinstalled_at", "reinstalled_at"),
+    ("created_at", "created_at"),
+]
+
+ATTENDANCE_EXPORT_COLUMNS = [
+    ("id", "id"),
+    ("user", "user_id"),
+    ("name", "user__name"),
+    ("date", "date"),
+    ("status", "status"),
+    ("marked_by", "marked_by_id"),
+    ("created_at", "created_at"),
+]
+
+
+def date_range(queryset, field, date_from=None, date_to=None):
+    if date_from:
+        queryset = queryset.filter(**{f"{field}__gte": date_from})
+    if date_to:
+        queryset = queryset.filter(**{f"{field}__lte": date_to})
+    return queryset
+
+
+def service_export_queryset(region, date_from=None, date_to=None):
+    return date_range(
+        Service.objects.filter(card__customer__region=region), "created_at", date_from, date_to
+    )
+
+
+def service_export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Rows of the services export, ordered by (created_at, id).
+    """
+    fields = [field for _, field in SERVICE_EXPORT_COLUMNS]
+
+    for (
+        id, card_id, customer_id, service_type, status,
+        scheduled_at, assigned_to_id, amount_charged, created,
+    ) in keyset_values(queryset, fields, "created_at", chunk_size):
+        yield [
+            id,
+            card_id,
+            customer_id or "",
+            service_type,
+            status,
+            scheduled_at.isoformat() if scheduled_at else "",
+            assigned_to_id or "",
+            amount_charged if amount_charged else "",
+            created.isoformat(),
+        ]
+
+
+def table_export(columns, queryset):
+    fields = [field for _, field in columns]
+    rows = (
+        [export_value(v) for v in row]
+        for row in keyset_values(queryset, fields)
+    )
+    return [name for name, _ in columns], rows
+
+
+def services_export(region, params):
+    qs = service_export_queryset(region, params.get("from"), params.get("to"))
+    return [name for name, _ in SERVICE_EXPORT_COLUMNS], service_export_rows(qs)
+
+
+def cards_export(region, params):
+    qs = Card.objects.filter(customer__region=region)
+    return table_export(
+        CARD_EXPORT_COLUMNS, date_range(qs, "created_at", params.get("from"), params.get("to"))
+    )
+
+
+def job_cards_export(region, params):
+    qs = JobCard.objects.filter(customer__region=region)
+    return table_export(
+        JOB_CARD_EXPORT_COLUMNS, date_range(qs, "created_at", params.get("from"), params.get("to"))
+    )
+
+
+def attendance_export(region, params):
+    qs = Attendance.objects.filter(user__region=region)
+    return table_export(
+        ATTENDANCE_EXPORT_COLUMNS, date_range(qs, "date", params.get("from"), params.get("to"))
+    )
+
+
+def report_month(params):
+    month = params.get("month")
+    if not month:
+        today = timezone.localdate()
+        return today.replace(day=1)
+
+    year, mon = map(int, month.split("-"))
+    return date(year, mon, 1)
+
+
+def report_export(report_type):
+    """
+    Flat rows of a monthly report: its snapshot when still valid, else
+    rebuilt (and stored) like the report views do.
+    """
+    def export(region, params):
+        first_day = report_month(params)
+
+        data = valid_snapshot(report_type, region, first_day)
+        if data is None:
+            data, _ = refresh_snapshot(report_type, region, first_day)
+
+        rows = data["report_data"] if isinstance(data, dict) else data
+
+        header = []
+        for row in rows:
+            header.extend(k for k in row if k != "allmilestones" and k not in header)
+
+        return header, ([export_value(row.get(k)) for k in header] for row in rows)
+
+    return export
+
+
+# kind -> export(region, params) returning (header, rows)
+EXPORTS = {
+    "services": services_export,
+    "cards": cards_export,
+    "job-cards": job_cards_export,
+    "attendance": attendance_export,
+    **{report_type: report_export(report_type) for report_type in REPORT_BUILDERS},
+}
+
+
+def validate_export_params(kind, params):
+    """
+    Error message for params the export would fail on, else None.
+    """
+    if kind in REPORT_BUILDERS:
+        month = params.get("month")
+        if month:
+            try:
+                year, mon = map(int, month.split("-"))
+                monthrange(year, mon)
+            except ValueError:
+                return "invalid month, expected YYYY-MM"
+        return None
+
+    for key in ("from", "to"):
+        value = params.get(key)
+        if value:
+            # the whole value ends up in the created_at filter
+            try:
+                valid = parse_date(value) or parse_datetime(value)
+            except ValueError:
+                valid = None
+            if not valid:
+                return f"invalid {key}, expected YYYY-MM-DD"
+    return None
+
+
+# -----------------------------
+# Streaming (HTTP)
+# -----------------------------
+class Echo:
+    # file-like object for csv.writer that hands the line back
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def gzip_stream(chunks, batch_bytes=64 * 1024):
+    """
+    gzip-compress a stream of str chunks on the fly.
+    """
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    pending = []
+    size = 0
+
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        pending.append(data)
+        size += len(data)
+
+        if size >= batch_bytes:
+            out = compressor.compress(b"".join(pending))
+            pending, size = [], 0
+            if out:
+                yield out
+
+    yield compressor.compress(b"".join(pending)) + compressor.flush()
+
+
+# -----------------------------
+# Files (export jobs)
+# -----------------------------
+def chunks_of(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_csv(path, header, rows):
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(header)
+
+        for chunk in chunks_of(rows, EXPORT_CHUNK_SIZE):
+            writer.writerows(chunk)
+            count += len(chunk)
+    return count
+
+
+def write_xlsx(path, header, rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)  # rows are streamed to disk
+    sheet = workbook.create_sheet()
+    sheet.append(header)
+
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+
+    workbook.save(path)
+    return count
+
+
+def write_parquet(path, header, rows):
+    # every column as text, like the CSV, so chunks always share one schema
+    schema = pyarrow.schema([(name, pyarrow.string()) for name in header])
+
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for chunk in chunks_of(rows, EXPORT_CHUNK_SIZE):
+            columns = list(zip(*chunk))
+            writer.write_table(pyarrow.table(
+                [[None if v == "" else str(v) for v in col] for col in columns],
+                schema=schema,
+            ))
+            count += len(chunk)
+    return count
+
+
+WRITERS = {
+    "csv": write_csv,
+    "xlsx": write_xlsx,
+    "parquet": write_parquet,
+}
+
+
+def available_formats():
+    return [f for f in WRITERS if f != "parquet" or pyarrow is not None]
+
+
+def run_export(job_id):
+    """
+    Write the file of a pending job. Returns the number of rows written, or
+    None when the job was already taken.
+    """
+    claimed = ExportJob.objects.filter(pk=job_id, status="pending").update(
+        status="running",
+        started_at=timezone.now(),
+    )
+    if not claimed:
+        return None
+
+    job = ExportJob.objects.get(pk=job_id)
+
+    name = f"{EXPORT_DIR}/{job.kind}-{job.id}-{timezone.now():%Y%m%d%H%M%S}.{FILE_EXTENSIONS[job.format]}"
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    try:
+        header, rows = EXPORTS[job.kind](job.region, job.params)
+        count = WRITERS[job.format](path, header, rows)
+
+    except Exception as e:
+        if os.path.exists(path):
+            os.remove(path)
+
+        ExportJob.objects.filter(pk=job.id).update(
+            status="failed",
+            error=str(e),
+            finished_at=timezone.now(),
+        )
+        raise
+
+    finished = ExportJob.objects.filter(pk=job.id, status="running").update(
+        status="done",
+        rows=count,
+        file=name,
+        finished_at=timezone.now(),
+    )
+    if not finished:
+        # given up by sweep_exports meanwhile (which may have removed it)
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+    return count
+
+
+def sweep_exports(now=None):
+    """
+    Fail the jobs whose worker died or whose task was lost, delete the files
+    past their retention, and the partial files dead workers left behind.
+    Returns the number of jobs failed, files expired and orphans removed.
+    """
+    now = now or timezone.now()
+    deadline = now - EXPORT_JOB_TIMEOUT
+
+    failed = ExportJob.objects.filter(
+        Q(status="pending", created_at__lt=deadline)
+        | Q(status="running", started_at__lt=deadline)
+    ).update(
+        status="failed",
+        error="export did not finish in time",
+        finished_at=now,
+    )
+
+    expired = 0
+    old_jobs = ExportJob.objects.filter(status="done", finished_at__lt=now - EXPORT_RETENTION)
+    for job in old_jobs:
+        if job.file:
+            job.file.delete(save=False)
+        ExportJob.objects.filter(pk=job.pk).update(status="expired", file=None)
+        expired += 1
+
+    # files of no done job, older than any running export could be
+    orphans = 0
+    directory = os.path.join(settings.MEDIA_ROOT, EXPORT_DIR)
+    if os.path.isdir(directory):
+        kept = set(ExportJob.objects.filter(status="done").values_list("file", flat=True))
+        for entry in os.scandir(directory):
+            name = f"{EXPORT_DIR}/{entry.name}"
+            modified = datetime.fromtimestamp(entry.stat().st_mtime, tz=now.tzinfo)
+            if entry.is_file() and name not in kept and modified < deadline:
+                os.remove(entry.path)
+                orphans += 1
+
+    return failed, expired, orphans
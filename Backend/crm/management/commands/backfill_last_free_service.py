@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from crm.models import Card, ServiceEntry
+
+
+class Command(BaseCommand):
+    help = "Set Card.last_free_service_at from the latest ServiceEntry of each card's free services"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **kwargs):
+
+        latest = (
+            ServiceEntry.objects
+            .filter(service__service_type="free")
+            .values("service__card_id")
+            .annotate(last=Max("created_at"))
+            .order_by("service__card_id")
+            .values_list("service__card_id", "last")
+        )
+
+        processed = 0
+        batch = []
+
+        for card_id, last in latest.iterator(chunk_size=kwargs["chunk_size"]):
+            batch.append(Card(id=card_id, last_free_service_at=last))
+
+            if len(batch) == kwargs["chunk_size"]:
+                processed += self.flush(batch)
+                batch = []
+                self.stdout.write(f"… {processed} cards updated")
+
+        processed += self.flush(batch)
+
+        self.stdout.write(self.style.SUCCESS("🎉 Last free service backfill completed"))
+        self.stdout.write(f"✔ Cards updated: {processed}")
+
+    def flush(self, batch):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            Card.objects.bulk_update(batch, ["last_free_service_at"])
+        return len(batch)
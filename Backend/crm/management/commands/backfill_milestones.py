@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from crm.models import Card
+from crm.milestones import sync_card_milestones
+
+
+class Command(BaseCommand):
+    help = "Build / refresh the precomputed warranty and AMC service milestones of every card"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--region", type=str, help="Only cards of customers in this region")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **kwargs):
+
+        cards = Card.objects.select_related("customer").order_by("id")
+
+        if kwargs.get("region"):
+            cards = cards.filter(customer__region=kwargs["region"])
+
+        processed = 0
+
+        for card in cards.iterator(chunk_size=kwargs["chunk_size"]):
+            sync_card_milestones(card)
+            processed += 1
+
+            if processed % kwargs["chunk_size"] == 0:
+                self.stdout.write(f"… {processed} cards processed")
+
+        self.stdout.write(self.style.SUCCESS("🎉 Milestone backfill completed"))
+        self.stdout.write(f"✔ Cards processed: {processed}")
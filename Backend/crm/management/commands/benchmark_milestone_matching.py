@@ -0,0 +1,171 @@
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from user.models import User
+from crm.models import Card, Service, ServiceMilestone, REGION_CHOICES
+from crm.milestones import build_milestones, free_services_by_card, find_service, MATCH_WINDOW
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark free-service matching for a monthly report: global service scan "
+        "(before) vs region + month window prefetch with bisect (after). "
+        "The fixture is created inside a transaction and rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--services", type=int, default=100_000)
+        parser.add_argument("--cards", type=int, default=10_000)
+        parser.add_argument("--month", type=str, default="2024-06", help="YYYY-MM")
+        parser.add_argument("--seed", type=int, default=42)
+
+    # -----------------------------
+    # Fixture
+    # -----------------------------
+    def build_fixture(self, n_cards, n_services, seed):
+        rnd = random.Random(seed)
+        regions = [r for r, _ in REGION_CHOICES]
+        first = date(2023, 1, 1)
+
+        User.objects.bulk_create([
+            User(
+                customer_code=f"BENCH{i:06d}",
+                name=f"Bench {i}",
+                role="customer",
+                region=regions[i % len(regions)],
+                password="!",
+            )
+            for i in range(n_cards)
+        ], batch_size=2000)
+
+        # MySQL's bulk_create returns no primary keys: read the rows back
+        customers = User.objects.filter(customer_code__startswith="BENCH").order_by("customer_code")
+
+        cards = []
+        for i, customer in enumerate(customers):
+            start = first + timedelta(days=rnd.randrange(730))
+            cards.append(Card(
+                model="BENCH",
+                customer=customer,
+                customer_name=customer.name,
+                region=customer.region,
+                warranty_start_date=start,
+                warranty_end_date=start + timedelta(days=365),
+            ))
+        # bulk_create skips Card.save(), milestones are added below
+        Card.objects.bulk_create(cards, batch_size=2000)
+        cards = list(
+            Card.objects.filter(model="BENCH", customer__customer_code__startswith="BENCH").order_by("id")
+        )
+
+        ServiceMilestone.objects.bulk_create([
+            ServiceMilestone(
+                card=card,
+                kind="warranty",
+                region=card.region,
+                sequence=seq,
+                milestone_date=d,
+            )
+            for card in cards
+            for seq, d in enumerate(build_milestones(card.warranty_start_date, card.warranty_end_date), start=1)
+        ], batch_size=5000)
+
+        Service.objects.bulk_create([
+            Service(
+                card=rnd.choice(cards),
+                service_type="free",
+                status="completed",
+                scheduled_at=first + timedelta(days=rnd.randrange(1095)),
+            )
+            for _ in range(n_services)
+        ], batch_size=5000)
+
+        return cards[0].region
+
+    # -----------------------------
+    # Implementations
+    # -----------------------------
+    def match_before(self, region, first_day, last_day):
+        milestones = ServiceMilestone.objects.filter(
+            region=region, kind="warranty", milestone_date__range=(first_day, last_day)
+        ).values_list("card_id", "milestone_date")
+
+        free_services = (
+            Service.objects
+            .filter(service_type="free")
+            .values("card_id", "scheduled_at", "assigned_to_id", "assigned_to__name")
+        )
+
+        services_by_card = {}
+        for s in free_services:
+            services_by_card.setdefault(s["card_id"], []).append(s)
+
+        done = 0
+        for card_id, m in milestones:
+            for svc in services_by_card.get(card_id, []):
+                if svc["scheduled_at"] and m - MATCH_WINDOW <= svc["scheduled_at"] <= m + MATCH_WINDOW:
+                    done += 1
+                    break
+        return done
+
+    def match_after(self, region, first_day, last_day):
+        milestones = ServiceMilestone.objects.filter(
+            region=region, kind="warranty", milestone_date__range=(first_day, last_day)
+        ).values_list("card_id", "milestone_date")
+
+        services = free_services_by_card(region, first_day - MATCH_WINDOW, last_day + MATCH_WINDOW)
+
+        done = 0
+        for card_id, m in milestones:
+            if find_service(services.get(card_id), m):
+                done += 1
+        return done
+
+    def measure(self, label, fn, *args):
+        tracemalloc.start()
+        started = time.perf_counter()
+
+        with CaptureQueriesContext(connection) as ctx:
+            done = fn(*args)
+
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(
+            f"{label:<7} queries={len(ctx.captured_queries):<4} "
+            f"peak={peak / 1024 / 1024:8.2f} MiB  time={elapsed * 1000:8.1f} ms  done={done}"
+        )
+        return done
+
+    # -----------------------------
+    # Main
+    # -----------------------------
+    def handle(self, *args, **kwargs):
+
+        year, mon = map(int, kwargs["month"].split("-"))
+        first_day = date(year, mon, 1)
+        last_day = (first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+        with transaction.atomic():
+            self.stdout.write(
+                f"Building fixture: {kwargs['cards']} cards, {kwargs['services']} free services …"
+            )
+            region = self.build_fixture(kwargs["cards"], kwargs["services"], kwargs["seed"])
+
+            self.stdout.write(f"Region {region}, month {first_day:%Y-%m}")
+            before = self.measure("before", self.match_before, region, first_day, last_day)
+            after = self.measure("after", self.match_after, region, first_day, last_day)
+
+            if before != after:
+                self.stderr.write(f"❌ Results differ: before={before} after={after}")
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("🎉 Benchmark completed (fixture rolled back)"))
@@ -1,17 +1,53 @@
 import pandas as pd
 import re
+from collections import defaultdict
+from itertools import islice
+from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
-from user.models import User
-from crm.models import Card
+from user.models import CustomerCodeSequence, User
+from crm.models import Card, CardSearchToken, ServiceMilestone
+from crm.milestones import new_card_milestones
+from crm.reports import invalidate_reports
+from crm.search import card_tokens, token_rows
 from datetime import date
 
+DEFAULT_PASSWORD = "abc12345"
+DEFAULT_POSTAL_CODE = "626102"
+DEFAULT_REGION = "rajapalayam"
+
+# IN (...) lists used to preload existing users / cards
+LOOKUP_CHUNK = 1000
+
+PROGRESS_WIDTH = 30
+
+
+def chunked(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 class Command(BaseCommand):
     help = "Import industrial customers and cards from Excel"
 
     def add_arguments(self, parser):
         parser.add_argument("file", type=str, help="Path to Excel file")
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Clean the sheet in pandas and insert with bulk_create (large files)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what a bulk import would create without writing (implies --bulk)",
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000)
 
     # -----------------------------
     # Helpers
@@ -27,7 +63,8 @@ class Command(BaseCommand):
         if not phone:
             return None  # ✅ phone optional
 
-        phone = re.sub(r"\D", "", phone)
+        # Excel numbers come in as 9876543210.0
+        phone = re.sub(r"\D", "", re.sub(r"\.0$", "", phone))
 
         if phone.startswith("91") and len(phone) > 10:
             phone = phone[-10:]
@@ -48,6 +85,239 @@ class Command(BaseCommand):
 
         return parsed.date()
 
+    def progress(self, label, done, total):
+        # redrawn in place on a terminal, one line per step in logs
+        if not self.stdout.isatty():
+            self.stdout.write(f"… {done} / {total} {label}")
+            return
+
+        filled = PROGRESS_WIDTH * done // total if total else PROGRESS_WIDTH
+        bar = "█" * filled + "·" * (PROGRESS_WIDTH - filled)
+        self.stdout.write(f"\r{bar} {done} / {total} {label}", ending="")
+        if done >= total:
+            self.stdout.write("")
+
+    # -----------------------------
+    # Vectorized cleaning (bulk mode)
+    # -----------------------------
+    def clean_column(self, df, column):
+        if column not in df:
+            return pd.Series("", index=df.index, dtype=object)
+        return df[column].astype(object).where(df[column].notna(), "").astype(str).str.strip()
+
+    def normalize_phone_column(self, df, column):
+        # same rules as normalize_phone(); Excel numbers come in as 9876543210.0
+        digits = (
+            self.clean_column(df, column)
+            .str.replace(r"\.0$", "", regex=True)
+            .str.replace(r"\D", "", regex=True)
+        )
+        digits = digits.where(
+            ~(digits.str.startswith("91") & (digits.str.len() > 10)),
+            digits.str[-10:],
+        )
+        return ("+91" + digits).astype(object).where(digits.str.len() == 10, None)
+
+    def parse_date_column(self, df, column):
+        if column not in df:
+            return pd.Series(date.today(), index=df.index, dtype=object)
+
+        parsed = pd.to_datetime(df[column], dayfirst=True, errors="coerce", format="mixed")
+        return parsed.dt.date.astype(object).where(parsed.notna(), date.today())
+
+    def load_rows(self, df):
+        rows = pd.DataFrame({
+            "name": self.clean_column(df, "CUSTOMER NAME"),
+            "city": self.clean_column(df, "PLACE"),
+            "model": self.clean_column(df, "MODEL"),
+            "phone": self.normalize_phone_column(df, "CONTACT NO"),
+            "installation": self.parse_date_column(df, "DATE OF INSTALLATION"),
+        })
+        # same lookup as the row-by-row import: by phone, else by name
+        rows["user_key"] = [
+            ("phone", phone) if phone else ("name", name)
+            for phone, name in zip(rows["phone"], rows["name"])
+        ]
+        return rows
+
+    # -----------------------------
+    # Bulk import
+    # -----------------------------
+    def existing_users(self, rows):
+        """
+        {user_key: user id} of the customers of the sheet already in the DB.
+        """
+        keys = set(rows["user_key"])
+        phones = {v for kind, v in keys if kind == "phone"}
+        names = {v for kind, v in keys if kind == "name"}
+
+        found = {}
+
+        for chunk in chunked(phones, LOOKUP_CHUNK):
+            for pk, phone in User.objects.filter(phone_normalized__in=chunk).values_list("id", "phone_normalized"):
+                found[("phone", phone)] = pk
+
+        for chunk in chunked(names, LOOKUP_CHUNK):
+            for pk, name in User.objects.filter(name__in=chunk).order_by("-id").values_list("id", "name"):
+                found[("name", name)] = pk  # lowest id wins
+
+        return found
+
+    def existing_cards(self, customer_ids):
+        """
+        {(customer id, model, warranty start)} already in the DB.
+        """
+        found = set()
+
+        for chunk in chunked(customer_ids, LOOKUP_CHUNK):
+            found.update(
+                Card.objects.filter(customer_id__in=chunk)
+                .values_list("customer_id", "model", "warranty_start_date")
+            )
+
+        return found
+
+    def create_users(self, new_keys, first_rows, chunk_size):
+        """
+        bulk_create the new customers; returns {user_key: user id}.
+        """
+        password = make_password(DEFAULT_PASSWORD)  # hashed once for every new user
+        codes = CustomerCodeSequence.allocate("VSTI", len(new_keys)) if new_keys else []
+
+        users = []
+        for key, code in zip(new_keys, codes):
+            row = first_rows[key]
+            users.append(User(
+                customer_code=code,
+                phone=row.phone,
+                # bulk_create skips User.save()
+                phone_normalized=row.phone,
+                phone_last10=row.phone[-10:] if row.phone else None,
+                name=row.name,
+                address=row.city,
+                city=row.city,
+                postal_code=DEFAULT_POSTAL_CODE,
+                region=DEFAULT_REGION,
+                role="customer",
+                is_industrial=True,
+                password=password,
+            ))
+
+        for chunk in chunked(users, chunk_size):
+            with transaction.atomic():
+                User.objects.bulk_create(chunk)
+
+        # MySQL does not return the new ids, the preassigned codes find them
+        created = {}
+        by_code = dict(zip(codes, new_keys))
+
+        for chunk in chunked(codes, LOOKUP_CHUNK):
+            for pk, code in User.objects.filter(customer_code__in=chunk).values_list("id", "customer_code"):
+                created[by_code[code]] = pk
+
+        return created
+
+    def create_cards(self, cards, chunk_size):
+        last_id = Card.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        done = 0
+
+        for chunk in chunked(cards, chunk_size):
+            with transaction.atomic():
+                Card.objects.bulk_create(chunk)
+
+            done += len(chunk)
+            self.progress("cards created", done, len(cards))
+
+        # bulk_create skips Card.save() and its signals: milestones, search
+        # tokens and report invalidation of the new cards, a chunk at a time.
+        # Cards created meanwhile through the API fall in the id range too and
+        # already have their rows: those inserts are skipped as conflicts.
+        new_cards = (
+            Card.objects.select_related("customer")
+            .filter(id__gt=last_id)
+            .order_by("id")
+        )
+
+        months = defaultdict(set)
+        indexed = 0
+
+        for chunk in chunked(new_cards.iterator(chunk_size=chunk_size), chunk_size):
+            milestones = [m for card in chunk for m in new_card_milestones(card)]
+            tokens = [
+                row for card in chunk
+                for row in token_rows(card, card_tokens(card), card.customer.region)
+            ]
+
+            with transaction.atomic():
+                ServiceMilestone.objects.bulk_create(milestones, ignore_conflicts=True)
+                CardSearchToken.objects.bulk_create(tokens, ignore_conflicts=True)
+
+            for milestone in milestones:
+                months[milestone.region].add(milestone.milestone_date.replace(day=1))
+
+            indexed += len(chunk)
+            self.progress("cards indexed", indexed, len(cards))
+
+        for region, region_months in months.items():
+            invalidate_reports(region, region_months)
+
+    def handle_bulk(self, df, dry_run, chunk_size):
+
+        rows = self.load_rows(df)
+        self.stdout.write(f"… {len(rows)} rows read")
+
+        users = self.existing_users(rows)
+        existing_user_count = len(set(users.values()))
+
+        first_rows = {}
+        for row in rows.itertuples():
+            first_rows.setdefault(row.user_key, row)
+
+        new_keys = [key for key in first_rows if key not in users]
+
+        if not dry_run:
+            users.update(self.create_users(new_keys, first_rows, chunk_size))
+
+        seen = self.existing_cards(set(users.values()))
+        cards = []
+        duplicates = 0
+
+        for row in rows.itertuples():
+            # new customers have no id yet in a dry run
+            customer_id = users.get(row.user_key, row.user_key)
+            key = (customer_id, row.model, row.installation)
+
+            if key in seen:
+                duplicates += 1
+                if self.verbosity > 1:
+                    self.stderr.write(f"⚠️ Row {row.Index + 1} skipped (duplicate card)")
+                continue
+
+            seen.add(key)
+            cards.append(Card(
+                model=row.model,
+                customer_id=customer_id,
+                customer_name=row.name,
+                card_type="normal",
+                address=row.city,
+                city=row.city,
+                postal_code=DEFAULT_POSTAL_CODE,
+                region=DEFAULT_REGION,
+                date_of_installation=row.installation,
+                warranty_start_date=row.installation,  # warranty same as installation
+                warranty_end_date=row.installation,
+            ))
+
+        if not dry_run:
+            self.create_cards(cards, chunk_size)
+
+        title = "🧪 Dry run, nothing written" if dry_run else "🎉 Bulk import completed"
+        self.stdout.write(self.style.SUCCESS(title))
+        self.stdout.write(f"✔ Customers created: {len(new_keys)}")
+        self.stdout.write(f"✔ Existing customers reused: {existing_user_count}")
+        self.stdout.write(f"✔ Cards created: {len(cards)}")
+        self.stdout.write(f"✔ Duplicate cards skipped: {duplicates}")
+
     # -----------------------------
     # Main
     # -----------------------------
@@ -56,10 +326,17 @@ class Command(BaseCommand):
         file_path = kwargs["file"]
         df = pd.read_excel(file_path)
 
+        self.verbosity = kwargs["verbosity"]
+
+        if kwargs["bulk"] or kwargs["dry_run"]:
+            return self.handle_bulk(df, kwargs["dry_run"], kwargs["chunk_size"])
+
         created_users = 0
         existing_users = 0
         created_cards = 0
 
+        password = make_password(DEFAULT_PASSWORD)  # hashed once, not per created user
+
         for idx, row in df.iterrows():
 
             try:
@@ -83,24 +360,24 @@ class Command(BaseCommand):
                     # -----------------------------
                     # USER
                     # -----------------------------
-                    user_filter = {"phone": phone} if phone else {"name": name}
+                    user_filter = {"phone_normalized": phone} if phone else {"name": name}
 
                     user, created = User.objects.get_or_create(
                         **user_filter,
                         defaults={
+                            "phone": phone,
                             "name": name,
                             "address": city,
                             "city": city,
-                            "postal_code": "626102",
-                            "region": "rajapalayam",
+                            "postal_code": DEFAULT_POSTAL_CODE,
+                            "region": DEFAULT_REGION,
                             "role": "customer",
                             "is_industrial": True, 
+                            "password": password,
                         },
                     )
 
                     if created:
-                        user.set_password("abc12345")
-                        user.save(update_fields=["password"])
                         created_users += 1
                     else:
                         existing_users += 1
@@ -129,8 +406,8 @@ class Command(BaseCommand):
                         card_type="normal",
                         address=city,
                         city=city,
-                        postal_code="626102",
-                        region="rajapalayam",
+                        postal_code=DEFAULT_POSTAL_CODE,
+                        region=DEFAULT_REGION,
                         date_of_installation=installation,
                         warranty_start_date=warranty_start,
                         warranty_end_date=warranty_end,
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.models import ServiceMilestone
+from crm.milestones import match_milestones
+from crm.reports import invalidate_reports, month_starts
+from crm.utils import parse_iso_date
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored done / notdone status of service milestones in a date range"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", type=str, required=True, help="YYYY-MM-DD")
+        parser.add_argument("--to", dest="date_to", type=str, required=True, help="YYYY-MM-DD")
+        parser.add_argument("--region", type=str, help="Only milestones of this region")
+        parser.add_argument("--kind", type=str, choices=["warranty", "amc"])
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **kwargs):
+
+        try:
+            date_from = parse_iso_date(kwargs["date_from"])
+            date_to = parse_iso_date(kwargs["date_to"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        qs = ServiceMilestone.objects.filter(
+            milestone_date__range=(date_from, date_to)
+        ).order_by("id")
+
+        if kwargs.get("region"):
+            qs = qs.filter(region=kwargs["region"])
+
+        if kwargs.get("kind"):
+            qs = qs.filter(kind=kwargs["kind"])
+
+        chunk_size = kwargs["chunk_size"]
+        reconciled = 0
+        last_id = 0
+
+        while True:
+            chunk = list(qs.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+
+            reconciled += match_milestones(chunk)
+            last_id = chunk[-1].id
+
+        # statuses were rewritten with queryset updates: retire the reports
+        months = month_starts(date_from, date_to)
+        for region in qs.order_by().values_list("region", flat=True).distinct():
+            invalidate_reports(region, months)
+
+        done = qs.filter(status="done").count()
+
+        self.stdout.write(self.style.SUCCESS("🎉 Milestone reconcile completed"))
+        self.stdout.write(f"✔ Milestones reconciled: {reconciled}")
+        self.stdout.write(f"✔ Done: {done}")
+        self.stdout.write(f"✔ Not done: {reconciled - done}")
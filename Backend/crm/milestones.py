@@ -0,0 +1,303 @@
+# crm/milestones.py
+from bisect import bisect_left
+from collections import Counter
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+
+from .models import Service, ServiceMilestone
+
+MILESTONE_INTERVAL = relativedelta(months=3)
+
+# a completed free service within +/- 30 days of a milestone marks it done
+MATCH_WINDOW = timedelta(days=30)
+
+# note shown on the report + filter counters bumped, by milestone sequence
+# (after the first year there is no filter change)
+MILESTONE_NOTES = {
+    1: ("Spun Filter Change", ("spun_filter",)),
+    2: ("Spun Filter, Pre Carbon and Sediments Filters", ("spun_filter", "pre_carbon", "sediments")),
+    3: ("Spun Filter Change", ("spun_filter",)),
+    4: ("Post Carbon filter", ("post_carbon",)),
+}
+
+
+def build_milestones(start_date, end_date):
+    """
+    Every 3 months from start_date while before end_date, plus end_date itself.
+    """
+    if not start_date or not end_date:
+        return []
+
+    milestones = []
+    current = start_date + MILESTONE_INTERVAL
+
+    while current < end_date:
+        milestones.append(current)
+        current += MILESTONE_INTERVAL
+
+    if end_date not in milestones:
+        milestones.append(end_date)
+
+    return milestones
+
+
+def card_contract_dates(card):
+    return {
+        "warranty": (card.warranty_start_date, card.warranty_end_date),
+        "amc": (card.amc_start_date, card.amc_end_date),
+    }
+
+
+def milestone_rows(card, kind, start, end, region):
+    return [
+        ServiceMilestone(
+            card=card,
+            kind=kind,
+            region=region,
+            sequence=seq,
+            milestone_date=d,
+        )
+        for seq, d in enumerate(build_milestones(start, end), start=1)
+    ]
+
+
+def new_card_milestones(card):
+    """
+    Unsaved milestone rows of a card that has none yet (bulk imports); with
+    no services there is nothing to match.
+    """
+    region = card.customer.region
+    return [
+        milestone
+        for kind, (start, end) in card_contract_dates(card).items()
+        for milestone in milestone_rows(card, kind, start, end, region)
+    ]
+
+
+def sync_card_milestones(card):
+    """
+    Rebuild the ServiceMilestone rows of a card when its warranty / AMC dates
+    (or its customer's region) no longer match what is stored.
+    """
+    region = card.customer.region
+
+    existing = {}
+    for kind, seq, milestone_date, row_region in card.milestones.values_list(
+        "kind", "sequence", "milestone_date", "region"
+    ):
+        existing.setdefault(kind, []).append((seq, milestone_date, row_region))
+
+    for kind, (start, end) in card_contract_dates(card).items():
+        desired = [
+            (seq, d, region)
+            for seq, d in enumerate(build_milestones(start, end), start=1)
+        ]
+
+        if sorted(existing.get(kind, [])) == desired:
+            continue
+
+        with transaction.atomic():
+            ServiceMilestone.objects.filter(card=card, kind=kind).delete()
+            ServiceMilestone.objects.bulk_create(milestone_rows(card, kind, start, end, region))
+            match_milestones(ServiceMilestone.objects.filter(card=card, kind=kind))
+
+
+def record_service_completion(service):
+    """
+    Mark the card's still-open milestones around a just completed free
+    service as done. Called from the service completion flows.
+    """
+    if service.service_type != "free" or service.status != "completed":
+        return 0
+
+    # reinstall visits complete a parent service, which is what gets matched
+    if service.is_reinstall or not service.scheduled_at:
+        return 0
+
+    d = service.scheduled_at
+
+    updated = ServiceMilestone.objects.filter(
+        card_id=service.card_id,
+        status="notdone",
+        milestone_date__range=(d - MATCH_WINDOW, d + MATCH_WINDOW),
+    ).update(
+        status="done",
+        service=service,
+        staff_id=service.assigned_to_id,
+        scheduled_date=d,
+    )
+
+    if updated:
+        from .reports import invalidate_card_reports
+        invalidate_card_reports(service.card_id)
+
+    return updated
+
+
+def free_services_by_card(region, date_from, date_to, card_ids=None, completed_only=False):
+    """
+    Free services of one region scheduled inside [date_from, date_to], grouped
+    as {card_id: (sorted dates, rows)} so a milestone can be matched with a
+    bisect instead of a scan over all the card's services.
+    """
+    qs = Service.objects.filter(
+        service_type="free",
+        card__customer__region=region,
+        scheduled_at__range=(date_from, date_to),
+    )
+
+    if completed_only:
+        qs = qs.filter(status="completed", is_reinstall=False)
+
+    if card_ids is not None:
+        qs = qs.filter(card_id__in=card_ids)
+
+    rows = qs.order_by("card_id", "scheduled_at", "created_at").values(
+        "id", "card_id", "scheduled_at", "assigned_to_id", "assigned_to__name"
+    )
+
+    by_card = {}
+    for svc in rows:
+        dates, card_rows = by_card.setdefault(svc["card_id"], ([], []))
+        dates.append(svc["scheduled_at"])
+        card_rows.append(svc)
+
+    return by_card
+
+
+def find_service(card_services, milestone_date):
+    """
+    Earliest service within MATCH_WINDOW of milestone_date, or None.
+    `card_services` is one value of free_services_by_card().
+    """
+    if not card_services:
+        return None
+
+    dates, rows = card_services
+    i = bisect_left(dates, milestone_date - MATCH_WINDOW)
+
+    if i < len(dates) and dates[i] <= milestone_date + MATCH_WINDOW:
+        return rows[i]
+
+    return None
+
+
+def match_milestones(milestones):
+    """
+    Recompute the stored status of the given milestones from the completed
+    free services. Used after a rebuild and by the reconcile command.
+    """
+    milestones = list(milestones)
+    if not milestones:
+        return 0
+
+    by_region = {}
+    for m in milestones:
+        by_region.setdefault(m.region, []).append(m)
+
+    for region, region_milestones in by_region.items():
+        dates = [m.milestone_date for m in region_milestones]
+        services = free_services_by_card(
+            region,
+            min(dates) - MATCH_WINDOW,
+            max(dates) + MATCH_WINDOW,
+            card_ids={m.card_id for m in region_milestones},
+            completed_only=True,
+        )
+
+        for m in region_milestones:
+            svc = find_service(services.get(m.card_id), m.milestone_date)
+
+            m.status = "done" if svc else "notdone"
+            m.service_id = svc["id"] if svc else None
+            m.staff_id = svc["assigned_to_id"] if svc else None
+            m.scheduled_date = svc["scheduled_at"] if svc else None
+
+    ServiceMilestone.objects.bulk_update(
+        milestones,
+        ["status", "service", "staff", "scheduled_date"],
+        batch_size=1000,
+    )
+    return len(milestones)
+
+
+def milestone_note(sequence, totals):
+    """
+    Return the filter note for a milestone and count it into `totals`.
+    """
+    note, counters = MILESTONE_NOTES.get(sequence, (None, ()))
+    for key in counters:
+        totals[key] += 1
+    return note
+
+
+def milestone_status(milestone):
+    """
+    (status, staff dict, scheduled date) of a stored milestone, as the
+    reports render them.
+    """
+    if milestone.status != "done":
+        return "notdone", None, None
+
+    staff = {
+        "staff_id": milestone.staff_id,
+        "staff_name": milestone.staff.name if milestone.staff else None,
+    }
+    scheduled_date = milestone.scheduled_date.isoformat() if milestone.scheduled_date else None
+
+    return "done", staff, scheduled_date
+
+
+def empty_totals():
+    return Counter({
+        "spun_filter": 0,
+        "pre_carbon": 0,
+        "sediments": 0,
+        "post_carbon": 0,
+    })
+
+
+def month_milestones(region, kind, first_day, last_day):
+    """
+    Milestones of `kind` falling inside [first_day, last_day] for a region,
+    with card + customer joined, in card / sequence order.
+    """
+    return (
+        ServiceMilestone.objects
+        .select_related("card", "card__customer", "staff")
+        .filter(
+            region=region,
+            kind=kind,
+            milestone_date__range=(first_day, last_day),
+        )
+        .exclude(card__card_type="om")
+        .order_by("card_id", "sequence")
+    )
+
+
+def all_milestones_by_card(card_ids, kind):
+    """
+    {card_id: [iso date, ...]} for every milestone of the given cards.
+    """
+    by_card = {}
+    rows = (
+        ServiceMilestone.objects
+        .filter(card_id__in=card_ids, kind=kind)
+        .order_by("card_id", "sequence")
+        .values_list("card_id", "milestone_date")
+    )
+    for card_id, milestone_date in rows:
+        by_card.setdefault(card_id, []).append(milestone_date.isoformat())
+    return by_card
+
+
+def card_milestones(card, kind, first_day=None, last_day=None):
+    """
+    Stored milestones of one card, optionally limited to a month.
+    """
+    qs = ServiceMilestone.objects.filter(card=card, kind=kind).order_by("sequence")
+    if first_day and last_day:
+        qs = qs.filter(milestone_date__range=(first_day, last_day))
+    return qs
@@ -97,9 +97,36 @@ class Card(models.Model):
     amc_start_date = models.DateField(null=True, blank=True, db_index=True)
     amc_end_date = models.DateField(null=True, blank=True, db_index=True)
 
+    # latest ServiceEntry of a free service (see crm.utils.record_free_service)
+    last_free_service_at = models.DateTimeField(null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # fields the precomputed ServiceMilestone rows depend on
+    MILESTONE_FIELDS = {
+        "customer",
+        "warranty_start_date",
+        "warranty_end_date",
+        "amc_start_date",
+        "amc_end_date",
+    }
+
+    # fields the CardSearchToken rows are built from
+    SEARCH_FIELDS = {"customer", "customer_name", "model"}
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or self.MILESTONE_FIELDS.intersection(update_fields):
+            from .milestones import sync_card_milestones
+            sync_card_milestones(self)
+
+        if update_fields is None or self.SEARCH_FIELDS.intersection(update_fields):
+            from .search import index_card
+            index_card(self)
+
     def __str__(self):
         return f"Card {self.id} - {self.model} ({self.customer_name})"
 
@@ -153,6 +180,8 @@ class Service(models.Model):
             models.Index(fields=["assigned_to", "status"]),
             models.Index(fields=["card", "status"]),
             models.Index(fields=["scheduled_at"]),
+            # export pages walk (created_at, id)
+            models.Index(fields=["created_at", "id"]),
         ]
 
     def __str__(self):
@@ -295,3 +324,252 @@ class IndustrialAMC(models.Model):
 
     def __str__(self):
         return f"Industrial AMC Card {self.card.id} ({self.interval_days} days)"
+
+
+MILESTONE_KIND = (
+    ("warranty", "Warranty"),
+    ("amc", "AMC"),
+)
+
+MILESTONE_STATUS = (
+    ("notdone", "Not Done"),
+    ("done", "Done"),
+)
+
+
+class ServiceMilestone(models.Model):
+    """
+    Precomputed 3-monthly free service milestone of a card's warranty / AMC.
+    Rows are rebuilt by Card.save() whenever the contract dates change, so the
+    monthly reports can read them with a single range query. The done / notdone
+    status is stored too (see crm.milestones.record_service_completion).
+    """
+
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name="milestones")
+    kind = models.CharField(max_length=20, choices=MILESTONE_KIND)
+
+    # copied from card.customer.region (the reports are scoped by customer region)
+    region = models.CharField(max_length=50, choices=REGION_CHOICES)
+
+    sequence = models.PositiveSmallIntegerField()
+    milestone_date = models.DateField()
+
+    # completion, recorded when a free service inside the window is completed
+    status = models.CharField(max_length=20, choices=MILESTONE_STATUS, default="notdone")
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="milestones"
+    )
+    staff = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="completed_milestones"
+    )
+    scheduled_date = models.DateField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["card", "kind", "sequence"]
+        unique_together = ("card", "kind", "sequence")
+        indexes = [
+            models.Index(fields=["region", "kind", "milestone_date"]),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} milestone {self.sequence} - Card {self.card_id} ({self.milestone_date})"
+
+
+REPORT_TYPE = (
+    ("warranty", "Warranty"),
+    ("amc", "AMC"),
+    ("industrial-amc", "Industrial AMC"),
+)
+
+
+class ReportSnapshot(models.Model):
+    """
+    Stored default response of a monthly report for one region, precomputed
+    overnight (crm.tasks.precompute_monthly_reports). A write to the region
+    sets invalidated_at; the snapshot is served only while computed_at is
+    later than that.
+    """
+
+    report_type = models.CharField(max_length=20, choices=REPORT_TYPE)
+    region = models.CharField(max_length=50, choices=REGION_CHOICES)
+    month = models.DateField()  # first day of the month
+
+    data = models.JSONField()
+
+    computed_at = models.DateTimeField()  # when the build started
+    invalidated_at = models.DateTimeField(null=True, blank=True)
+    build_ms = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-month", "region", "report_type"]
+        unique_together = ("report_type", "region", "month")
+
+    def __str__(self):
+        return f"{self.report_type} {self.region} {self.month:%Y-%m} ({self.computed_at:%Y-%m-%d %H:%M})"
+
+
+SEARCH_TOKEN_KIND = (
+    ("name", "Name"),
+    ("model", "Model"),
+    ("phone", "Phone"),
+    ("phone_rev", "Phone (reversed)"),
+)
+
+
+class CardSearchToken(models.Model):
+    """
+    Search index of a card: one row per word of the customer / card name and
+    model, plus the phone digits forward and reversed, so card search is a
+    prefix range scan on `token` (a phone suffix is a prefix of the reversed
+    digits). Rebuilt by Card.save() and on customer changes (crm.search).
+    """
+
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name="search_tokens")
+    region = models.CharField(max_length=50, choices=REGION_CHOICES)  # customer region
+    kind = models.CharField(max_length=20, choices=SEARCH_TOKEN_KIND)
+    token = models.CharField(max_length=32)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = ("card", "kind", "token")
+        indexes = [
+            models.Index(fields=["token", "kind"]),
+            models.Index(fields=["region", "token"]),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.token} - Card {self.card_id}"
+
+
+NOTIFICATION_KIND = (
+    ("otp", "Service OTP"),
+)
+
+NOTIFICATION_STATUS = (
+    ("pending", "Pending"),
+    ("sending", "Sending"),
+    ("sent", "Sent"),
+    ("failed", "Failed"),
+    ("superseded", "Superseded"),  # no longer worth sending, e.g. a newer OTP
+)
+
+
+class NotificationOutbox(models.Model):
+    """
+    Outgoing SMS written in the same transaction as the state it announces
+    (e.g. the service OTP hash) and delivered by a Celery worker
+    (crm.notifications). `next_attempt_at` is when the row may be claimed
+    next: a retry time while pending, a lease while sending.
+    """
+
+    kind = models.CharField(max_length=20, choices=NOTIFICATION_KIND)
+    phone = models.CharField(max_length=20)
+    payload = models.JSONField(default=dict, blank=True)  # cleared once sent / given up
+
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="notifications"
+    )
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="requested_notifications"
+    )
+
+    status = models.CharField(max_length=20, choices=NOTIFICATION_STATUS, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} to {self.phone} ({self.status})"
+
+
+EXPORT_KIND = (
+    ("services", "Services"),
+    ("cards", "Cards"),
+    ("job-cards", "Job cards"),
+    ("attendance", "Attendance"),
+    ("warranty", "Warranty report"),
+    ("amc", "AMC report"),
+    ("industrial-amc", "Industrial AMC report"),
+)
+
+EXPORT_FORMAT = (
+    ("csv", "CSV"),
+    ("xlsx", "Excel"),
+    ("parquet", "Parquet"),
+)
+
+EXPORT_STATUS = (
+    ("pending", "Pending"),
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"),
+    ("expired", "Expired"),  # file deleted after CRM_EXPORT_RETENTION_DAYS
+)
+
+
+class ExportJob(models.Model):
+    """
+    An admin data export written to MEDIA_ROOT by a Celery worker
+    (crm.exports), so large pulls never run inside a request. `params`
+    holds the export's filters (from / to, month).
+    """
+
+    kind = models.CharField(max_length=20, choices=EXPORT_KIND)
+    format = models.CharField(max_length=10, choices=EXPORT_FORMAT, default="csv")
+    region = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="export_jobs"
+    )
+
+    status = models.CharField(max_length=20, choices=EXPORT_STATUS, default="pending")
+    rows = models.PositiveIntegerField(default=0)
+    file = models.FileField(upload_to="exports/", null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.kind} export ({self.format}, {self.status})"
@@ -0,0 +1,181 @@
+# crm/notifications.py
+"""
+Transactional outbox for outgoing SMS.
+
+The view writes a NotificationOutbox row inside the transaction that stores
+the state being announced, and enqueues its delivery on commit. A worker
+claims the row (a conditional UPDATE, so a row is never sent twice in
+parallel), calls the provider and records the outcome. Failures are retried
+with exponential backoff; rows whose task was lost are picked up again by
+the periodic drain task.
+
+The payload (the plaintext OTP) only lives until the row is sent, given up
+or superseded: a newer OTP of the service supersedes the queued ones, and
+every attempt first checks the OTP is still the service's current one.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from utils.msg91 import send_otp
+
+from .models import NotificationOutbox
+from .utils import verify_otp_hash
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, "CRM_NOTIFICATION_MAX_ATTEMPTS", 5)
+RETRY_BACKOFF = getattr(settings, "CRM_NOTIFICATION_RETRY_BACKOFF", 30)  # seconds, doubled per attempt
+SEND_LEASE = timedelta(seconds=getattr(settings, "CRM_NOTIFICATION_SEND_LEASE", 120))
+
+
+def send_otp_notification(outbox):
+    send_otp(outbox.phone, outbox.payload["otp"])
+
+
+def otp_is_current(outbox):
+    # not verified, expired or replaced by a newer OTP since it was queued
+    service = outbox.service
+    otp = outbox.payload.get("otp")
+
+    return bool(
+        service is not None
+        and otp
+        and service.otp_hash
+        and service.otp_expires_at
+        and service.otp_expires_at > timezone.now()
+        and verify_otp_hash(otp, service.otp_hash)
+    )
+
+
+# kind -> sender(outbox)
+SENDERS = {
+    "otp": send_otp_notification,
+}
+
+# kind -> whether the row is still worth sending
+IS_CURRENT = {
+    "otp": otp_is_current,
+}
+
+
+def notification_region(outbox):
+    if outbox.service_id:
+        return outbox.service.card.customer.region
+    if outbox.requested_by_id:
+        return outbox.requested_by.region
+    return None
+
+
+def queue_notification(kind, phone, payload, service=None, requested_by=None):
+    """
+    Store a notification and enqueue its delivery once the surrounding
+    transaction commits.
+    """
+    from .tasks import deliver_notification
+
+    if service is not None:
+        # the queued ones would only deliver a code that no longer verifies
+        NotificationOutbox.objects.filter(
+            kind=kind, service=service, status="pending"
+        ).update(status="superseded", payload={})
+
+    outbox = NotificationOutbox.objects.create(
+        kind=kind,
+        phone=phone,
+        payload=payload,
+        service=service,
+        requested_by=requested_by,
+    )
+    transaction.on_commit(lambda: deliver_notification.delay(outbox.id))
+    return outbox
+
+
+def retry_delay(attempts):
+    return RETRY_BACKOFF * 2 ** max(attempts - 1, 0)
+
+
+def claim(outbox_id):
+    """
+    Take the row for one attempt, or None when it is sent, failed,
+    superseded, or already being sent / not due yet.
+    """
+    now = timezone.now()
+
+    claimed = NotificationOutbox.objects.filter(
+        pk=outbox_id,
+        status__in=("pending", "sending"),
+        next_attempt_at__lte=now,
+    ).update(
+        status="sending",
+        attempts=F("attempts") + 1,
+        next_attempt_at=now + SEND_LEASE,
+    )
+    if not claimed:
+        return None
+
+    return NotificationOutbox.objects.select_related("service").get(pk=outbox_id)
+
+
+def deliver(outbox_id):
+    """
+    One delivery attempt. Returns the delay (seconds) before the next try,
+    or None when there is nothing more to do.
+    """
+    outbox = claim(outbox_id)
+    if outbox is None:
+        return None
+
+    is_current = IS_CURRENT.get(outbox.kind)
+    if is_current is not None and not is_current(outbox):
+        logger.info("Notification %s superseded, not sent", outbox.id)
+        NotificationOutbox.objects.filter(pk=outbox.id).update(
+            status="superseded",
+            payload={},
+        )
+        return None
+
+    try:
+        SENDERS[outbox.kind](outbox)
+
+    except Exception as e:
+        logger.warning(
+            "Notification %s attempt %s failed: %s", outbox.id, outbox.attempts, e
+        )
+
+        if outbox.attempts >= MAX_ATTEMPTS:
+            NotificationOutbox.objects.filter(pk=outbox.id).update(
+                status="failed",
+                last_error=str(e),
+                payload={},
+            )
+            return None
+
+        delay = retry_delay(outbox.attempts)
+        NotificationOutbox.objects.filter(pk=outbox.id).update(
+            status="pending",
+            last_error=str(e),
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+        )
+        return delay
+
+    NotificationOutbox.objects.filter(pk=outbox.id).update(
+        status="sent",
+        sent_at=timezone.now(),
+        last_error="",
+        payload={},
+    )
+    return None
+
+
+def due_notification_ids(limit=500):
+    return list(
+        NotificationOutbox.objects
+        .filter(status__in=("pending", "sending"), next_attempt_at__lte=timezone.now())
+        .order_by("next_attempt_at")
+        .values_list("id", flat=True)[:limit]
+    )
@@ -0,0 +1,748 @@
+# crm/reports.py
+"""
+Row builders, cursor pagination and NDJSON streaming for the monthly
+warranty / AMC / industrial AMC reports.
+
+By default the report views keep returning one flat row per milestone with
+the card's full `allmilestones` array repeated on every row. With `?cursor=`
+or `?page_size=` they return pages of cards instead, and with `?stream=1`
+they stream one NDJSON line per card. In both modes each card carries its
+`allmilestones` once and the month's milestone rows under `milestones`.
+
+Non-streamed responses are cached per (report, region, month) in the
+`CRM_REPORT_CACHE_ALIAS` cache and served with ETag / Last-Modified. A
+Card / Service / IndustrialAMC write bumps the version of the months the
+card appears in (see crm/signals.py), which retires the cached reports and
+snapshots of those months only. The write is also recorded on the month's
+ReportSnapshot (invalidated_at), which is part of the cache key, so a
+per-process cache never serves another worker's stale report.
+
+The default response of each report is also stored as a ReportSnapshot,
+precomputed nightly for the current and next month (crm.tasks), so a cold
+cache is filled from the database instead of rebuilding the report. When a
+write retires one of those snapshots, a worker rebuilds it shortly after
+(crm.tasks.refresh_report_snapshots). `?fresh=1` rebuilds it synchronously.
+"""
+import base64
+import hashlib
+import json
+import time
+from calendar import monthrange
+from collections import Counter
+from datetime import timedelta
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.utils.urls import replace_query_param
+
+from .milestones import (
+    MATCH_WINDOW,
+    MILESTONE_NOTES,
+    all_milestones_by_card,
+    empty_totals,
+    find_service,
+    free_services_by_card,
+    milestone_note,
+    milestone_status,
+    month_milestones,
+)
+from .models import Card, IndustrialAMC, ReportSnapshot, ServiceMilestone
+
+REPORT_PAGE_SIZE = getattr(settings, "CRM_REPORT_PAGE_SIZE", 200)
+REPORT_MAX_PAGE_SIZE = getattr(settings, "CRM_REPORT_MAX_PAGE_SIZE", 1000)
+
+# cards whose allmilestones are fetched together while streaming
+STREAM_BATCH_SIZE = 200
+
+REPORT_CACHE_ALIAS = getattr(settings, "CRM_REPORT_CACHE_ALIAS", "reports")
+REPORT_CACHE_TIMEOUT = getattr(settings, "CRM_REPORT_CACHE_TIMEOUT", 5 * 60)
+
+# seconds between a write and the background rebuild of the snapshots it retired
+REPORT_REFRESH_DELAY = getattr(settings, "CRM_REPORT_REFRESH_DELAY", 60)
+
+# months of snapshots kept before the current one (older are pruned nightly)
+REPORT_SNAPSHOT_MONTHS = getattr(settings, "CRM_REPORT_SNAPSHOT_MONTHS", 12)
+
+CARD_FIELDS = (
+    "card_id",
+    "card_model",
+    "customer_id",
+    "customer_name",
+    "customer_phone",
+    "address",
+    "city",
+)
+
+INDUSTRIAL_AMC_FIELDS = CARD_FIELDS + (
+    "interval_days",
+    "is_with_spare",
+    "spares",
+)
+
+
+# -----------------------------
+# Request helpers
+# -----------------------------
+def wants_stream(request):
+    return request.query_params.get("stream") in ("1", "true")
+
+
+def wants_pages(request):
+    return "cursor" in request.query_params or "page_size" in request.query_params
+
+
+def get_page_size(request):
+    try:
+        size = int(request.query_params.get("page_size", REPORT_PAGE_SIZE))
+        if size < 1:
+            raise ValueError
+    except ValueError:
+        raise ValidationError({"page_size": "Expected a positive integer"})
+    return min(size, REPORT_MAX_PAGE_SIZE)
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(f"p={position}".encode()).decode()
+
+
+def decode_cursor(request):
+    """
+    Position (card / AMC id) the page starts after, 0 for the first page.
+    """
+    cursor = request.query_params.get("cursor")
+    if not cursor:
+        return 0
+
+    try:
+        key, value = base64.urlsafe_b64decode(cursor.encode()).decode().split("=", 1)
+        if key != "p":
+            raise ValueError
+        return int(value)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValidationError({"cursor": "Invalid cursor"})
+
+
+def next_page_url(request, position):
+    if position is None:
+        return None
+    return replace_query_param(request.build_absolute_uri(), "cursor", encode_cursor(position))
+
+
+# -----------------------------
+# Rows
+# -----------------------------
+def milestone_row(milestone, note_key, totals):
+    """
+    One warranty / AMC report row (without `allmilestones`).
+    """
+    c = milestone.card
+    status, done_staff, scheduled_date = milestone_status(milestone)
+
+    return {
+        "card_id": c.id,
+        "card_model": c.model,
+        "customer_id": c.customer.id,
+        "customer_name": c.customer.name,
+        "customer_phone": c.customer.phone,
+        "address": c.address,
+        "city": c.city,
+        "milestone": milestone.milestone_date.isoformat(),
+        "status": status,
+        "staff": done_staff,
+        "scheduled_date": scheduled_date,
+        note_key: milestone_note(milestone.sequence, totals),
+    }
+
+
+def month_totals(milestones):
+    """
+    summary_totals of a month's milestone queryset, counted in the database.
+    """
+    totals = empty_totals()
+    counts = milestones.order_by().values("sequence").annotate(n=Count("id"))
+
+    for row in counts:
+        _, counters = MILESTONE_NOTES.get(row["sequence"], (None, ()))
+        for key in counters:
+            totals[key] += row["n"]
+
+    return totals
+
+
+def group_by_card(rows, allmilestones, fields=CARD_FIELDS):
+    """
+    Fold consecutive rows of the same card into one item carrying the card
+    fields and `allmilestones` once, and the rows under `milestones`.
+    """
+    for card_id, card_rows in groupby(rows, key=lambda r: r["card_id"]):
+        card_rows = list(card_rows)
+
+        item = {key: card_rows[0][key] for key in fields}
+        item["allmilestones"] = allmilestones.get(card_id, [])
+        item["milestones"] = [
+            {k: v for k, v in row.items() if k not in fields}
+            for row in card_rows
+        ]
+        yield item
+
+
+def industrial_amc_milestones(amc):
+    milestones = []
+
+    current = amc.start_date + timedelta(days=amc.interval_days)
+
+    while current <= amc.end_date:
+        milestones.append(current)
+        current += timedelta(days=amc.interval_days)
+
+    return milestones
+
+
+def industrial_amc_rows(amc, service_map, first_day, last_day):
+    """
+    (rows of the month, all milestone dates) of one industrial AMC.
+    """
+    # Skip invalid interval
+    if not amc.interval_days:
+        return [], []
+
+    milestones = industrial_amc_milestones(amc)
+    services = service_map.get(amc.card.id)
+
+    rows = []
+
+    for m in milestones:
+
+        if not (first_day <= m <= last_day):
+            continue
+
+        status = "notdone"
+        done_staff = None
+        scheduled_date = None
+
+        # bisect on the card's sorted service dates
+        svc = find_service(services, m)
+
+        if svc:
+            status = "done"
+            scheduled_date = svc["scheduled_at"].isoformat()
+
+            done_staff = {
+                "staff_id": svc["assigned_to_id"],
+                "staff_name": svc["assigned_to__name"],
+            }
+
+        rows.append({
+            "card_id": amc.card.id,
+            "card_model": amc.card.model,
+
+            "customer_id": amc.card.customer.id,
+            "customer_name": amc.card.customer.name,
+            "customer_phone": amc.card.customer.phone,
+
+            "address": amc.card.address,
+            "city": amc.card.city,
+
+            "interval_days": amc.interval_days,
+            "is_with_spare": amc.is_with_spare,
+            "spares": amc.spares or [],
+
+            "milestone": m.isoformat(),
+            "status": status,
+            "staff": done_staff,
+            "scheduled_date": scheduled_date,
+        })
+
+    return rows, [d.isoformat() for d in milestones]
+
+
+# -----------------------------
+# Report data (default response shape)
+# -----------------------------
+def warranty_milestones(region, first_day, last_day):
+    return month_milestones(region, "warranty", first_day, last_day)
+
+
+def amc_milestones(region, first_day, last_day):
+    return month_milestones(
+        region, "amc", first_day, last_day
+    ).exclude(card__customer__is_industrial=True)
+
+
+def industrial_amcs(region):
+    return IndustrialAMC.objects.select_related(
+        "card",
+        "card__customer"
+    ).filter(
+        card__customer__region=region
+    )
+
+
+def industrial_service_map(region, first_day, last_day):
+    # only the free services that can match a milestone of the month
+    return free_services_by_card(
+        region,
+        first_day - MATCH_WINDOW,
+        last_day + MATCH_WINDOW,
+    )
+
+
+def milestone_report_data(milestones, kind, note_key):
+    totals = empty_totals()
+
+    # status is stored when the free service is completed
+    results = [milestone_row(m, note_key, totals) for m in milestones]
+
+    allmilestones = all_milestones_by_card({r["card_id"] for r in results}, kind)
+    for row in results:
+        row["allmilestones"] = allmilestones.get(row["card_id"], [])
+
+    return {
+        "report_data": results,
+        "summary_totals": totals
+    }
+
+
+def warranty_report_data(region, first_day, last_day):
+    return milestone_report_data(
+        warranty_milestones(region, first_day, last_day), "warranty", "warranty_note"
+    )
+
+
+def amc_report_data(region, first_day, last_day):
+    return milestone_report_data(
+        amc_milestones(region, first_day, last_day), "amc", "amc_note"
+    )
+
+
+def industrial_amc_report_data(region, first_day, last_day):
+    service_map = industrial_service_map(region, first_day, last_day)
+    results = []
+
+    for amc in industrial_amcs(region):
+        rows, allmilestones = industrial_amc_rows(amc, service_map, first_day, last_day)
+
+        for row in rows:
+            row["allmilestones"] = allmilestones
+            results.append(row)
+
+    return results
+
+
+# report_type -> builder(region, first_day, last_day) of the default response
+REPORT_BUILDERS = {
+    "warranty": warranty_report_data,
+    "amc": amc_report_data,
+    "industrial-amc": industrial_amc_report_data,
+}
+
+
+# -----------------------------
+# Paginated / streamed responses
+# -----------------------------
+def ndjson_response(lines):
+    encoder = DjangoJSONEncoder()
+    return StreamingHttpResponse(
+        (encoder.encode(line) + "\n" for line in lines),
+        content_type="application/x-ndjson",
+    )
+
+
+def paginated_milestone_report(request, milestones, kind, note_key):
+    """
+    One page of cards (keyset on card_id) of a warranty / AMC month.
+    """
+    after = decode_cursor(request)
+    size = get_page_size(request)
+
+    card_ids = list(
+        milestones
+        .filter(card_id__gt=after)
+        .order_by("card_id")
+        .values_list("card_id", flat=True)
+        .distinct()[:size + 1]
+    )
+    has_next = len(card_ids) > size
+    card_ids = card_ids[:size]
+
+    rows = [
+        milestone_row(m, note_key, Counter())
+        for m in milestones.filter(card_id__in=card_ids)
+    ]
+
+    return Response({
+        "next": next_page_url(request, card_ids[-1] if has_next else None),
+        "results": list(group_by_card(rows, all_milestones_by_card(card_ids, kind))),
+        "summary_totals": month_totals(milestones),
+    })
+
+
+def streamed_milestone_report(milestones, kind, note_key):
+    """
+    NDJSON: one line per card, then a final {"summary_totals": ...} line.
+    """
+    def lines():
+        totals = empty_totals()
+        rows = (
+            milestone_row(m, note_key, totals)
+            for m in milestones.iterator(chunk_size=2000)
+        )
+        cards = (
+            (card_id, list(card_rows))
+            for card_id, card_rows in groupby(rows, key=lambda r: r["card_id"])
+        )
+
+        while True:
+            batch = list(islice(cards, STREAM_BATCH_SIZE))
+            if not batch:
+                break
+
+            batch_rows = [row for _, card_rows in batch for row in card_rows]
+            allmilestones = all_milestones_by_card([card_id for card_id, _ in batch], kind)
+            yield from group_by_card(batch_rows, allmilestones)
+
+        yield {"summary_totals": totals}
+
+    return ndjson_response(lines())
+
+
+def industrial_amc_items(amcs, service_map, first_day, last_day):
+    """
+    (amc id, card item) of every AMC with a milestone in the month.
+    """
+    for amc in amcs:
+        rows, allmilestones = industrial_amc_rows(amc, service_map, first_day, last_day)
+        if not rows:
+            continue
+
+        item = next(group_by_card(rows, {amc.card.id: allmilestones}, INDUSTRIAL_AMC_FIELDS))
+        item["amc_id"] = amc.id
+        yield amc.id, item
+
+
+def paginated_industrial_amc_report(request, amcs, service_map, first_day, last_day):
+    """
+    One page of industrial AMCs (keyset on AMC id) having a milestone in the month.
+    """
+    after = decode_cursor(request)
+    size = get_page_size(request)
+
+    items = industrial_amc_items(
+        amcs.filter(id__gt=after).order_by("id").iterator(chunk_size=500),
+        service_map,
+        first_day,
+        last_day,
+    )
+    page = list(islice(items, size + 1))
+    has_next = len(page) > size
+    page = page[:size]
+
+    return Response({
+        "next": next_page_url(request, page[-1][0] if has_next else None),
+        "results": [item for _, item in page],
+    })
+
+
+def streamed_industrial_amc_report(amcs, service_map, first_day, last_day):
+    items = industrial_amc_items(
+        amcs.order_by("id").iterator(chunk_size=500),
+        service_map,
+        first_day,
+        last_day,
+    )
+    return ndjson_response(item for _, item in items)
+
+
+# -----------------------------
+# Snapshot cache
+# -----------------------------
+def report_cache():
+    return caches[REPORT_CACHE_ALIAS]
+
+
+def region_version_key(region):
+    return f"crm-report-version:{region}"
+
+
+def month_version_key(region, first_day):
+    return f"crm-report-version:{region}:{first_day:%Y-%m}"
+
+
+def cache_version(key):
+    cache = report_cache()
+
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time(), None)
+        version = cache.get(key)
+
+    return version
+
+
+def report_version(region, first_day):
+    """
+    Times (epoch seconds) of the last region-wide write and of the last
+    write affecting the month, as (region, month).
+    """
+    return (
+        cache_version(region_version_key(region)),
+        cache_version(month_version_key(region, first_day)),
+    )
+
+
+def stored_version(report_type, region, first_day):
+    """
+    Time (epoch seconds) of the last write recorded on the month's
+    ReportSnapshot, 0 when none was, or None when the snapshot does not
+    exist. Unlike the cache versions this is seen by every process, even
+    with a per-process cache.
+    """
+    stored = list(
+        ReportSnapshot.objects
+        .filter(report_type=report_type, region=region, month=first_day)
+        .values_list("invalidated_at", flat=True)[:1]
+    )
+    if not stored:
+        return None
+    return stored[0].timestamp() if stored[0] else 0
+
+
+def month_starts(start, end):
+    """
+    First day of every month from start's month to end's month.
+    """
+    months = []
+    current = start.replace(day=1)
+    while current <= end:
+        months.append(current)
+        current = (current + timedelta(days=32)).replace(day=1)
+    return months
+
+
+def card_report_months(card_id, extra_ranges=()):
+    """
+    First days of the months whose reports can show the card: the months of
+    its milestones and of its industrial AMCs, plus `extra_ranges` of
+    (start, end) dates (e.g. contract dates not yet synced to milestones).
+    """
+    months = set(
+        ServiceMilestone.objects.filter(card_id=card_id).dates("milestone_date", "month")
+    )
+
+    ranges = IndustrialAMC.objects.filter(card_id=card_id).values_list("start_date", "end_date")
+    for start, end in [*ranges, *extra_ranges]:
+        if start and end:
+            months.update(month_starts(start, end))
+
+    return months
+
+
+def invalidate_reports(region, months):
+    """
+    Retire the cached reports and snapshots of some months of a region.
+    """
+    months = set(months)
+    if not region or not months:
+        return
+
+    now = time.time()
+    report_cache().set_many({month_version_key(region, m): now for m in months}, None)
+
+    retired = ReportSnapshot.objects.filter(region=region, month__in=months).update(
+        invalidated_at=timezone.now()
+    )
+    if retired:
+        schedule_snapshot_refresh(region, months)
+
+
+def report_months(today):
+    """
+    First day of the current and of the next month: the precomputed ones.
+    """
+    current = today.replace(day=1)
+    next_month = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return [current, next_month]
+
+
+def schedule_snapshot_refresh(region, months):
+    """
+    Queue a rebuild of the retired snapshots of the precomputed months,
+    REPORT_REFRESH_DELAY seconds after the commit. A burst of writes to
+    the same month queues one rebuild.
+    """
+    from .tasks import refresh_report_snapshots
+
+    for first_day in set(months) & set(report_months(timezone.localdate())):
+        key = f"crm-report-refresh:{region}:{first_day:%Y-%m}"
+
+        if report_cache().add(key, 1, REPORT_REFRESH_DELAY):
+            transaction.on_commit(
+                lambda month=first_day.isoformat(): refresh_report_snapshots.apply_async(
+                    (region, month), countdown=REPORT_REFRESH_DELAY
+                )
+            )
+
+
+def invalidate_card_reports(card_id, region=None, extra_ranges=()):
+    """
+    Retire the reports the card appears in. Called by the Card / Service /
+    IndustrialAMC signals and by writes that bypass them (queryset updates).
+    """
+    if region is None:
+        region = (
+            Card.objects.filter(pk=card_id)
+            .values_list("customer__region", flat=True)
+            .first()
+        )
+    if region:
+        invalidate_reports(region, card_report_months(card_id, extra_ranges))
+
+
+def invalidate_region_reports(region):
+    """
+    Retire every report of the region (e.g. cards moved to another region).
+    """
+    if not region:
+        return
+
+    report_cache().set(region_version_key(region), time.time(), None)
+    ReportSnapshot.objects.filter(region=region).update(invalidated_at=timezone.now())
+
+
+def prune_snapshots(keep_months=REPORT_SNAPSHOT_MONTHS):
+    """
+    Delete the snapshots of months older than `keep_months` months; they
+    are rebuilt on demand if requested again.
+    """
+    first = timezone.localdate().replace(day=1)
+    for _ in range(keep_months):
+        first = (first - timedelta(days=1)).replace(day=1)
+
+    deleted, _ = ReportSnapshot.objects.filter(month__lt=first).delete()
+    return deleted
+
+
+def wants_fresh(request):
+    return request.query_params.get("fresh") in ("1", "true")
+
+
+def valid_snapshot(report_type, region, first_day):
+    """
+    Stored data of the precomputed report, or None when it is missing or a
+    write happened after it was computed.
+    """
+    snapshot = (
+        ReportSnapshot.objects
+        .filter(report_type=report_type, region=region, month=first_day)
+        .filter(Q(invalidated_at__isnull=True) | Q(computed_at__gt=F("invalidated_at")))
+        .only("data")
+        .first()
+    )
+    return snapshot.data if snapshot else None
+
+
+def refresh_snapshot(report_type, region, first_day):
+    """
+    Rebuild and store the default response of one report, returning
+    (data, build time in ms).
+    """
+    last_day = first_day.replace(day=monthrange(first_day.year, first_day.month)[1])
+
+    computed_at = timezone.now()
+    started = time.perf_counter()
+
+    data = REPORT_BUILDERS[report_type](region, first_day, last_day)
+    # stored as JSON, read back the same way
+    data = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+    build_ms = int((time.perf_counter() - started) * 1000)
+
+    ReportSnapshot.objects.update_or_create(
+        report_type=report_type,
+        region=region,
+        month=first_day,
+        defaults={
+            "data": data,
+            "computed_at": computed_at,
+            "build_ms": build_ms,
+        },
+    )
+    return data, build_ms
+
+
+def cached_report_response(request, report_type, first_day, build):
+    """
+    Serve `build()` (a view body returning a Response) from the snapshot
+    cache, answering 304 when the client's ETag / Last-Modified still match.
+    Streamed responses are never cached.
+
+    The default variant (no cursor / page_size) is read from the nightly
+    ReportSnapshot when the cache is cold; `?fresh=1` recomputes it
+    synchronously and refreshes both.
+    """
+    if wants_stream(request):
+        return build()
+
+    region = request.user.region
+    default_variant = not wants_pages(request)
+    fresh = wants_fresh(request)
+
+    region_v, month_v = report_version(region, first_day)
+    # the cache versions only see this process's writes with a local cache
+    stored_v = stored_version(report_type, region, first_day)
+
+    variant = "{}:{}".format(
+        request.query_params.get("cursor", ""),
+        request.query_params.get("page_size", ""),
+    )
+    key = f"crm-report:{report_type}:{region}:{first_day:%Y-%m}:{variant}:{region_v}:{month_v}:{stored_v}"
+
+    etag = '"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+    last_modified = int(max(region_v, month_v, stored_v or 0))
+
+    if not fresh:
+        not_modified = get_conditional_response(
+            request._request,
+            etag=etag,
+            last_modified=last_modified,
+        )
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+
+    cache = report_cache()
+    data = None if fresh else cache.get(key)
+
+    if data is None and default_variant and not fresh:
+        data = valid_snapshot(report_type, region, first_day)
+
+    if data is None:
+        if default_variant:
+            data, _ = refresh_snapshot(report_type, region, first_day)
+        else:
+            response = build()
+            if response.status_code != 200:
+                return response
+            data = response.data
+
+    # without a snapshot no other process can record its writes, so nothing
+    # is cached until the month's default report has been built once
+    if stored_v is not None:
+        cache.set(key, data, REPORT_CACHE_TIMEOUT)
+
+    response = Response(data)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+
+    return response
@@ -0,0 +1,215 @@
+# crm/search.py
+"""
+Card search backed by the CardSearchToken table.
+
+Every term of `?search=` must match a token of the card by prefix: a word of
+the customer / card name or model, or the phone digits (a prefix of the
+national number or, reversed, a suffix of it; a full number matches however
+its country code was written). Matches are ranked by token weight,
+with a bonus for whole-word hits, all inside one grouped query on the
+indexed `token` column instead of `LIKE '%...%'` scans over the joins.
+"""
+import re
+from functools import reduce
+from operator import and_, or_
+
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Card, CardSearchToken
+
+TOKEN_LENGTH = 32
+MAX_TERMS = 5
+
+# rank of a matching token, by kind
+TOKEN_WEIGHTS = {
+    "phone": 5,
+    "phone_rev": 5,
+    "name": 3,
+    "model": 2,
+}
+
+WORD_RE = re.compile(r"\w+")
+PHONE_QUERY_RE = re.compile(r"[\d\s+()-]+")
+
+
+def words(text):
+    return {w[:TOKEN_LENGTH] for w in WORD_RE.findall((text or "").lower())}
+
+
+def phone_digits(phone):
+    return re.sub(r"\D", "", phone or "")
+
+
+def card_tokens(card):
+    """
+    {(kind, token)} the card should be findable by.
+    """
+    customer = card.customer
+    tokens = set()
+
+    for w in words(card.customer_name) | words(customer.name):
+        tokens.add(("name", w))
+
+    for w in words(card.model):
+        tokens.add(("model", w))
+
+    digits = phone_digits(customer.phone)
+    if digits:
+        # national number for prefix search, all digits reversed for suffix search
+        tokens.add(("phone", digits[-10:]))
+        tokens.add(("phone_rev", digits[::-1][:TOKEN_LENGTH]))
+
+    return tokens
+
+
+def token_rows(card, tokens, region):
+    return [
+        CardSearchToken(
+            card=card,
+            region=region,
+            kind=kind,
+            token=token,
+            weight=TOKEN_WEIGHTS[kind],
+        )
+        for kind, token in tokens
+    ]
+
+
+def index_card(card):
+    """
+    Rebuild the search tokens of a card when they changed.
+    """
+    region = card.customer.region
+    desired = card_tokens(card)
+
+    existing = {}
+    for pk, kind, token, row_region in card.search_tokens.values_list("id", "kind", "token", "region"):
+        existing[(kind, token)] = (pk, row_region)
+
+    stale = [
+        pk for key, (pk, row_region) in existing.items()
+        if key not in desired or row_region != region
+    ]
+    missing = [
+        key for key in desired
+        if key not in existing or existing[key][1] != region
+    ]
+
+    if not stale and not missing:
+        return
+
+    with transaction.atomic():
+        CardSearchToken.objects.filter(pk__in=stale).delete()
+        CardSearchToken.objects.bulk_create(token_rows(card, missing, region))
+
+
+def index_customer_cards(user):
+    for card in Card.objects.select_related("customer").filter(customer=user):
+        index_card(card)
+
+
+def phone_term(digits):
+    # like phone_lookup: a full number (with or without country code / trunk
+    # 0) is matched on its national part, the way the "phone" token is stored
+    return digits[-10:] if len(digits) >= 10 else digits
+
+
+def query_terms(query):
+    # "+91 98765 43210" is one phone number, not three terms
+    if PHONE_QUERY_RE.fullmatch(query.strip()):
+        digits = phone_digits(query)
+        return [phone_term(digits)] if digits else []
+
+    return sorted(words(query), key=len, reverse=True)[:MAX_TERMS]
+
+
+def term_filter(term):
+    if term.isdigit():
+        return (
+            Q(kind="phone", token__startswith=term)
+            | Q(kind="phone_rev", token__startswith=term[::-1])
+        )
+    return Q(kind__in=("name", "model"), token__startswith=term)
+
+
+def rank_expression(terms):
+    # token weights, whole-word hits counted twice
+    return Sum("weight") + Coalesce(Sum("weight", filter=Q(token__in=terms)), Value(0))
+
+
+def matching_card_ids(terms, filters, region=None):
+    """
+    ids of the cards having a token for every term (one grouped scan of the
+    (region, token) index).
+    """
+    tokens = CardSearchToken.objects.filter(reduce(or_, filters))
+    if region:
+        tokens = tokens.filter(region=region)
+
+    per_term = {f"term_{i}": Count("id", filter=f) for i, f in enumerate(filters)}
+
+    return (
+        tokens
+        .values("card_id")
+        .annotate(**per_term)
+        .filter(reduce(and_, (Q(**{f"{name}__gt": 0}) for name in per_term)))
+        .values("card_id")
+    )
+
+
+def search_cards(queryset, query, region=None):
+    """
+    Narrow a Card queryset to the matches of `query`, annotated with
+    `search_rank` (higher is better).
+    """
+    terms = query_terms(query)
+    if not terms:
+        return queryset
+
+    filters = [term_filter(t) for t in terms]
+
+    # per card, so it is a lookup on the (card, kind, token) unique index
+    rank = (
+        CardSearchToken.objects
+        .filter(card_id=OuterRef("pk"))
+        .filter(reduce(or_, filters))
+        .values("card_id")
+        .annotate(score=rank_expression(terms))
+        .values("score")[:1]
+    )
+
+    return queryset.filter(
+        id__in=matching_card_ids(terms, filters, region)
+    ).annotate(
+        search_rank=Subquery(rank, output_field=IntegerField())
+    )
+
+
+class CardSearchFilter(BaseFilterBackend):
+    """
+    `?search=` over the card search index, best matches first.
+    Admins search only their region's part of the index.
+    """
+    search_param = "search"
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, "")
+        if not query.strip():
+            return queryset
+
+        user = request.user
+        region = user.region if getattr(user, "role", None) == "admin" else None
+
+        return search_cards(queryset, query, region).order_by("-search_rank", "-id")
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            "name": self.search_param,
+            "required": False,
+            "in": "query",
+            "description": "Customer name, card model or phone digits (prefix / suffix)",
+            "schema": {"type": "string"},
+        }]
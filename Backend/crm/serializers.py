@@ -29,6 +29,7 @@ class CardSerializer(serializers.ModelSerializer):
             "customer_id",
             "customer_name",
             "customer_phone",
+            "last_free_service_at",  # kept by the service completion flows
         )
 
 class CardCreateSerializer(serializers.ModelSerializer):
@@ -172,6 +173,36 @@ class JobCardSerializer(serializers.ModelSerializer):
 
 
 
+class JobCardSummarySerializer(serializers.ModelSerializer):
+    """
+    Flat job card for list screens (?view=summary): no image URL.
+    """
+    service_status = serializers.CharField(source="service.status", read_only=True)
+    customer_name = serializers.CharField(source="customer.name", read_only=True, default=None)
+    customer_phone = serializers.CharField(source="customer.phone", read_only=True, default=None)
+    staff_name = serializers.CharField(source="staff.name", read_only=True, default=None)
+    reinstall_staff_name = serializers.CharField(source="reinstall_staff.name", read_only=True, default=None)
+
+    class Meta:
+        model = JobCard
+        fields = [
+            "id",
+            "service",
+            "service_status",
+            "staff",
+            "staff_name",
+            "reinstall_staff",
+            "reinstall_staff_name",
+            "customer_name",
+            "customer_phone",
+            "part_name",
+            "serial_number",
+            "status",
+            "created_at",
+        ]
+        read_only_fields = fields
+
+
 class ServiceEntrySerializer(serializers.ModelSerializer):
     performed_by = serializers.PrimaryKeyRelatedField(read_only=True)
     job_cards = JobCardSerializer(many=True, read_only=True)
@@ -290,7 +321,9 @@ from django.utils import timezone
 from django.conf import settings
 from datetime import date as _date
 
-from .models import Service, ServiceEntry
+from django.db.models import Prefetch
+
+from .models import Service, ServiceEntry, Feedback, JobCard
 from user.models import User
 
 BOOKING_WINDOW_DAYS = getattr(settings, "CRM_BOOKING_WINDOW_DAYS", 30)
@@ -326,12 +359,36 @@ class ServiceSerializer(serializers.ModelSerializer):
             "entries", "feedback", "otp_phone", "otp_requested_at", "otp_requested_location", "created_at",
         ]
         read_only_fields = ("id", "requested_by", "created_at")
-    
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Join / prefetch everything the representation reads, so a page of
+        services costs a fixed number of queries whatever its size.
+        """
+        job_cards = JobCard.objects.select_related(
+            "service", "customer", "staff", "reinstall_staff"
+        )
+        entries = ServiceEntry.objects.prefetch_related(
+            Prefetch("job_cards", queryset=job_cards)
+        )
+        feedbacks = Feedback.objects.order_by("-created_at")
+
+        return queryset.select_related(
+            "card", "requested_by", "assigned_to"
+        ).prefetch_related(
+            Prefetch("entries", queryset=entries),
+            Prefetch("feedbacks", queryset=feedbacks, to_attr="latest_feedbacks"),
+        )
+
     def get_feedback(self, obj):
         """
         Return latest feedback for the service (if any)
         """
-        feedback = obj.feedbacks.order_by("-created_at").first()
+        if hasattr(obj, "latest_feedbacks"):
+            feedback = obj.latest_feedbacks[0] if obj.latest_feedbacks else None
+        else:
+            feedback = obj.feedbacks.order_by("-created_at").first()
         if not feedback:
             return None
 
@@ -378,6 +435,28 @@ class ServiceSerializer(serializers.ModelSerializer):
         return ret
 
 
+class ServiceSummarySerializer(serializers.ModelSerializer):
+    """
+    Flat service for list screens (?view=summary): card fields inlined,
+    no entries, job cards or feedback.
+    """
+    card_model = serializers.CharField(source="card.model", read_only=True)
+    customer_name = serializers.CharField(source="card.customer_name", read_only=True)
+    address = serializers.CharField(source="card.address", read_only=True)
+    city = serializers.CharField(source="card.city", read_only=True)
+    assigned_to_name = serializers.CharField(source="assigned_to.name", read_only=True, default=None)
+
+    class Meta:
+        model = Service
+        fields = [
+            "id", "card", "card_model", "customer_name", "address", "city",
+            "service_type", "status", "visit_type",
+            "preferred_date", "scheduled_at", "assigned_to", "assigned_to_name",
+            "created_at",
+        ]
+        read_only_fields = fields
+
+
 class ServiceCreateSerializer(serializers.ModelSerializer):
     """
     Create serializer that accepts only preferred_date (date-only).
@@ -2,16 +2,18 @@ import logging
 import requests
 from django.conf import settings
 
+from utils.gateway import gateway
+
 logger = logging.getLogger(__name__)
 
+CHATINFY_SEND_PATH = "/api/sendmediamessage.php"
+
 
 def notify_admin(phone, message):
     """Send WhatsApp notification using Chatinfy API"""
 
     contact_phone = str(phone)
 
-    url = "https://web.chatinfy.in/api/sendmediamessage.php"
-
     params = {
         "LicenseNumber": settings.CHATINFY_LICENSE_NUMBER,
         "APIKey": settings.CHATINFY_API_KEY,
@@ -26,7 +28,7 @@ def notify_admin(phone, message):
     try:
         logger.info("Sending notification to %s", contact_phone)
 
-        response = requests.get(url, params=params, timeout=10)
+        response = gateway("chatinfy").get(CHATINFY_SEND_PATH, params=params)
 
         response.raise_for_status()
 
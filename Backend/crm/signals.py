@@ -0,0 +1,81 @@
+# crm/signals.py
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from user.models import User
+
+from .milestones import card_contract_dates, sync_card_milestones
+from .models import Card, Service, IndustrialAMC, ServiceMilestone
+from .reports import invalidate_card_reports, invalidate_region_reports
+from .search import index_customer_cards
+from .utils import refresh_last_free_service
+
+# customer fields the card search index is built from
+CUSTOMER_SEARCH_FIELDS = {"name", "phone", "region"}
+
+
+@receiver(post_save, sender=Card)
+def card_saved(sender, instance, **kwargs):
+    try:
+        region = instance.customer.region
+    except ObjectDoesNotExist:
+        return
+    # milestones are synced after this signal: add the new contract dates
+    invalidate_card_reports(instance.id, region, card_contract_dates(instance).values())
+
+
+@receiver(pre_delete, sender=Card)
+def card_deleted(sender, instance, **kwargs):
+    # before the cascade removes the milestones the months come from
+    invalidate_card_reports(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Service)
+def service_changed(sender, instance, **kwargs):
+    # card already gone on cascade deletes; card_deleted covers that
+    invalidate_card_reports(instance.card_id)
+
+
+@receiver(post_delete, sender=Service)
+def service_deleted(sender, instance, **kwargs):
+    # its entries went with it
+    if instance.service_type == "free":
+        refresh_last_free_service(instance.card_id)
+
+
+@receiver(pre_save, sender=IndustrialAMC)
+@receiver([post_save, post_delete], sender=IndustrialAMC)
+def industrial_amc_changed(sender, instance, **kwargs):
+    # pre_save covers the old dates of an edited AMC
+    invalidate_card_reports(instance.card_id, extra_ranges=[(instance.start_date, instance.end_date)])
+
+
+@receiver(post_save, sender=User)
+def customer_changed(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is not None and not CUSTOMER_SEARCH_FIELDS.intersection(update_fields):
+        return
+    index_customer_cards(instance)
+
+    # milestones are filed under the customer's region for the reports
+    old_regions = set(
+        ServiceMilestone.objects
+        .filter(card__customer=instance)
+        .exclude(region=instance.region)
+        .values_list("region", flat=True)
+        .distinct()
+    )
+
+    if old_regions:
+        for card in Card.objects.select_related("customer").filter(customer=instance):
+            sync_card_milestones(card)
+
+        for region in old_regions | {instance.region}:
+            invalidate_region_reports(region)
+        return
+
+    # name / phone are shown on the report rows
+    for card_id in instance.cards.values_list("id", flat=True):
+        invalidate_card_reports(card_id, instance.region)
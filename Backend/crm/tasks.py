@@ -0,0 +1,128 @@
+from datetime import date
+
+from celery import shared_task
+from django.utils import timezone
+
+from crm.exports import run_export, sweep_exports
+from crm.models import REGION_CHOICES
+from crm.notifications import deliver, due_notification_ids
+from crm.reports import REPORT_BUILDERS, prune_snapshots, refresh_snapshot, report_months, valid_snapshot
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def precompute_monthly_reports():
+    """
+    Nightly: store the warranty / AMC / industrial AMC reports of the current
+    and next month for every region as ReportSnapshot rows, and drop the
+    snapshots of old months. Returns the build timings per region (kept by
+    the django-db result backend).
+    """
+    months = report_months(timezone.localdate())
+    metrics = {}
+
+    pruned = prune_snapshots()
+    if pruned:
+        logger.info(f"Pruned {pruned} old report snapshots")
+
+    for region, _ in REGION_CHOICES:
+
+        started = time.perf_counter()
+        builds = {}
+
+        for first_day in months:
+            for report_type in REPORT_BUILDERS:
+
+                try:
+                    _, build_ms = refresh_snapshot(report_type, region, first_day)
+                except Exception:
+                    logger.exception(
+                        f"Report precompute failed: {report_type} {region} {first_day:%Y-%m}"
+                    )
+                    continue
+
+                builds[f"{report_type}:{first_day:%Y-%m}"] = build_ms
+
+        total_ms = int((time.perf_counter() - started) * 1000)
+        metrics[region] = {"total_ms": total_ms, "builds_ms": builds}
+
+        logger.info(f"Reports precomputed for {region} in {total_ms} ms: {builds}")
+
+    return metrics
+
+
+@shared_task
+def refresh_report_snapshots(region, month):
+    """
+    Rebuild the snapshots of a precomputed month (YYYY-MM-DD, first day)
+    that a write retired, so the next request is served from them again.
+    Queued by crm.reports.schedule_snapshot_refresh.
+    """
+    first_day = date.fromisoformat(month)
+    rebuilt = {}
+
+    for report_type in REPORT_BUILDERS:
+        if valid_snapshot(report_type, region, first_day) is not None:
+            continue  # already rebuilt by a request (?fresh=1 / cold cache)
+
+        _, rebuilt[report_type] = refresh_snapshot(report_type, region, first_day)
+
+    return rebuilt
+
+
+@shared_task
+def deliver_notification(outbox_id):
+    """
+    One delivery attempt of a NotificationOutbox row, rescheduling itself
+    with backoff while the provider keeps failing.
+    """
+    delay = deliver(outbox_id)
+
+    if delay is not None:
+        deliver_notification.apply_async((outbox_id,), countdown=delay)
+
+
+@shared_task
+def drain_notification_outbox():
+    """
+    Every minute: enqueue the outbox rows that are due but whose task was
+    lost (worker restart, broker down at commit time, expired send lease).
+    """
+    ids = due_notification_ids()
+
+    for outbox_id in ids:
+        deliver_notification.delay(outbox_id)
+
+    return len(ids)
+
+
+@shared_task
+def run_export_job(job_id):
+    """
+    Write the file of an ExportJob under MEDIA_ROOT/exports/.
+    """
+    rows = run_export(job_id)
+
+    if rows is not None:
+        logger.info(f"Export job {job_id} done: {rows} rows")
+
+    return rows
+
+
+@shared_task
+def sweep_export_jobs():
+    """
+    Every 15 minutes: give up on stuck export jobs and delete old files.
+    """
+    failed, expired, orphans = sweep_exports()
+
+    if failed or expired or orphans:
+        logger.info(
+            f"Export sweep: {failed} jobs failed, {expired} files expired, {orphans} orphans removed"
+        )
+
+    return failed, expired, orphans
@@ -1,3 +1,1058 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from user.models import User
+
+from .models import Attendance, Card, CardSearchToken, Service, ServiceEntry, ServiceMilestone, Feedback, JobCard, ReportSnapshot, NotificationOutbox, ExportJob
+from .exports import EXPORT_JOB_TIMEOUT, EXPORT_RETENTION, run_export, sweep_exports
+from .notifications import MAX_ATTEMPTS, deliver, due_notification_ids
+from .reports import CARD_FIELDS, refresh_snapshot, report_cache, valid_snapshot
+from .search import card_tokens
+from .tasks import refresh_report_snapshots
+from .utils import hash_otp, record_free_service
+
+
+class ServiceListQueryCountTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        self.staff = User.objects.create_user(
+            phone="9000000002", name="staff", role="staff", region="rajapalayam"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def add_services(self, count):
+        for i in range(count):
+            customer = User.objects.create_user(
+                phone=f"91{User.objects.count():08d}",
+                name=f"customer {i}",
+                role="customer",
+                region="rajapalayam",
+            )
+            card = Card.objects.create(model="RO", customer=customer, customer_name=customer.name)
+            service = Service.objects.create(
+                card=card,
+                requested_by=customer,
+                assigned_to=self.staff,
+                service_type="normal",
+                scheduled_at=date(2025, 1, 1),
+            )
+            entry = ServiceEntry.objects.create(service=service, performed_by=self.staff)
+            JobCard.objects.create(
+                service=service,
+                service_entry=entry,
+                staff=self.staff,
+                customer=customer,
+                part_name="motor",
+                serial_number=f"SN{service.id}",
+            )
+            Feedback.objects.create(service=service, card=card, customer=customer, rating=5)
+            Feedback.objects.create(service=service, card=card, customer=customer, rating=4)
+
+    def list_query_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/crm/services/")
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_list_query_count_is_constant(self):
+        self.add_services(2)
+        few, _ = self.list_query_count()
+
+        self.add_services(10)
+        many, data = self.list_query_count()
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(data), 12)
+
+        # latest feedback and nested job cards still come through
+        self.assertIsNotNone(data[0]["feedback"])
+        self.assertEqual(data[0]["entries"][0]["job_cards"][0]["part_name"], "motor")
+
+    def test_summary_view_is_flat(self):
+        self.add_services(3)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/crm/services/?view=summary")
+
+        data = response.json()
+        self.assertEqual(len(data), 3)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(data[0]["card_model"], "RO")
+        self.assertNotIn("entries", data[0])
+
+
+class CardSearchTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+        for name, phone, model in (
+            ("Ramesh Kumar", "9876543210", "AquaPure X1"),
+            ("Suresh", "9000012345", "Kent Grand"),
+        ):
+            customer = User.objects.create_user(
+                phone=phone, name=name, role="customer", region="rajapalayam"
+            )
+            Card.objects.create(model=model, customer=customer, customer_name=name)
+
+    def search(self, query):
+        response = self.client.get("/api/crm/cards/", {"search": query})
+        return [card["customer_name"] for card in response.json()]
+
+    def test_search_by_name_model_and_phone(self):
+        self.assertEqual(self.search("ram kum"), ["Ramesh Kumar"])
+        self.assertEqual(self.search("kent"), ["Suresh"])
+        self.assertEqual(self.search("12345"), ["Suresh"])
+        self.assertEqual(self.search("+91 98765 43210"), ["Ramesh Kumar"])
+
+    def test_index_follows_customer_changes(self):
+        customer = User.objects.get(name="Suresh")
+        customer.phone = "+919111122222"
+        customer.save()
+
+        self.assertEqual(self.search("12345"), [])
+        self.assertEqual(self.search("22222"), ["Suresh"])
+
+    def test_full_number_matches_any_spelling(self):
+        # stored without the country code, searched with it and vice versa
+        customer = User.objects.get(name="Suresh")
+        customer.phone = "90000 12345"
+        customer.save()
+
+        for query in ("919000012345", "+91 90000 12345", "09000012345", "9000012345"):
+            self.assertEqual(self.search(query), ["Suresh"], query)
+        self.assertEqual(self.search("919876543210"), ["Ramesh Kumar"])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def add_card(self, name, model="RO"):
+        customer = User.objects.create_user(
+            phone=f"91{User.objects.count():08d}", name=name, role="customer", region="rajapalayam"
+        )
+        return Card.objects.create(model=model, customer=customer, customer_name=name)
+
+    def walk(self, path, **params):
+        """
+        ids of every page, following `next` from the first one.
+        """
+        ids, pages = [], 0
+        response = self.client.get(path, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids += [row["id"] for row in body["results"]]
+            pages += 1
+            if not body["next"]:
+                return ids, pages
+            response = self.client.get(body["next"])
+
+    def test_plain_list_without_page_params(self):
+        cards = [self.add_card(f"customer {i}") for i in range(3)]
+
+        body = self.client.get("/api/crm/cards/").json()
+        self.assertIsInstance(body, list)
+        self.assertEqual([row["id"] for row in body], [c.id for c in reversed(cards)])
+
+    def test_pages_cover_every_row_once(self):
+        cards = [self.add_card(f"customer {i}") for i in range(7)]
+
+        ids, pages = self.walk("/api/crm/cards/", page_size=3)
+        self.assertEqual(ids, [c.id for c in reversed(cards)])
+        self.assertEqual(pages, 3)
+
+        # a full last page still ends with next = null
+        ids, pages = self.walk("/api/crm/cards/", page_size=7)
+        self.assertEqual((len(ids), pages), (7, 1))
+
+    def test_service_pages_keep_unscheduled_last(self):
+        card = self.add_card("customer")
+        for scheduled_at in (None, date(2025, 1, 2), None, date(2025, 1, 1), date(2025, 1, 1), None):
+            Service.objects.create(card=card, service_type="normal", scheduled_at=scheduled_at)
+
+        plain = [row["id"] for row in self.client.get("/api/crm/services/").json()]
+        ids, _ = self.walk("/api/crm/services/", page_size=2)
+        self.assertEqual(ids, plain)
+        self.assertEqual(len(set(ids)), 6)
+
+        scheduled = list(Service.objects.filter(id__in=ids[3:]).values_list("scheduled_at", flat=True))
+        self.assertEqual(scheduled, [None, None, None])
+
+    def test_search_pages_follow_the_rank(self):
+        ram = self.add_card("Ram")
+        for name in ("Ramesh", "Ram Kumar", "Ramu"):
+            self.add_card(name)
+        self.add_card("Bala", model="Ram")
+        self.add_card("Suresh")
+
+        plain = [row["id"] for row in self.client.get("/api/crm/cards/", {"search": "ram"}).json()]
+        ids, pages = self.walk("/api/crm/cards/", search="ram", page_size=2)
+
+        self.assertEqual(ids, plain)
+        self.assertEqual((len(ids), pages), (5, 3))
+        # whole-word name matches first, newest first between them
+        self.assertEqual(ids[1], ram.id)
+
+    def test_bad_cursor_is_rejected(self):
+        self.add_card("customer")
+
+        def cursor(position):
+            return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+        for value in ("not-a-cursor", cursor({"id": 1}), cursor([1, 2]), cursor(["abc"])):
+            response = self.client.get("/api/crm/cards/", {"cursor": value})
+            self.assertEqual(response.status_code, 400, value)
+
+        response = self.client.get("/api/crm/services/", {"cursor": cursor([0, "yesterday", None, 1])})
+        self.assertEqual(response.status_code, 400)
+
+
+class MilestoneRegionTests(TestCase):
+
+    def test_milestones_follow_customer_region(self):
+        customer = User.objects.create_user(
+            phone="9000000011", name="customer", role="customer", region="rajapalayam"
+        )
+        card = Card.objects.create(
+            model="RO",
+            customer=customer,
+            customer_name="customer",
+            warranty_start_date=date(2025, 1, 1),
+            warranty_end_date=date(2025, 12, 31),
+        )
+        self.assertEqual(set(card.milestones.values_list("region", flat=True)), {"rajapalayam"})
+
+        customer.region = "tenkasi"
+        customer.save(update_fields=["region"])
+
+        self.assertEqual(set(card.milestones.values_list("region", flat=True)), {"tenkasi"})
+        self.assertFalse(ServiceMilestone.objects.filter(region="rajapalayam").exists())
+
+
+class MilestoneCompletionTests(TestCase):
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.staff = User.objects.create_user(
+            phone="9000000002", name="staff", role="staff", region="rajapalayam"
+        )
+        customer = User.objects.create_user(
+            phone="9000000111", name="customer", role="customer", region="rajapalayam"
+        )
+        # first warranty milestone today, the next one three months later
+        self.card = Card.objects.create(
+            model="RO",
+            customer=customer,
+            customer_name=customer.name,
+            warranty_start_date=self.today - relativedelta(months=3),
+            warranty_end_date=self.today + relativedelta(months=9),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def milestone_status(self):
+        return list(
+            self.card.milestones.filter(kind="warranty")
+            .order_by("sequence")
+            .values_list("status", "service_id", "staff_id")[:2]
+        )
+
+    def add_service(self, service_type="free", **fields):
+        return Service.objects.create(
+            card=self.card,
+            service_type=service_type,
+            assigned_to=self.staff,
+            scheduled_at=self.today,
+            otp_hash=hash_otp("1234"),
+            otp_expires_at=timezone.now() + timedelta(minutes=5),
+            **fields
+        )
+
+    def test_verify_otp_marks_the_milestone_of_a_free_service(self):
+        normal = self.add_service("normal")
+        response = self.client.post(f"/api/crm/services/{normal.id}/verify_otp/", {"otp": "1234"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.milestone_status(), [("notdone", None, None)] * 2)
+
+        free = self.add_service()
+        response = self.client.post(f"/api/crm/services/{free.id}/verify_otp/", {"otp": "1234"})
+        self.assertEqual(response.data["status"], "completed")
+
+        self.assertEqual(
+            self.milestone_status(),
+            [("done", free.id, self.staff.id), ("notdone", None, None)],
+        )
+
+    def test_reinstall_completes_the_milestone_with_the_last_part(self):
+        service = self.add_service()
+        response = self.client.post(
+            f"/api/crm/services/{service.id}/verify_otp/",
+            {
+                "otp": "1234",
+                "job_cards[0][part_name]": "motor",
+                "job_cards[0][details]": "no flow",
+                "job_cards[0][serial_number]": "SN1",
+            },
+        )
+        self.assertEqual(response.data["status"], "job_card_pending")
+        self.assertEqual(self.milestone_status()[0][0], "notdone")
+
+        job_card = JobCard.objects.get(service=service)
+        job_card.status = "repair_completed"
+        job_card.save()
+
+        Service.objects.filter(pk=service.pk).update(
+            otp_hash=hash_otp("5678"),
+            otp_expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        response = self.client.post(
+            f"/api/crm/services/{service.id}/reinstall/",
+            {"otp": "5678", "job_cards": [job_card.id]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.milestone_status()[0], ("done", service.id, self.staff.id))
+
+    def test_reconcile_repairs_drifted_milestones(self):
+        service = self.add_service(status="completed")
+        first, second = self.card.milestones.filter(kind="warranty").order_by("sequence")[:2]
+
+        # drift: the served milestone lost its service, the next one got it
+        ServiceMilestone.objects.filter(pk=first.pk).update(status="notdone", service=None, staff=None)
+        ServiceMilestone.objects.filter(pk=second.pk).update(status="done", service=service)
+
+        out = StringIO()
+        call_command(
+            "reconcile_milestones",
+            "--from", (self.today - relativedelta(months=1)).isoformat(),
+            "--to", (self.today + relativedelta(months=4)).isoformat(),
+            stdout=out,
+        )
+
+        self.assertEqual(
+            self.milestone_status(),
+            [("done", service.id, self.staff.id), ("notdone", None, None)],
+        )
+        self.assertIn("Done: 1", out.getvalue())
+
+
+class ReportSnapshotTests(TestCase):
+
+    def setUp(self):
+        report_cache().clear()
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+        self.cards = []
+        for i, start in enumerate((date(2025, 1, 1), date(2027, 1, 1))):
+            customer = User.objects.create_user(
+                phone=f"900000010{i}", name=f"customer {i}", role="customer", region="rajapalayam"
+            )
+            self.cards.append(Card.objects.create(
+                model="RO",
+                customer=customer,
+                customer_name=customer.name,
+                warranty_start_date=start,
+                warranty_end_date=start.replace(month=12, day=31),
+            ))
+
+        # milestone 2025-04-01 of the first card
+        self.april = date(2025, 4, 1)
+        refresh_snapshot("warranty", "rajapalayam", self.april)
+
+    def report(self, **headers):
+        return self.client.get("/api/crm/reports/warranty/", {"month": "2025-04"}, **headers)
+
+    def test_snapshot_served_until_a_write_of_its_month(self):
+        ReportSnapshot.objects.update(data=[{"from": "snapshot"}])
+        self.assertEqual(self.report().data, [{"from": "snapshot"}])
+
+        # the other card has no milestone in April 2025
+        Service.objects.create(card=self.cards[1], service_type="free", scheduled_at=date(2027, 4, 1))
+        self.assertIsNotNone(valid_snapshot("warranty", "rajapalayam", self.april))
+
+        Service.objects.create(card=self.cards[0], service_type="free", scheduled_at=self.april)
+        self.assertIsNone(valid_snapshot("warranty", "rajapalayam", self.april))
+
+        rows = self.report().data["report_data"]
+        self.assertEqual([row["card_id"] for row in rows], [self.cards[0].id])
+
+    def test_queryset_updates_retire_the_report(self):
+        service = Service.objects.create(
+            card=self.cards[0], service_type="free", status="completed", scheduled_at=self.april
+        )
+        refresh_snapshot("warranty", "rajapalayam", self.april)
+
+        ServiceMilestone.objects.filter(card=self.cards[0]).update(status="notdone")
+        from .milestones import record_service_completion
+        self.assertEqual(record_service_completion(service), 1)
+
+        self.assertIsNone(valid_snapshot("warranty", "rajapalayam", self.april))
+
+    def test_etag_answers_304_until_the_month_changes(self):
+        first = self.report()
+        self.assertEqual(first.status_code, 200)
+
+        again = self.report(HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        self.cards[0].model = "RO Plus"
+        self.cards[0].save()
+
+        changed = self.report(HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data["report_data"][0]["card_model"], "RO Plus")
+
+    def test_write_in_another_worker_retires_the_cached_report(self):
+        first = self.report()
+        self.assertEqual(first.data["report_data"][0]["card_model"], "RO")
+
+        # another worker's write: its local cache is not ours, only the
+        # database sees the invalidation
+        Card.objects.filter(pk=self.cards[0].pk).update(model="RO Plus")
+        ReportSnapshot.objects.update(invalidated_at=timezone.now())
+
+        changed = self.report(HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data["report_data"][0]["card_model"], "RO Plus")
+
+
+class ReportPagingTests(TestCase):
+
+    def setUp(self):
+        report_cache().clear()
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+        # every card has its first warranty milestone on 2025-04-01
+        self.cards = []
+        for i in range(5):
+            customer = User.objects.create_user(
+                phone=f"900000020{i}", name=f"customer {i}", role="customer", region="rajapalayam"
+            )
+            self.cards.append(Card.objects.create(
+                model="RO",
+                customer=customer,
+                customer_name=customer.name,
+                warranty_start_date=date(2025, 1, 1),
+                warranty_end_date=date(2025, 12, 31),
+            ))
+
+    def report(self, **params):
+        return self.client.get("/api/crm/reports/warranty/", {"month": "2025-04", **params})
+
+    def flat_rows(self, items):
+        """
+        Paged / streamed cards back in the default shape, one row per milestone.
+        """
+        return [
+            {
+                **{key: item[key] for key in CARD_FIELDS},
+                **row,
+                "allmilestones": item["allmilestones"],
+            }
+            for item in items
+            for row in item["milestones"]
+        ]
+
+    def test_pages_split_on_cards_and_keep_the_month_totals(self):
+        full = self.report().json()
+        self.assertEqual(len(full["report_data"]), 5)
+
+        pages = [self.report(page_size=2).json()]
+        while pages[-1]["next"]:
+            pages.append(self.client.get(pages[-1]["next"]).json())
+
+        self.assertEqual([len(page["results"]) for page in pages], [2, 2, 1])
+        for page in pages:
+            self.assertEqual(page["summary_totals"], full["summary_totals"])
+
+        items = [item for page in pages for item in page["results"]]
+        self.assertEqual([item["card_id"] for item in items], [c.id for c in self.cards])
+        self.assertEqual(self.flat_rows(items), full["report_data"])
+
+    def test_stream_lines_match_the_default_report(self):
+        full = self.report().json()
+
+        response = self.report(stream="1")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+
+        self.assertEqual(lines[-1], {"summary_totals": full["summary_totals"]})
+        self.assertEqual(self.flat_rows(lines[:-1]), full["report_data"])
+
+    def test_bad_page_params_are_rejected(self):
+        for params in ({"cursor": "not-a-cursor"}, {"page_size": "ten"}, {"page_size": "0"}):
+            self.assertEqual(self.report(**params).status_code, 400, params)
+
+        # above the maximum is clamped, not rejected
+        response = self.report(page_size="100000")
+        self.assertEqual(len(response.json()["results"]), 5)
+
+
+class SnapshotRefreshTests(TestCase):
+
+    def setUp(self):
+        report_cache().clear()
+        self.month = timezone.localdate().replace(day=1)
+
+        customer = User.objects.create_user(
+            phone="9000000101", name="customer", role="customer", region="rajapalayam"
+        )
+        # first milestone on the first day of the current month
+        self.card = Card.objects.create(
+            model="RO",
+            customer=customer,
+            customer_name=customer.name,
+            warranty_start_date=self.month - relativedelta(months=3),
+            warranty_end_date=self.month + relativedelta(months=6),
+        )
+        refresh_snapshot("warranty", "rajapalayam", self.month)
+
+    def test_retired_precomputed_snapshot_is_rebuilt_in_background(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Service.objects.create(card=self.card, service_type="free", scheduled_at=self.month)
+            Service.objects.create(card=self.card, service_type="free", scheduled_at=self.month)
+
+        # one rebuild queued for the burst of writes
+        self.assertEqual(len(callbacks), 1)
+        self.assertIsNone(valid_snapshot("warranty", "rajapalayam", self.month))
+
+        rebuilt = refresh_report_snapshots("rajapalayam", self.month.isoformat())
+
+        self.assertIn("warranty", rebuilt)
+        self.assertIsNotNone(valid_snapshot("warranty", "rajapalayam", self.month))
+
+
+class NotificationOutboxTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        customer = User.objects.create_user(
+            phone="9000000011", name="customer", role="customer", region="rajapalayam"
+        )
+        card = Card.objects.create(model="RO", customer=customer, customer_name="customer")
+        self.service = Service.objects.create(card=card, status="assigned")
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def request_otp(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                f"/api/crm/services/{self.service.id}/request_otp/",
+                {"phone": "9000000011"},
+                format="json",
+            )
+        self.assertIn(response.status_code, (200, 202))
+        self.assertEqual(len(callbacks), 1)
+        return NotificationOutbox.objects.get(pk=response.data["delivery_id"])
+
+    def make_due(self, outbox):
+        NotificationOutbox.objects.filter(pk=outbox.pk).update(next_attempt_at=timezone.now())
+
+    @mock.patch("crm.notifications.send_otp")
+    def test_delivered_once_and_payload_cleared(self, send_otp):
+        outbox = self.request_otp()
+        self.assertIn(outbox.id, due_notification_ids())
+
+        self.assertIsNone(deliver(outbox.id))
+        self.assertIsNone(deliver(outbox.id))
+
+        send_otp.assert_called_once_with("9000000011", outbox.payload["otp"])
+        outbox.refresh_from_db()
+        self.assertEqual((outbox.status, outbox.attempts, outbox.payload), ("sent", 1, {}))
+        self.assertNotIn(outbox.id, due_notification_ids())
+
+    @mock.patch("crm.notifications.send_otp", side_effect=RuntimeError("provider down"))
+    def test_retried_with_backoff_then_given_up(self, send_otp):
+        outbox = self.request_otp()
+
+        self.assertEqual(deliver(outbox.id), 30)
+        # not due again before the backoff
+        self.assertIsNone(deliver(outbox.id))
+        self.assertNotIn(outbox.id, due_notification_ids())
+
+        for _ in range(MAX_ATTEMPTS - 1):
+            self.make_due(outbox)
+            deliver(outbox.id)
+
+        outbox.refresh_from_db()
+        self.assertEqual(send_otp.call_count, MAX_ATTEMPTS)
+        self.assertEqual((outbox.status, outbox.payload), ("failed", {}))
+        self.assertEqual(outbox.last_error, "provider down")
+
+    @mock.patch("crm.notifications.send_otp")
+    def test_stale_otp_is_never_sent(self, send_otp):
+        first = self.request_otp()
+        second = self.request_otp()
+
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.payload), ("superseded", {}))
+        self.assertIsNone(deliver(first.id))
+
+        # verified (hash cleared) before the worker got to it
+        Service.objects.filter(pk=self.service.pk).update(otp_hash=None)
+        self.assertIsNone(deliver(second.id))
+
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.payload), ("superseded", {}))
+        send_otp.assert_not_called()
+
+    def test_delivery_readable_by_the_region_admin_only(self):
+        outbox = self.request_otp()
+        url = f"/api/crm/notifications/{outbox.id}/"
+
+        self.assertEqual(self.client.get(url).data["status"], "pending")
+
+        other = User.objects.create_user(
+            phone="9000000002", name="other", role="admin", region="tenkasi"
+        )
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class ImportCustomersCardsTests(TestCase):
+
+    def setUp(self):
+        self.existing = User.objects.create_user(
+            phone="9876543210", name="Existing", role="customer", region="tenkasi"
+        )
+        Card.objects.create(
+            model="RO", customer=self.existing, customer_name="Existing",
+            warranty_start_date=date(2025, 1, 10), warranty_end_date=date(2025, 1, 10),
+        )
+
+        sheet = pd.DataFrame({
+            "CUSTOMER NAME": ["Existing", "Existing", "New Mill", "New Mill", "No Phone Co"],
+            "PLACE": ["Tenkasi", "Tenkasi", "Rajapalayam", "Rajapalayam", "Sivakasi"],
+            "MODEL": ["RO", "UV", "Kent", "Kent", "Aqua"],
+            "CONTACT NO": [9876543210, "+91 98765 43210", "919000012345", 9000012345.0, None],
+            "DATE OF INSTALLATION": ["10/01/2025", "05/02/2025", "15/03/2025", "15/03/2025", "01/04/2025"],
+        })
+        handle, self.path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        sheet.to_excel(self.path, index=False)
+
+    def run_import(self, *options):
+        out = StringIO()
+        call_command("import_customers_cards", self.path, *options, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_writes_nothing(self):
+        out = self.run_import("--dry-run")
+
+        self.assertIn("Customers created: 2", out)
+        self.assertIn("Cards created: 3", out)
+        self.assertIn("Duplicate cards skipped: 2", out)
+        self.assertEqual(User.objects.filter(role="customer").count(), 1)
+        self.assertEqual(Card.objects.count(), 1)
+
+    def test_bulk_import_builds_milestones_and_search_tokens(self):
+        out = self.run_import("--bulk", "--chunk-size", "2")
+
+        self.assertIn("Cards created: 3", out)
+        self.assertIn("3 / 3 cards indexed", out)
+
+        mill = User.objects.get(phone_normalized="+919000012345")
+        self.assertTrue(mill.is_industrial)
+        self.assertTrue(mill.customer_code.startswith("VSTI"))
+        self.assertEqual(Card.objects.filter(customer=self.existing).count(), 2)
+
+        card = Card.objects.get(customer=mill)
+        self.assertEqual(
+            list(card.milestones.values_list("kind", "region", "milestone_date")),
+            [("warranty", "rajapalayam", date(2025, 3, 15))],
+        )
+        self.assertEqual(
+            list(Card.objects.get(model="UV").milestones.values_list("region", flat=True)),
+            ["tenkasi"],
+        )
+        self.assertTrue(CardSearchToken.objects.filter(card=card, kind="phone", token="9000012345").exists())
+        self.assertTrue(CardSearchToken.objects.filter(card=card, kind="name", token="mill").exists())
+
+        # same tokens as the incremental indexer would keep
+        self.assertEqual(
+            set(card.search_tokens.values_list("kind", "token")),
+            card_tokens(card),
+        )
+
+        # re-running imports nothing
+        self.assertIn("Cards created: 0", self.run_import("--bulk"))
+
+    def test_cards_created_meanwhile_keep_their_rows(self):
+        bulk_create = Card.objects.bulk_create
+
+        def with_api_card(cards, *args, **kwargs):
+            created = bulk_create(cards, *args, **kwargs)
+            # a card saved through the API while the import runs
+            Card.objects.create(
+                model="API", customer=self.existing, customer_name="Existing",
+                warranty_start_date=date(2025, 6, 1), warranty_end_date=date(2026, 6, 1),
+            )
+            return created
+
+        with mock.patch.object(Card.objects, "bulk_create", side_effect=with_api_card):
+            out = self.run_import("--bulk")
+
+        self.assertIn("Cards created: 3", out)
+        api_card = Card.objects.get(model="API")
+        self.assertEqual(api_card.milestones.count(), 4)
+        self.assertEqual(set(api_card.search_tokens.values_list("kind", "token")), card_tokens(api_card))
+        self.assertEqual(ServiceMilestone.objects.filter(card__model="Kent").count(), 1)
+
+
+class ServiceExportTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        customer = User.objects.create_user(
+            phone="9000000011", name="customer", role="customer", region="rajapalayam"
+        )
+        card = Card.objects.create(model="RO", customer=customer, customer_name="customer")
+        self.service = Service.objects.create(card=card)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        return self.client.get("/api/crm/admin/export/services/", params)
+
+    def test_streams_the_services_of_the_range(self):
+        today = timezone.localdate()
+        response = self.export(**{"from": (today - timedelta(days=1)).isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f"{self.service.id},"))
+
+    def test_invalid_dates_answer_400_before_streaming(self):
+        for params in ({"from": "2025-13-01"}, {"to": "yesterday"}, {"from": "2025-01-01junk"}):
+            response = self.export(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertFalse(response.streaming)
+            self.assertIn("expected YYYY-MM-DD", response.data["detail"])
+
+
+class ExportJobTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        customer = User.objects.create_user(
+            phone="9000000011", name="customer", role="customer", region="rajapalayam"
+        )
+        card = Card.objects.create(model="RO", customer=customer, customer_name="customer")
+        Service.objects.create(card=card)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def queue(self, **body):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post("/api/crm/admin/exports/", body, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        return ExportJob.objects.get(pk=response.data["id"])
+
+    def test_job_written_once_and_downloadable(self):
+        job = self.queue(kind="services")
+
+        self.assertEqual(run_export(job.id), 1)
+        self.assertIsNone(run_export(job.id))
+
+        url = f"/api/crm/admin/exports/{job.id}/"
+        self.assertEqual(self.client.get(url).data["status"], "done")
+
+        response = self.client.get(url, {"download": 1})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_rejects_unknown_kind_and_bad_dates(self):
+        for body in ({"kind": "everything"}, {"kind": "services", "from": "2025-02-30"}):
+            response = self.client.post("/api/crm/admin/exports/", body, format="json")
+            self.assertEqual(response.status_code, 400, body)
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_sweep_fails_stuck_jobs_and_deletes_old_files(self):
+        now = timezone.now()
+
+        stuck = self.queue(kind="services")
+        ExportJob.objects.filter(pk=stuck.pk).update(
+            status="running", started_at=now - EXPORT_JOB_TIMEOUT - timedelta(minutes=1)
+        )
+        lost = self.queue(kind="cards")
+        ExportJob.objects.filter(pk=lost.pk).update(created_at=now - EXPORT_JOB_TIMEOUT - timedelta(minutes=1))
+
+        old = self.queue(kind="services")
+        run_export(old.id)
+        ExportJob.objects.filter(pk=old.pk).update(finished_at=now - EXPORT_RETENTION - timedelta(days=1))
+        old.refresh_from_db()
+        old_path = old.file.path
+
+        recent = self.queue(kind="services")
+        run_export(recent.id)
+        recent.refresh_from_db()
+
+        # partial file of a dead worker
+        orphan = os.path.join(self.media, "exports", f"services-{stuck.id}-20250101000000.csv")
+        open(orphan, "w").close()
+        stamp = (now - EXPORT_JOB_TIMEOUT - timedelta(minutes=1)).timestamp()
+        os.utime(orphan, (stamp, stamp))
+
+        self.assertEqual(sweep_exports(now), (2, 1, 1))
+
+        statuses = dict(ExportJob.objects.values_list("id", "status"))
+        self.assertEqual(
+            [statuses[j.id] for j in (stuck, lost, old, recent)],
+            ["failed", "failed", "expired", "done"],
+        )
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(recent.file.path))
+
+    def test_worker_finishing_after_the_sweep_keeps_nothing(self):
+        job = self.queue(kind="services")
+
+        def slow_write(path, header, rows):
+            open(path, "w").close()
+            sweep_exports(timezone.now() + EXPORT_JOB_TIMEOUT * 2)
+            return 0
+
+        with mock.patch.dict("crm.exports.WRITERS", {"csv": slow_write}):
+            self.assertIsNone(run_export(job.id))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(os.listdir(os.path.join(self.media, "exports")), [])
+
+
+class AttendanceBulkTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        self.workers = [
+            User.objects.create_user(
+                phone=f"900000001{i}", name=f"worker {i}", role="worker", region="rajapalayam"
+            )
+            for i in range(3)
+        ]
+        self.outsider = User.objects.create_user(
+            phone="9000000020", name="outsider", role="worker", region="tenkasi"
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def bulk(self, **body):
+        return self.client.post("/api/crm/attendance/bulk/", body, format="json")
+
+    def marked(self):
+        return dict(
+            Attendance.objects.filter(date=timezone.localdate())
+            .values_list("user_id", "status")
+        )
+
+    def test_marks_today_and_resubmits_as_upsert(self):
+        a, b, c = (w.id for w in self.workers)
+
+        response = self.bulk(present=[a, b], absent=[c])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["present_marked"], response.data["absent_marked"]), (2, 1))
+        self.assertEqual(self.marked(), {a: "present", b: "present", c: "absent"})
+
+        # second submission of the day changes the rows in place
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.bulk(present=[c], absent=[b])
+        self.assertEqual(response.status_code, 200)
+        # one lookup, one upsert, two availability updates (+ savepoint)
+        self.assertEqual(
+            sum(not q["sql"].startswith(("SAVEPOINT", "RELEASE")) for q in ctx.captured_queries), 4
+        )
+
+        self.assertEqual(self.marked(), {a: "present", b: "absent", c: "present"})
+        self.assertEqual(Attendance.objects.count(), 3)
+        self.assertEqual(
+            dict(User.objects.filter(role="worker", region="rajapalayam").values_list("id", "is_available")),
+            {a: True, b: False, c: True},
+        )
+
+    def test_unknown_ids_are_reported_not_marked(self):
+        a = self.workers[0].id
+
+        response = self.bulk(present=[a, self.outsider.id, "x", 999999])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["present_marked"], 1)
+        self.assertCountEqual(response.data["unknown"], ["x", self.outsider.id, 999999])
+        self.assertEqual(self.marked(), {a: "present"})
+
+    def test_only_today_with_a_valid_date(self):
+        yesterday = (timezone.localdate() - timedelta(days=1)).isoformat()
+
+        for date_str in ("31-12-2025", yesterday):
+            response = self.bulk(date=date_str, present=[self.workers[0].id])
+            self.assertEqual(response.status_code, 400, date_str)
+
+        self.assertFalse(Attendance.objects.exists())
+
+
+class BenchmarkMilestoneMatchingTests(TestCase):
+
+    def test_fixture_is_built_and_rolled_back(self):
+        out = StringIO()
+        call_command("benchmark_milestone_matching", cards=30, services=200, stdout=out, stderr=out)
+
+        self.assertIn("Benchmark completed", out.getvalue())
+        self.assertNotIn("differ", out.getvalue())
+        self.assertFalse(Card.objects.filter(model="BENCH").exists())
+
+
+class FreeServiceEligibilityTests(TestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            phone="9000000011", name="customer", role="customer", region="rajapalayam"
+        )
+        self.card = Card.objects.create(
+            model="RO",
+            customer=self.customer,
+            customer_name="customer",
+            warranty_start_date=date(2025, 1, 1),
+            warranty_end_date=date(2025, 12, 31),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def eligibility(self, *dates):
+        response = self.client.get(
+            "/api/crm/cards/free-eligibility/", {"dates": ",".join(dates)}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data[0]["eligible"]
+
+    def test_free_entry_blocks_the_next_three_months(self):
+        self.assertEqual(self.eligibility("2025-03-01"), {"2025-03-01": True})
+
+        service = Service.objects.create(card=self.card, service_type="free")
+        entry = ServiceEntry.objects.create(service=service)
+        ServiceEntry.objects.filter(pk=entry.pk).update(created_at="2025-02-01T10:00:00Z")
+        entry.refresh_from_db()
+        record_free_service(service, entry.created_at)
+
+        self.assertEqual(
+            self.eligibility("2025-03-01", "2025-05-01", "2026-01-01"),
+            {"2025-03-01": False, "2025-05-01": True, "2026-01-01": False},
+        )
+
+
+    def test_last_free_service_follows_entry_changes(self):
+        admin = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="rajapalayam"
+        )
+        self.client.force_authenticate(admin)
+
+        free = Service.objects.create(card=self.card, service_type="free")
+        normal = Service.objects.create(card=self.card, service_type="normal")
+
+        def add_entry():
+            response = self.client.post(
+                "/api/crm/service-entries/", {"service": free.id, "work_detail": "filter change"}
+            )
+            self.assertEqual(response.status_code, 201)
+            return ServiceEntry.objects.get(pk=response.data["id"])
+
+        def last_free_service_at():
+            self.card.refresh_from_db()
+            return self.card.last_free_service_at
+
+        first = add_entry()
+        second = add_entry()
+        self.assertEqual(last_free_service_at(), second.created_at)
+
+        self.assertEqual(self.client.delete(f"/api/crm/service-entries/{second.id}/").status_code, 204)
+        self.assertEqual(last_free_service_at(), first.created_at)
+
+        # moved to a normal service: no free entry left
+        response = self.client.patch(f"/api/crm/service-entries/{first.id}/", {"service": normal.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(last_free_service_at())
+
+        add_entry()
+        free.delete()
+        self.assertIsNone(last_free_service_at())
+
+
+class ProcessMetricsTests(TestCase):
+
+    def test_counts_requests_and_connections_of_the_process(self):
+        admin = User.objects.create_user(phone="9000000001", name="admin", role="admin")
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        before = client.get("/api/crm/admin/metrics/").data["database"]
+        client.get("/api/crm/notifications/999/")
+        after = client.get("/api/crm/admin/metrics/").data["database"]
+
+        self.assertEqual(after["requests"], before["requests"] + 2)
+        # the test connection stays open: no new connection per request
+        self.assertEqual(after["databases"]["default"]["opened"], before["databases"]["default"]["opened"])
+
+        worker = User.objects.create_user(phone="9000000002", name="worker", role="worker")
+        client.force_authenticate(worker)
+        self.assertEqual(client.get("/api/crm/admin/metrics/").status_code, 403)
@@ -7,7 +7,8 @@ from .views import (
     FeedbackViewSet, AttendanceViewSet,
     WarrantyReportView, UpcomingServicesReportView,
     AutoAssignRunView, ExportServicesCSVView, DevSendOtpView, WarrantyReportByCardView,
-    AMCReportByCardView, AMCReportView, JobCardViewSet, IndustrialAMCViewSet, IndustrialAMCReportView, FollowUpCardsView
+    AMCReportByCardView, AMCReportView, JobCardViewSet, IndustrialAMCViewSet, IndustrialAMCReportView, FollowUpCardsView,
+    NotificationDeliveryView, ExportJobView, ExportJobDetailView, ProcessMetricsView,
 )
 
 router = DefaultRouter()
@@ -35,8 +36,12 @@ urlpatterns = [
     path("reports/amc-report/by_card/",AMCReportByCardView.as_view(),name="amc-report-by-card"),
     path("autoassign/run/", AutoAssignRunView.as_view(), name="autoassign-run"),
     path("admin/export/services/", ExportServicesCSVView.as_view(), name="export-services"),
+    path("admin/exports/", ExportJobView.as_view(), name="export-jobs"),
+    path("admin/exports/<int:pk>/", ExportJobDetailView.as_view(), name="export-job"),
+    path("admin/metrics/", ProcessMetricsView.as_view(), name="process-metrics"),
     path("reports/industrial-amc/", IndustrialAMCReportView.as_view()),
     path("reports/follow-up/", FollowUpCardsView.as_view(), name="follow-up-report"),
+    path("notifications/<int:pk>/", NotificationDeliveryView.as_view(), name="notification-delivery"),
 
     # Dev only
     path("test/send-otp/", DevSendOtpView.as_view(), name="dev-send-otp"),
@@ -95,19 +95,66 @@ except Exception:
         def __init__(self, months=0): self.months = months
         def __radd__(self, other): return add_months(other, self.months)
 
+def record_free_service(service, at):
+    """
+    Keep Card.last_free_service_at on the latest entry of a free service.
+    Called when verify_otp / partial_complete / the entries API store a
+    ServiceEntry.
+    """
+    from .models import Card
+    from django.db.models import Q
+
+    if service.service_type != "free":
+        return
+
+    Card.objects.filter(pk=service.card_id).filter(
+        Q(last_free_service_at__isnull=True) | Q(last_free_service_at__lt=at)
+    ).update(last_free_service_at=at)
+
+
+def refresh_last_free_service(card_id):
+    """
+    Recompute Card.last_free_service_at from the card's remaining free
+    entries, after an entry was deleted or moved to another service.
+    """
+    from .models import Card, ServiceEntry
+    from django.db.models import Max
+
+    last = ServiceEntry.objects.filter(
+        service__card_id=card_id,
+        service__service_type="free",
+    ).aggregate(last=Max("created_at"))["last"]
+
+    Card.objects.filter(pk=card_id).update(last_free_service_at=last)
+
+
+def completed_free_service_subquery():
+    """
+    updated_at of a card's latest completed free service (for cards that
+    never got a ServiceEntry), as a Subquery on OuterRef("pk").
+    """
+    from .models import Service
+    from django.db.models import OuterRef, Subquery
+
+    return Subquery(
+        Service.objects
+        .filter(card=OuterRef("pk"), service_type="free", status="completed")
+        .order_by("-updated_at", "-created_at")
+        .values("updated_at")[:1]
+    )
+
+
 def card_last_free_service_date(card):
     """
     Returns a date object of the most recent completed free service for the given card,
     or None if none exists.
-    Prefers ServiceEntry.created_at if you store completed entries; fallback to Service.completed_at or Service.updated_at.
+    Uses Card.last_free_service_at (the latest free ServiceEntry); fallback to the
+    latest completed free Service.
     """
-    from .models import Service, ServiceEntry
-    from django.db.models import Q
+    from .models import Service
 
-    # Try ServiceEntry first (if you create entries on completion)
-    se = ServiceEntry.objects.filter(service__card=card, service__service_type="free").order_by("-created_at").first()
-    if se:
-        return se.created_at.date()
+    if card.last_free_service_at:
+        return card.last_free_service_at.date()
 
     # Fallback to Service row where status == 'completed' and service_type == 'free'
     svc = Service.objects.filter(card=card, service_type="free", status="completed").order_by("-updated_at", "-created_at").first()
@@ -119,6 +166,30 @@ def card_last_free_service_date(card):
         return (svc.updated_at or svc.created_at).date()
     return None
 
+
+def next_free_service_date(last_free):
+    # require booking_date >= last_free + 3 months (use relativedelta)
+    try:
+        return last_free + relativedelta(months=3)
+    except Exception:
+        # fallback to basic month arithmetic if relativedelta missing
+        return add_months(last_free, 3)
+
+
+def free_service_allowed(warranty_start, warranty_end, last_free, booking_date):
+    if not warranty_start or not warranty_end:
+        return False
+    # inside warranty
+    if not (warranty_start <= booking_date <= warranty_end):
+        return False
+
+    if not last_free:
+        # no prior free → allow if booking_date within warranty
+        return True
+
+    return booking_date >= next_free_service_date(last_free)
+
+
 def booking_is_eligible_for_free(card, booking_date):
     """
     booking_date: datetime.date
@@ -131,16 +202,36 @@ def booking_is_eligible_for_free(card, booking_date):
         return False
 
     last_free = card_last_free_service_date(card)  # returns date or None
-    if not last_free:
-        # no prior free → allow if booking_date within warranty
-        return True
 
-    # require booking_date >= last_free + 3 months (use relativedelta)
-    from datetime import date as _date
-    try:
-        next_allowed = last_free + relativedelta(months=3)
-    except Exception:
-        # fallback to basic month arithmetic if relativedelta missing
-        next_allowed = add_months(last_free, 3)
+    return free_service_allowed(
+        card.warranty_start_date, card.warranty_end_date, last_free, booking_date
+    )
+
 
-    return booking_date >= next_allowed
+def free_service_eligibility(cards, dates):
+    """
+    Free-service eligibility of many cards on many booking dates, read in one
+    query: [{"card_id", "last_free_service", "next_free_date", "eligible": {date: bool}}].
+    """
+    rows = cards.order_by("id").annotate(
+        completed_free_at=completed_free_service_subquery()
+    ).values_list(
+        "id", "warranty_start_date", "warranty_end_date", "last_free_service_at", "completed_free_at"
+    )
+
+    results = []
+    for card_id, start, end, last_entry_at, completed_at in rows:
+        last_at = last_entry_at or completed_at
+        last_free = last_at.date() if last_at else None
+
+        results.append({
+            "card_id": card_id,
+            "last_free_service": last_free,
+            "next_free_date": next_free_service_date(last_free) if last_free else None,
+            "eligible": {
+                d.isoformat(): free_service_allowed(start, end, last_free, d)
+                for d in dates
+            },
+        })
+
+    return results
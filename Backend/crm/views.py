@@ -1,13 +1,13 @@
 # crm/views.py
 from datetime import datetime
-import csv
-from io import StringIO
+import os
 
 from django.conf import settings
 from django.db.models import Value
 from django.db.models.functions import Coalesce
-from django.http import HttpResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
 from rest_framework.exceptions import PermissionDenied
 
@@ -18,24 +18,41 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.db import models
 
-from user.models import User  # your custom user model
+from user.models import User, phone_lookup  # your custom user model
+from utils.db import db_metrics
+from utils.gateway import gateway_metrics
 
-from .models import Card, Service, ServiceEntry, Feedback, Attendance, JobCard, IndustrialAMC
+from .models import Card, Service, ServiceEntry, Feedback, Attendance, JobCard, IndustrialAMC, NotificationOutbox, ExportJob
 from .serializers import (
     CardSerializer,
     CardCreateSerializer,
     ServiceSerializer,
+    ServiceSummarySerializer,
     ServiceCreateSerializer,
     ServiceAdminCreateSerializer,
     ServiceEntrySerializer,
     FeedbackSerializer,
     AttendanceSerializer,
     JobCardSerializer,
+    JobCardSummarySerializer,
     IndustrialAMCSerializer,
     # assume User serializer exists if needed (e.g., UserSerializer)
 )
 from .permissions import IsAdmin, IsStaff, IsCustomer
 from .utils import generate_otp, hash_otp, otp_expiry_time, verify_otp_hash, parse_iso_datetime
+from .utils import free_service_eligibility, parse_iso_date, record_free_service, refresh_last_free_service
+from .exports import (
+    EXPORTS,
+    SERVICE_EXPORT_COLUMNS,
+    available_formats,
+    csv_lines,
+    gzip_stream,
+    service_export_queryset,
+    service_export_rows,
+    validate_export_params,
+)
+from .region import admin_region, ensure_same_region
+from .tasks import run_export_job
 
 # ---------- Cards ----------
 from django.db.models import Q
@@ -45,28 +62,27 @@ from django_filters.rest_framework import DjangoFilterBackend
 
 from .models import Card
 from .serializers import CardSerializer, CardCreateSerializer
+from .search import CardSearchFilter, search_cards, phone_digits
+
+
+FREE_ELIGIBILITY_MAX_DATES = 31
 
 
 class CardViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Card.objects.select_related("customer").all()
 
-    # 🔍 filtering / searching / sorting
+    # 🔍 filtering / sorting / searching (search last: it ranks)
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
         filters.OrderingFilter,
+        CardSearchFilter,
     ]
 
     # allow ?customer=123
     filterset_fields = ["customer"]
 
-    # allow ?search=
-    search_fields = [
-        "customer__name",
-        "customer__phone",
-        "model",
-    ]
+    # allow ?search= (customer name, model, phone) — see crm/search.py
 
     # allow ?ordering=
     ordering_fields = [
@@ -80,6 +96,13 @@ class CardViewSet(viewsets.ModelViewSet):
 
     ordering = ["-id"]  # default latest first
 
+    # paged lists (?page_size= / ?cursor=) are latest first, or best match first
+    @property
+    def keyset_ordering(self):
+        if self.request.query_params.get("search", "").strip():
+            return ("-search_rank", "-id")
+        return ("-id",)
+
     def get_serializer_class(self):
         if self.action == "create":
             return CardCreateSerializer
@@ -107,10 +130,11 @@ class CardViewSet(viewsets.ModelViewSet):
             )
 
             phone = self.request.query_params.get("phone")
-            if phone:
-                qs = qs.filter(
-                    customer__phone__icontains=phone
-                )
+            if phone and len(phone_digits(phone)) >= 10:
+                # a whole number: the customer's phone_last10 index
+                qs = qs.filter(phone_lookup(phone, prefix="customer__"))
+            elif phone:
+                qs = search_cards(qs, phone_digits(phone), user.region)
 
             customer_id = self.request.query_params.get("customer")
             if customer_id:
@@ -197,6 +221,46 @@ class CardViewSet(viewsets.ModelViewSet):
         )
 
 
+    @action(detail=False, methods=["get"], url_path="free-eligibility")
+    def free_eligibility(self, request):
+        """
+        GET /api/crm/cards/free-eligibility/?cards=1,2&dates=YYYY-MM-DD,...
+        Free-service eligibility of the user's cards (all of them when
+        `cards` is omitted) on each date (default today), in one query.
+        """
+        try:
+            dates = [
+                parse_iso_date(d.strip())
+                for d in request.query_params.get("dates", "").split(",")
+                if d.strip()
+            ] or [timezone.localdate()]
+        except ValueError:
+            return Response({"detail": "invalid date, expected YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(dates) > FREE_ELIGIBILITY_MAX_DATES:
+            return Response(
+                {"detail": f"at most {FREE_ELIGIBILITY_MAX_DATES} dates"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        cards = self.get_queryset()
+
+        card_ids = request.query_params.get("cards")
+        if card_ids:
+            try:
+                cards = cards.filter(id__in=[int(i) for i in card_ids.split(",") if i.strip()])
+            except ValueError:
+                return Response({"detail": "cards must be a comma separated list of ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(free_service_eligibility(cards, dates))
+
+def wants_summary(request):
+    """
+    ?view=summary: list screens get the flat serializer.
+    """
+    return request.query_params.get("view") == "summary"
+
+
 # crm/views.py — updated ServiceViewSet (replace existing ServiceViewSet class)
 
 from datetime import datetime as _dt
@@ -219,7 +283,7 @@ from rest_framework.exceptions import PermissionDenied
 
 # NEW imports for safe null-last ordering
 from django.db.models import Case, When, IntegerField, F
-from django.db import transaction
+from django.db import connection, transaction
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
@@ -227,7 +291,9 @@ from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 
 import json
-from utils.msg91 import send_otp
+from .notifications import notification_region, queue_notification
+from .milestones import record_service_completion
+from .reports import invalidate_card_reports
 
 
 
@@ -235,11 +301,16 @@ class ServiceViewSet(viewsets.ModelViewSet):
     queryset = Service.objects.select_related("card", "assigned_to").all()
     permission_classes = [IsAuthenticated]
 
+    # same order as get_queryset(), id breaks ties between pages
+    keyset_ordering = ("scheduled_is_null", "scheduled_at", "created_at", "id")
+
     def get_serializer_class(self):
         if self.action == "create":
             return ServiceCreateSerializer
         if self.action == "admin_create":
             return ServiceAdminCreateSerializer
+        if self.action == "list" and wants_summary(self.request):
+            return ServiceSummarySerializer
         # use ServiceSerializer for list/retrieve/update/partial_update
         return ServiceSerializer
 
@@ -300,6 +371,12 @@ class ServiceViewSet(viewsets.ModelViewSet):
             qs = qs.filter(card_id=card_q)
         if assigned_q:
             qs = qs.filter(assigned_to_id=assigned_q)
+
+        # prefetch plan of the nested representation (entries, job cards, feedback);
+        # the actions only load the service itself
+        if self.action in ("list", "retrieve") and self.get_serializer_class() is ServiceSerializer:
+            qs = ServiceSerializer.setup_eager_loading(qs)
+
         return qs
     
     def complete_reinstall_service(self, service):
@@ -335,6 +412,7 @@ class ServiceViewSet(viewsets.ModelViewSet):
         if not pending:
             parent.status = "completed"
             parent.save(update_fields=["status"])
+            record_service_completion(parent)
     
     @action(detail=False, methods=["get"], url_path="industrial")
     def industrial_services(self, request):
@@ -525,14 +603,21 @@ class ServiceViewSet(viewsets.ModelViewSet):
         service.otp_requested_at = timezone.now()
         service.otp_requested_location = location
         service.status = "awaiting_otp"
-        service.save()
 
-        send_otp(phone, otp)
+        # OTP hash + outbox row commit together, the SMS goes out from Celery
+        with transaction.atomic():
+            service.save()
+            delivery = queue_notification(
+                "otp", phone, {"otp": otp}, service=service, requested_by=user
+            )
         
         if getattr(settings, "CRM_DEV_RETURN_OTP", False):
-            return Response({"detail": "otp-generated", "otp": otp})
+            return Response({"detail": "otp-generated", "otp": otp, "delivery_id": delivery.id})
         
-        return Response({"detail": "otp-sent"}, status=status.HTTP_200_OK)
+        return Response(
+            {"detail": "otp-queued", "delivery_id": delivery.id},
+            status=status.HTTP_202_ACCEPTED
+        )
     
     @action(detail=True, methods=["post"], permission_classes=[IsAuthenticated])
     def reinstall(self, request, pk=None):
@@ -595,6 +680,7 @@ class ServiceViewSet(viewsets.ModelViewSet):
             service.otp_hash = None
             service.otp_expires_at = None
             service.save()
+            record_service_completion(service)
 
         return Response({"detail": "Selected parts reinstalled"})
     
@@ -649,6 +735,7 @@ class ServiceViewSet(viewsets.ModelViewSet):
                 parts_replaced=parts_replaced,
                 amount_charged=amount_charged,
             )
+            record_free_service(service, se.created_at)
 
             # ✏️ Update description
             service.description = f"Need to done {pending_work}. {service.description}"
@@ -752,6 +839,8 @@ class ServiceViewSet(viewsets.ModelViewSet):
                 amount_charged=amount_charged,
                 image=service_image, 
             )
+            record_free_service(service, se.created_at)
+
             if service.visit_type == "I" and service_image:
                 card = service.card
                 card.installation_image = service_image
@@ -779,6 +868,8 @@ class ServiceViewSet(viewsets.ModelViewSet):
                     otp_hash=None,
                     otp_expires_at=None,
                 )
+                # queryset update: no post_save to retire the reports
+                invalidate_card_reports(service.card_id)
 
             else:
                 # Normal completion
@@ -796,6 +887,7 @@ class ServiceViewSet(viewsets.ModelViewSet):
                     "next_service_date",
                     "scheduled_at",
                 ])
+                record_service_completion(service)
                 self.complete_reinstall_service(service)
 
 
@@ -837,6 +929,23 @@ class ServiceEntryViewSet(viewsets.ModelViewSet):
 
         return qs.none()
 
+    # Card.last_free_service_at follows the card's latest free entry
+    def perform_create(self, serializer):
+        entry = serializer.save()
+        record_free_service(entry.service, entry.created_at)
+
+    def perform_update(self, serializer):
+        old_card_id = serializer.instance.service.card_id
+        entry = serializer.save()
+
+        for card_id in {old_card_id, entry.service.card_id}:
+            refresh_last_free_service(card_id)
+
+    def perform_destroy(self, instance):
+        card_id = instance.service.card_id
+        instance.delete()
+        refresh_last_free_service(card_id)
+
 # ---------- Feedback ----------
 
 class FeedbackViewSet(viewsets.ModelViewSet):
@@ -991,40 +1100,58 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        present_ids = request.data.get("present", [])
-        absent_ids = request.data.get("absent", [])
+        # uid -> status; an id in both lists ends up absent
+        wanted = {}
+        unknown = []
 
-        for uid in present_ids:
-            staff = get_object_or_404(
-                User,
-                pk=uid,
-                region=request.user.region
-            )
-            Attendance.objects.update_or_create(
-                user=staff, date=d,
-                defaults={"status": "present", "marked_by": request.user}
-            )
-            staff.is_available = True
-            staff.save(update_fields=["is_available"])
+        for key, att_status in (("present", "present"), ("absent", "absent")):
+            for uid in request.data.get(key, []) or []:
+                try:
+                    wanted[int(uid)] = att_status
+                except (TypeError, ValueError):
+                    unknown.append(uid)
 
-        for uid in absent_ids:
-            staff = get_object_or_404(
-                User,
-                pk=uid,
+        staff_ids = set(
+            User.objects.filter(
+                pk__in=wanted,
                 region=request.user.region
+            ).values_list("id", flat=True)
+        )
+        unknown += [uid for uid in wanted if uid not in staff_ids]
+
+        marked = {uid: s for uid, s in wanted.items() if uid in staff_ids}
+        present = [uid for uid, s in marked.items() if s == "present"]
+        absent = [uid for uid, s in marked.items() if s == "absent"]
+
+        with transaction.atomic():
+            Attendance.objects.bulk_create(
+                [
+                    Attendance(user_id=uid, date=d, status=s, marked_by=request.user)
+                    for uid, s in marked.items()
+                ],
+                update_conflicts=True,
+                # MySQL upserts on any unique key and takes no target
+                unique_fields=(
+                    ["user", "date"]
+                    if connection.features.supports_update_conflicts_with_target
+                    else None
+                ),
+                update_fields=["status", "marked_by"],
             )
-            Attendance.objects.update_or_create(
-                user=staff, date=d,
-                defaults={"status": "absent", "marked_by": request.user}
-            )
-            staff.is_available = False
-            staff.save(update_fields=["is_available"])
+
+            User.objects.filter(pk__in=present).update(is_available=True)
+            User.objects.filter(pk__in=absent).update(is_available=False)
 
         return Response(
-            {"detail": "bulk attendance updated for today"},
+            {
+                "detail": "bulk attendance updated for today",
+                "present_marked": len(present),
+                "absent_marked": len(absent),
+                "unknown": unknown,
+            },
             status=status.HTTP_200_OK
         )
-    
+
     @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated, IsAdmin])
     def by_date(self, request):
         """
@@ -1099,6 +1226,24 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from collections import Counter
 
+from .milestones import card_milestones
+from .reports import (
+    wants_stream,
+    wants_pages,
+    warranty_milestones,
+    amc_milestones,
+    industrial_amcs,
+    industrial_service_map,
+    warranty_report_data,
+    amc_report_data,
+    industrial_amc_report_data,
+    paginated_milestone_report,
+    streamed_milestone_report,
+    paginated_industrial_amc_report,
+    streamed_industrial_amc_report,
+    cached_report_response,
+)
+
 class WarrantyReportView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
@@ -1113,122 +1258,30 @@ class WarrantyReportView(APIView):
         first_day = datetime(year, mon, 1).date()
         last_day = datetime(year, mon, monthrange(year, mon)[1]).date()
 
-        results = []
-
-        totals = Counter({
-            "spun_filter": 0,
-            "pre_carbon": 0,
-            "sediments": 0,
-            "post_carbon": 0,
-        })
-
-        cards = Card.objects.select_related("customer").filter(
-            customer__region=request.user.region,
-            warranty_start_date__isnull=False,
-            warranty_end_date__isnull=False,
+        return cached_report_response(
+            request,
+            "warranty",
+            first_day,
+            lambda: self.build_report(request, first_day, last_day),
         )
 
-        free_services = (
-            Service.objects
-            .filter(service_type="free")
-            .values("card_id", "scheduled_at", "assigned_to_id", "assigned_to__name")
-        )
+    def build_report(self, request, first_day, last_day):
+        region = request.user.region
 
-        services_by_card = {}
-        for s in free_services:
-            services_by_card.setdefault(s["card_id"], []).append({
-                "date": s["scheduled_at"],
-                "staff_id": s["assigned_to_id"],
-                "staff_name": s["assigned_to__name"]
-            })
+        if wants_stream(request):
+            return streamed_milestone_report(
+                warranty_milestones(region, first_day, last_day), "warranty", "warranty_note"
+            )
 
-        for c in cards:
-            if c.card_type == "om":
-                continue
-
-            if c.warranty_start_date > last_day or c.warranty_end_date < first_day:
-                continue
-
-            milestones = []
-            current_milestone = c.warranty_start_date + relativedelta(months=3)
-
-            while current_milestone < c.warranty_end_date:
-                milestones.append(current_milestone)
-                current_milestone += relativedelta(months=3)
-
-            if c.warranty_end_date not in milestones:
-                milestones.append(c.warranty_end_date)
-
-            card_services = services_by_card.get(c.id, [])
-
-            for idx, m in enumerate(milestones, start=1):
-
-                if not (first_day <= m <= last_day):
-                    continue
-
-                # ---------------------------
-                # WARRANTY NOTE LOGIC
-                # ---------------------------
-                warranty_note = None
-
-                if idx == 1:
-                    warranty_note = "Spun Filter Change"
-                    totals["spun_filter"] += 1
-                elif idx == 2:
-                    warranty_note = "Spun Filter, Pre Carbon and Sediments Filters"
-                    totals["spun_filter"] += 1
-                    totals["pre_carbon"] += 1
-                    totals["sediments"] += 1
-                elif idx == 3:
-                    warranty_note = "Spun Filter Change"
-                    totals["spun_filter"] += 1
-                elif idx == 4:
-                    warranty_note = "Post Carbon filter"
-                    totals["post_carbon"] += 1
-
-                # after 1 year -> None
-
-                start_window = m - timedelta(days=30)
-                end_window = m + timedelta(days=30)
-
-                status = "notdone"
-                done_staff = None
-                scheduled_date = None
-
-                for svc in card_services:
-                    svc_date = svc["date"]
-
-                    if svc_date and start_window <= svc_date <= end_window:
-                        status = "done"
-                        scheduled_date = svc_date.isoformat() if svc_date else None
-                        done_staff = {
-                            "staff_id": svc["staff_id"],
-                            "staff_name": svc["staff_name"],
-                        }
-                        break
-
-                results.append({
-                    "card_id": c.id,
-                    "card_model": c.model,
-                    "customer_id": c.customer.id,
-                    "customer_name": c.customer.name,
-                    "customer_phone": c.customer.phone,
-                    "address": c.address,
-                    "city": c.city,
-                    "milestone": m.isoformat(),
-                    "status": status,
-                    "staff": done_staff,
-                    "scheduled_date": scheduled_date,
-                    "warranty_note": warranty_note,  # ✅ NEW FIELD
-                    "allmilestones": [m.isoformat() for m in milestones],
-                })
+        if wants_pages(request):
+            return paginated_milestone_report(
+                request, warranty_milestones(region, first_day, last_day), "warranty", "warranty_note"
+            )
 
-        return Response({
-            "report_data": results,
-            "summary_totals": totals
-        })
+        return Response(warranty_report_data(region, first_day, last_day))
 
     
+
 class WarrantyReportByCardView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -1279,45 +1332,17 @@ class WarrantyReportByCardView(APIView):
             )
 
         # ------------------------------
-        # Fetch free services for card
+        # Stored milestones + status for card
         # ------------------------------
-        free_services = (
-            Service.objects
-            .filter(card=card, service_type="free")
-            .values_list("preferred_date", flat=True)
-        )
-
-        milestones = []
-
-        current = card.warranty_start_date + relativedelta(months=3)
-
-        while current < card.warranty_end_date:
-            milestones.append(current)
-            current += relativedelta(months=3)
-        
-        if card.warranty_end_date not in milestones:
-            milestones.append(card.warranty_end_date)
-
-        results = []
-
-        for m in milestones:
-            if first_day and last_day:
-                if not (first_day <= m <= last_day):
-                    continue
-
-            start_window = m - timedelta(days=30)
-            end_window = m + timedelta(days=30)
-
-            status_flag = "notdone"
-            for svc_date in free_services:
-                if svc_date and start_window <= svc_date <= end_window:
-                    status_flag = "done"
-                    break
-
-            results.append({
+        results = [
+            {
                 "milestone": m.isoformat(),
                 "status": status_flag,
-            })
+            }
+            for m, status_flag in card_milestones(
+                card, "warranty", first_day, last_day
+            ).values_list("milestone_date", "status")
+        ]
         if(card.card_type=="om"):
             results=[]
 
@@ -1352,137 +1377,30 @@ class AMCReportView(APIView):
         first_day = datetime(year, mon, 1).date()
         last_day = datetime(year, mon, monthrange(year, mon)[1]).date()
 
-        results = []
-
-        totals = Counter({
-            "spun_filter": 0,
-            "pre_carbon": 0,
-            "sediments": 0,
-            "post_carbon": 0,
-        })
-
-        # ----------------------------------
-        # 1. Fetch cards
-        # ----------------------------------
-
-        cards = Card.objects.select_related("customer").filter(
-            customer__region=request.user.region,
-            amc_start_date__isnull=False,
-            amc_end_date__isnull=False,
-        )
-
-        # ----------------------------------
-        # 2. Fetch ALL free services + staff
-        # ----------------------------------
-        free_services = (
-            Service.objects
-            .filter(service_type="free")
-            .values(
-                "card_id",
-                "scheduled_at",
-                "assigned_to_id",
-                "assigned_to__name",
-            )
+        return cached_report_response(
+            request,
+            "amc",
+            first_day,
+            lambda: self.build_report(request, first_day, last_day),
         )
 
-        # Group services by card_id
-        services_by_card = {}
+    def build_report(self, request, first_day, last_day):
+        region = request.user.region
 
-        for s in free_services:
-            services_by_card.setdefault(s["card_id"], []).append({
-                "date": s["scheduled_at"],
-                "staff_id": s["assigned_to_id"],
-                "staff_name": s["assigned_to__name"],
-            })
+        if wants_stream(request):
+            return streamed_milestone_report(
+                amc_milestones(region, first_day, last_day), "amc", "amc_note"
+            )
 
-        # ----------------------------------
-        # 3. Process milestones
-        # ----------------------------------
-        for c in cards:
-
-            if c.customer.is_industrial:
-                continue
-
-            if c.card_type == "om":
-                continue
-
-            if c.amc_start_date > last_day or c.amc_end_date < first_day:
-                continue
-
-            milestones = []
-            current_milestone = c.amc_start_date + relativedelta(months=3)
-
-            while current_milestone < c.amc_end_date:
-                milestones.append(current_milestone)
-                current_milestone += relativedelta(months=3)
-
-            if c.amc_end_date not in milestones:
-                milestones.append(c.amc_end_date)
-
-            card_services = services_by_card.get(c.id, [])
-
-            for idx,m in enumerate(milestones, start=1):
-                if not (first_day <= m <= last_day):
-                    continue
-
-                amc_note = None
-
-                if idx == 1:
-                    amc_note = "Spun Filter Change"
-                    totals["spun_filter"] += 1
-                elif idx == 2:
-                    amc_note = "Spun Filter, Pre Carbon and Sediments Filters"
-                    totals["spun_filter"] += 1
-                    totals["pre_carbon"] += 1
-                    totals["sediments"] += 1
-                elif idx == 3:
-                    amc_note = "Spun Filter Change"
-                    totals["spun_filter"] += 1
-                elif idx == 4:
-                    amc_note = "Post Carbon filter"
-                    totals["post_carbon"] += 1
-
-                start_window = m - timedelta(days=30)
-                end_window = m + timedelta(days=30)
-
-                status = "notdone"
-                done_staff = None
-                scheduled_date = None
-
-                for svc in card_services:
-                    svc_date = svc["date"]
-
-                    if svc_date and start_window <= svc_date <= end_window:
-                        status = "done"
-                        scheduled_date = svc_date.isoformat() if svc_date else None
-                        done_staff = {
-                            "staff_id": svc["staff_id"],
-                            "staff_name": svc["staff_name"],
-                        }
-                        break
-
-                results.append({
-                    "card_id": c.id,
-                    "card_model": c.model,
-                    "customer_id": c.customer.id,
-                    "customer_name": c.customer.name,
-                    "customer_phone": c.customer.phone,
-                    "address": c.address,
-                    "city": c.city,
-                    "milestone": m.isoformat(),
-                    "status": status,
-                    "staff": done_staff,
-                    "amc_note": amc_note,
-                    "scheduled_date": scheduled_date,
-                    "allmilestones": [m.isoformat() for m in milestones],
-                })
+        if wants_pages(request):
+            return paginated_milestone_report(
+                request, amc_milestones(region, first_day, last_day), "amc", "amc_note"
+            )
 
-        return Response({
-            "report_data": results,
-            "summary_totals": totals
-        })
+        return Response(amc_report_data(region, first_day, last_day))
 
     
+
 class AMCReportByCardView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -1533,45 +1451,17 @@ class AMCReportByCardView(APIView):
             )
 
         # ------------------------------
-        # Fetch free services for card
+        # Stored milestones + status for card
         # ------------------------------
-        free_services = (
-            Service.objects
-            .filter(card=card, service_type="free")
-            .values_list("preferred_date", flat=True)
-        )
-
-        milestones = []
-
-        current = card.amc_start_date + relativedelta(months=3)
-
-        while current <= card.amc_end_date:
-            milestones.append(current)
-            current += relativedelta(months=3)
-
-        if card.amc_end_date not in milestones:
-            milestones.append(card.amc_end_date)
-            
-        results = []
-
-        for m in milestones:
-            if first_day and last_day:
-                if not (first_day <= m <= last_day):
-                    continue
-
-            start_window = m - timedelta(days=30)
-            end_window = m + timedelta(days=30)
-
-            status_flag = "notdone"
-            for svc_date in free_services:
-                if svc_date and start_window <= svc_date <= end_window:
-                    status_flag = "done"
-                    break
-
-            results.append({
+        results = [
+            {
                 "milestone": m.isoformat(),
                 "status": status_flag,
-            })
+            }
+            for m, status_flag in card_milestones(
+                card, "amc", first_day, last_day
+            ).values_list("milestone_date", "status")
+        ]
         if(card.card_type=="om"):
             results=[]
 
@@ -1642,38 +1532,176 @@ class ExportServicesCSVView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        """Export services as CSV for given date range"""
-        from_date = request.query_params.get("from")
-        to_date = request.query_params.get("to")
-        qs = Service.objects.filter(
-            card__customer__region=request.user.region
-        )
-        if from_date:
-            qs = qs.filter(created_at__gte=from_date)
-        if to_date:
-            qs = qs.filter(created_at__lte=to_date)
-        qs = qs.order_by("created_at")
-
-        buf = StringIO()
-        writer = csv.writer(buf)
-        writer.writerow(["id", "card_id", "customer", "service_type", "status", "scheduled_at", "assigned_to", "amount_charged", "created_at"])
-        for s in qs:
-            writer.writerow([
-                s.id,
-                s.card_id,
-                s.card.customer_id if s.card else "",
-                s.service_type,
-                s.status,
-                s.scheduled_at.isoformat() if s.scheduled_at else "",
-                s.assigned_to_id if s.assigned_to else "",
-                s.amount_charged if s.amount_charged else "",
-                s.created_at.isoformat()
-            ])
-        resp = HttpResponse(buf.getvalue(), content_type="text/csv")
+        """Export services as CSV for given date range (?gzip=1 for .csv.gz)"""
+        params = {
+            key: request.query_params[key]
+            for key in ("from", "to")
+            if request.query_params.get(key)
+        }
+
+        # before the response starts: a bad date cannot fail mid-stream
+        error = validate_export_params("services", params)
+        if error:
+            return Response({"detail": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        qs = service_export_queryset(request.user.region, params.get("from"), params.get("to"))
+
+        header = [name for name, _ in SERVICE_EXPORT_COLUMNS]
+        body = csv_lines(header, service_export_rows(qs))
+
+        if request.query_params.get("gzip") in ("1", "true"):
+            resp = StreamingHttpResponse(gzip_stream(body), content_type="application/gzip")
+            resp["Content-Disposition"] = "attachment; filename=services_export.csv.gz"
+            return resp
+
+        resp = StreamingHttpResponse(body, content_type="text/csv")
         resp["Content-Disposition"] = "attachment; filename=services_export.csv"
         return resp
 
 
+class ExportJobView(APIView):
+    """
+    POST: queue an export of the admin's region, written to a file by a
+    worker. GET: the admin's latest export jobs.
+    """
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        jobs = ExportJob.objects.filter(
+            region=admin_region(request.user)
+        )[:20]
+        return Response([export_job_data(request, job) for job in jobs])
+
+    def post(self, request):
+        region = admin_region(request.user)
+
+        kind = request.data.get("kind")
+        fmt = request.data.get("format", "csv")
+
+        if kind not in EXPORTS:
+            return Response(
+                {"detail": f"kind must be one of: {', '.join(EXPORTS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if fmt not in available_formats():
+            return Response(
+                {"detail": f"format must be one of: {', '.join(available_formats())}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        params = {
+            key: str(request.data[key])
+            for key in ("from", "to", "month")
+            if request.data.get(key)
+        }
+
+        error = validate_export_params(kind, params)
+        if error:
+            return Response({"detail": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = ExportJob.objects.create(
+            kind=kind,
+            format=fmt,
+            region=region,
+            params=params,
+            requested_by=request.user,
+        )
+        transaction.on_commit(lambda: run_export_job.delay(job.id))
+
+        return Response(export_job_data(request, job), status=status.HTTP_202_ACCEPTED)
+
+
+class ExportJobDetailView(APIView):
+    """
+    Status of an export job; `?download=1` returns the file once done.
+    """
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request, pk):
+        job = get_object_or_404(ExportJob, pk=pk, region=admin_region(request.user))
+
+        if request.query_params.get("download") not in ("1", "true"):
+            return Response(export_job_data(request, job))
+
+        if job.status != "done":
+            return Response(
+                {"detail": f"export is {job.status}"},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        return FileResponse(
+            job.file.open("rb"),
+            as_attachment=True,
+            filename=os.path.basename(job.file.name),
+        )
+
+
+def export_job_data(request, job):
+    data = {
+        "id": job.id,
+        "kind": job.kind,
+        "format": job.format,
+        "params": job.params,
+        "status": job.status,
+        "rows": job.rows,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "download_url": None,
+    }
+    if job.status == "done":
+        data["download_url"] = request.build_absolute_uri(
+            reverse("export-job", args=[job.id])
+        ) + "?download=1"
+    return data
+
+
+class ProcessMetricsView(APIView):
+    """
+    Connection counters of the process that served the request: database
+    connections opened per request / task and the gateway HTTP clients.
+    Each worker process has its own numbers.
+    """
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        return Response({
+            "pid": os.getpid(),
+            "database": db_metrics(),
+            "gateways": gateway_metrics(),
+        })
+
+
+# ---------- Notifications ----------
+class NotificationDeliveryView(APIView):
+    """
+    Delivery status of a queued notification (e.g. the delivery_id returned
+    by request_otp), for the staff app to poll.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        outbox = get_object_or_404(
+            NotificationOutbox.objects.select_related("service__card__customer", "requested_by"),
+            pk=pk,
+        )
+
+        if request.user.role == "admin":
+            ensure_same_region(request.user, notification_region(outbox))
+        elif outbox.requested_by_id != request.user.id:
+            return Response({"detail": "not allowed"}, status=status.HTTP_403_FORBIDDEN)
+
+        return Response({
+            "delivery_id": outbox.id,
+            "kind": outbox.kind,
+            "status": outbox.status,
+            "attempts": outbox.attempts,
+            "sent_at": outbox.sent_at,
+            "next_attempt_at": outbox.next_attempt_at if outbox.status == "pending" else None,
+        })
+
+
 # ---------- Dev test endpoint to send OTP (dev-only) ----------
 class DevSendOtpView(APIView):
     """
@@ -1715,6 +1743,12 @@ from .utils import verify_otp_hash
 class JobCardViewSet(viewsets.ModelViewSet):
     serializer_class = JobCardSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ("-created_at", "-id")
+
+    def get_serializer_class(self):
+        if self.action == "list" and wants_summary(self.request):
+            return JobCardSummarySerializer
+        return JobCardSerializer
 
     # ======================================================
     # 1️⃣ GET JOB CARDS (ADMIN / STAFF / REINSTALL STAFF)
@@ -1791,6 +1825,7 @@ class JobCardViewSet(viewsets.ModelViewSet):
         if not pending:
             parent.status = "completed"
             parent.save(update_fields=["status"])
+            record_service_completion(parent)
 
     # ======================================================
     # 4️⃣ ADMIN UPDATE STATUS + ASSIGN REINSTALL STAFF
@@ -2149,121 +2184,34 @@ class IndustrialAMCReportView(APIView):
         first_day = datetime(year, mon, 1).date()
         last_day = datetime(year, mon, monthrange(year, mon)[1]).date()
 
-        results = []
-
-        # ✅ Fetch all AMCs
-        amcs = IndustrialAMC.objects.select_related(
-            "card",
-            "card__customer"
-        ).filter(
-            card__customer__region=request.user.region
+        return cached_report_response(
+            request,
+            "industrial-amc",
+            first_day,
+            lambda: self.build_report(request, first_day, last_day),
         )
 
-        # ✅ Fetch all services ONCE
-        all_services = Service.objects.filter(
-            service_type="free",
-            card__customer__region=request.user.region
-        ).values(
-            "card_id",
-            "scheduled_at",
-            "assigned_to_id",
-            "assigned_to__name"
-        )
-
-        # ✅ Build service map
-        service_map = {}
-
-        for svc in all_services:
-            service_map.setdefault(svc["card_id"], []).append(svc)
+    def build_report(self, request, first_day, last_day):
+        region = request.user.region
 
-        # =========================
-        # Main AMC Loop
-        # =========================
-        for amc in amcs:
-
-            # Skip invalid interval
-            if not amc.interval_days:
-                continue
-
-            milestones = []
-
-            current = amc.start_date + timedelta(days=amc.interval_days)
-
-            while current <= amc.end_date:
-                milestones.append(current)
-                current += timedelta(days=amc.interval_days)
-
-            services = service_map.get(amc.card.id, [])
-
-            # =====================
-            # Milestone Loop
-            # =====================
-            for m in milestones:
-
-                if not (first_day <= m <= last_day):
-                    continue
-
-                start_window = m - timedelta(days=30)
-                end_window = m + timedelta(days=30)
-
-                status = "notdone"
-                done_staff = None
-                scheduled_date = None
-
-                # =====================
-                # Service Matching
-                # =====================
-                for svc in services:
-
-                    svc_date = svc["scheduled_at"]
-
-                    # Normalize datetime → date
-                    if svc_date:
-                        svc_date = (
-                            svc_date.date()
-                            if hasattr(svc_date, "date")
-                            else svc_date
-                        )
-
-                    if svc_date and start_window <= svc_date <= end_window:
-
-                        status = "done"
-                        scheduled_date = svc_date.isoformat()
-
-                        done_staff = {
-                            "staff_id": svc["assigned_to_id"],
-                            "staff_name": svc["assigned_to__name"],
-                        }
-
-                        break
-
-                results.append({
-
-                    "card_id": amc.card.id,
-                    "card_model": amc.card.model,
-
-                    "customer_id": amc.card.customer.id,
-                    "customer_name": amc.card.customer.name,
-                    "customer_phone": amc.card.customer.phone,
-
-                    "address": amc.card.address,
-                    "city": amc.card.city,
-
-                    "interval_days": amc.interval_days,
-                    
-                    "is_with_spare": amc.is_with_spare,
-
-                    "spares": amc.spares or [], 
-
-                    "milestone": m.isoformat(),
-                    "status": status,
-                    "staff": done_staff,
-                    "scheduled_date": scheduled_date,
+        if wants_stream(request):
+            return streamed_industrial_amc_report(
+                industrial_amcs(region),
+                industrial_service_map(region, first_day, last_day),
+                first_day,
+                last_day,
+            )
 
-                    "allmilestones": [d.isoformat() for d in milestones]
-                })
+        if wants_pages(request):
+            return paginated_industrial_amc_report(
+                request,
+                industrial_amcs(region),
+                industrial_service_map(region, first_day, last_day),
+                first_day,
+                last_day,
+            )
 
-        return Response(results)
+        return Response(industrial_amc_report_data(region, first_day, last_day))
 
 
 from django.db.models import Max, F, ExpressionWrapper, DurationField
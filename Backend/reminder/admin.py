@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import AdminReminder
+from .models import AdminReminder, ReminderFire
 
 admin.site.register(AdminReminder)
+admin.site.register(ReminderFire)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from reminder.models import AdminReminder
+from reminder.queue import sync_reminder_fires
+
+
+class Command(BaseCommand):
+    help = "Build / refresh the ReminderFire rows (due-reminder queue) of every reminder"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **kwargs):
+
+        reminders = AdminReminder.objects.order_by("id")
+
+        processed = 0
+
+        for reminder in reminders.iterator(chunk_size=kwargs["chunk_size"]):
+            sync_reminder_fires(reminder)
+            processed += 1
+
+            if processed % kwargs["chunk_size"] == 0:
+                self.stdout.write(f"… {processed} reminders processed")
+
+        self.stdout.write(self.style.SUCCESS("🎉 Reminder queue synced"))
+        self.stdout.write(f"✔ Reminders processed: {processed}")
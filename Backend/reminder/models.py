@@ -65,5 +65,52 @@ class AdminReminder(models.Model):
             return self.customer.phone
         return None
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"reminder_dates", "is_active"}.intersection(update_fields):
+            from .queue import sync_reminder_fires
+            sync_reminder_fires(self)
+
+    def __str__(self):
+        return f"Admin reminder for {self.get_contact_name()}"
+
+
+class ReminderFire(models.Model):
+    """
+    One entry of AdminReminder.reminder_dates, kept in sync by
+    AdminReminder.save(). The beat task reads the unfired rows that are due
+    with one indexed range query instead of parsing every reminder, and hands
+    them to send tasks (see reminder.queue).
+    """
+
+    reminder = models.ForeignKey(
+        AdminReminder,
+        on_delete=models.CASCADE,
+        related_name="fires"
+    )
+
+    fire_at = models.DateTimeField()
+    date_str = models.CharField(max_length=64)  # as stored in reminder_dates
+    fired_at = models.DateTimeField(null=True, blank=True)
+
+    # dispatch claim: only the send task holding this token may send the row
+    claim_token = models.CharField(max_length=32, null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # given up after REMINDER_MAX_ATTEMPTS failed sends; never claimed again
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["fire_at"]
+        # (reminder, fire_at) is the idempotency key of a reminder SMS
+        unique_together = ("reminder", "fire_at")
+        indexes = [
+            # unfired + due: fired_at IS NULL AND fire_at <= now
+            models.Index(fields=["fired_at", "fire_at"]),
+        ]
+
     def __str__(self):
-        return f"Admin reminder for {self.get_contact_name()}"
\ No newline at end of file
+        return f"Reminder {self.reminder_id} at {self.fire_at}"
\ No newline at end of file
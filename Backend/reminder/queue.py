@@ -0,0 +1,218 @@
+# reminder/queue.py
+"""
+Due-reminder queue on the ReminderFire table.
+
+Each date of an active reminder is a ReminderFire row; (reminder, fire_at)
+is its idempotency key. A tick locks the unfired rows that are due with
+`select_for_update(skip_locked=True)`, stamps each batch with a claim token
+and fans the batches out to send tasks, so one slow or failing batch does
+not hold up the others. A send task only sends rows still unfired and still
+holding its token, marks them fired (mirrored into
+AdminReminder.triggered_dates) and retries on its own with backoff. A row
+whose send failed REMINDER_MAX_ATTEMPTS times is marked failed and left
+alone by later ticks.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from utils.msg91 import FLOW_BATCH_SIZE, send_reminders
+
+from .models import AdminReminder, ReminderFire
+
+logger = logging.getLogger(__name__)
+
+# due rows claimed per tick
+REMINDER_TICK_SIZE = getattr(settings, "REMINDER_TICK_SIZE", 2000)
+
+# how long a send task owns its rows; must outlast its retries
+CLAIM_LEASE = timedelta(seconds=getattr(settings, "REMINDER_CLAIM_LEASE", 20 * 60))
+
+# failed sends of a row, across tasks and ticks, before it is given up
+REMINDER_MAX_ATTEMPTS = getattr(settings, "REMINDER_MAX_ATTEMPTS", 5)
+
+
+def parse_reminder_date(date_str):
+    reminder_time = parse_datetime(date_str) if isinstance(date_str, str) else None
+
+    if not reminder_time:
+        return None
+
+    if timezone.is_naive(reminder_time):
+        reminder_time = timezone.make_aware(
+            reminder_time,
+            timezone.get_default_timezone()
+        )
+
+    return reminder_time
+
+
+def sync_reminder_fires(reminder):
+    """
+    Make the unfired ReminderFire rows match reminder_dates. Inactive
+    reminders keep no unfired rows; dates already in triggered_dates are
+    created as fired.
+    """
+    desired = {}
+    if reminder.is_active:
+        for date_str in reminder.reminder_dates or []:
+            fire_at = parse_reminder_date(date_str)
+            if fire_at:
+                desired.setdefault(fire_at, date_str)
+
+    existing = {f.fire_at: f for f in reminder.fires.all()}
+    triggered = set(reminder.triggered_dates or [])
+    now = timezone.now()
+
+    stale = [
+        f.id for fire_at, f in existing.items()
+        if f.fired_at is None and fire_at not in desired
+    ]
+    missing = [
+        ReminderFire(
+            reminder=reminder,
+            fire_at=fire_at,
+            date_str=date_str,
+            fired_at=now if date_str in triggered else None,
+        )
+        for fire_at, date_str in desired.items()
+        if fire_at not in existing
+    ]
+
+    if not stale and not missing:
+        return
+
+    with transaction.atomic():
+        ReminderFire.objects.filter(id__in=stale).delete()
+        ReminderFire.objects.bulk_create(missing)
+
+
+def reminder_phone(reminder):
+    if reminder.customer:
+        return reminder.customer.phone
+    return reminder.phone
+
+
+def claim_due_fires(now=None):
+    """
+    Claim the due rows, neither fired nor failed, that no send task holds
+    (or whose claim lease ran out) and split them into send batches.
+    Returns [(claim token, [fire ids]), ...].
+    """
+    now = now or timezone.now()
+
+    with transaction.atomic():
+
+        ids = list(
+            ReminderFire.objects
+            .select_for_update(skip_locked=True)
+            .filter(fired_at__isnull=True, failed_at__isnull=True, fire_at__lte=now)
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_LEASE))
+            .order_by("fire_at")
+            .values_list("id", flat=True)[:REMINDER_TICK_SIZE]
+        )
+
+        batches = []
+        for start in range(0, len(ids), FLOW_BATCH_SIZE):
+            chunk = ids[start:start + FLOW_BATCH_SIZE]
+            token = uuid.uuid4().hex
+
+            ReminderFire.objects.filter(id__in=chunk).update(
+                claim_token=token,
+                claimed_at=now,
+            )
+            batches.append((token, chunk))
+
+    return batches
+
+
+def send_claimed_fires(fire_ids, token):
+    """
+    Send the rows of one claimed batch that are still unfired and still held
+    by `token`, so a retried or re-dispatched task never sends a row twice.
+    Each row records its own outcome. Returns (sent, error); error is set
+    when some rows failed and are still worth retrying.
+    """
+    fires = list(
+        ReminderFire.objects
+        .select_related("reminder", "reminder__customer")
+        .filter(id__in=fire_ids, claim_token=token, fired_at__isnull=True)
+    )
+    if not fires:
+        return 0, None
+
+    messages = []
+    skipped = []
+
+    for fire in fires:
+        phone = reminder_phone(fire.reminder)
+
+        if not phone:
+            logger.warning(
+                f"Reminder {fire.reminder_id} skipped. No phone number."
+            )
+            skipped.append(fire.id)
+            continue
+
+        messages.append((fire, phone, fire.reminder.message))
+
+    now = timezone.now()
+
+    ReminderFire.objects.filter(id__in=skipped).update(fired_at=now, claim_token=None)
+
+    if not messages:
+        return 0, None
+
+    # one MSG91 flow call for the batch. MSG91 answers per call, so one bad
+    # recipient fails them all: a retry sends one call per recipient, and
+    # only the recipients that really fail keep failing.
+    retrying = any(fire.attempts for fire, _, _ in messages)
+    results = send_reminders(messages, batch_size=1 if retrying else len(messages))
+
+    sent = [fire for fire, e in results.items() if e is None]
+    failed = {}
+    for fire, e in results.items():
+        if e is not None:
+            failed.setdefault(str(e), (e, []))[1].append(fire.id)
+
+    error = None
+    for message, (e, ids) in failed.items():
+        ReminderFire.objects.filter(id__in=ids).update(
+            attempts=F("attempts") + 1,
+            last_error=message,
+        )
+
+        given_up = ReminderFire.objects.filter(
+            id__in=ids, attempts__gte=REMINDER_MAX_ATTEMPTS
+        ).update(failed_at=now, claim_token=None)
+
+        if given_up:
+            logger.warning(
+                f"{given_up} reminders failed {REMINDER_MAX_ATTEMPTS} times, given up: {message}"
+            )
+
+        if given_up < len(ids):
+            error = e
+
+    with transaction.atomic():
+        ReminderFire.objects.filter(id__in=[fire.id for fire in sent]).update(
+            fired_at=now,
+            claim_token=None,
+            attempts=F("attempts") + 1,
+            last_error="",
+        )
+
+        for fire in sent:
+            reminder = AdminReminder.objects.select_for_update().get(pk=fire.reminder_id)
+            reminder.triggered_dates.append(fire.date_str)
+            AdminReminder.objects.filter(pk=reminder.pk).update(
+                triggered_dates=reminder.triggered_dates
+            )
+
+    return len(sent), error
@@ -3,9 +3,13 @@ import requests
 from datetime import timezone, timedelta
 from django.conf import settings
 
+from utils.gateway import gateway
+
 
 logger = logging.getLogger(__name__)
 
+CHATINFY_SEND_PATH = "/api/sendmediamessage.php"
+
 IST = timezone(timedelta(hours=5, minutes=30))
 
 def notify_admin(reminder, trigger_time):
@@ -23,8 +27,6 @@ def notify_admin(reminder, trigger_time):
 
     print("✨ REMINDER", reminder.message, trigger_time)
 
-    url = "https://web.chatinfy.in/api/sendmediamessage.php"
-
     msg = f"{reminder.message} for {contact_name} ({contact_phone})."
 
     params = {
@@ -40,7 +42,7 @@ def notify_admin(reminder, trigger_time):
     }
 
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = gateway("chatinfy").get(CHATINFY_SEND_PATH, params=params)
         response.raise_for_status()
 
         logger.info("Reminder notification sent successfully")
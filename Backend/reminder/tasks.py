@@ -1,9 +1,7 @@
 from celery import shared_task
 from django.utils import timezone
-from django.utils.dateparse import parse_datetime
 
-from reminder.models import AdminReminder
-from utils.msg91 import send_reminder
+from reminder.queue import claim_due_fires, send_claimed_fires
 
 import logging
 
@@ -22,58 +20,34 @@ def process_admin_reminders(self):
 
     logger.info(f"NOW (UTC): {now}")
 
-    reminders = AdminReminder.objects.filter(is_active=True)
+    # claimed rows are sent by their own task; a lost task's rows are
+    # claimed again by a later tick once the lease runs out
+    batches = claim_due_fires(now)
 
-    for reminder in reminders:
+    for token, fire_ids in batches:
+        send_reminder_batch.delay(fire_ids, token)
 
-        phone = None
-        customer_name = ""
+    dispatched = sum(len(fire_ids) for _, fire_ids in batches)
 
-        if reminder.customer:
-            phone = reminder.customer.phone
-            customer_name = reminder.customer.name
-        else:
-            phone = reminder.phone
-            customer_name = reminder.name
+    logger.info(
+        f"Reminders dispatched: {dispatched} in {len(batches)} batches"
+    )
 
-        if not phone:
-            logger.warning(
-                f"Reminder {reminder.id} skipped. No phone number."
-            )
-            continue
+    return dispatched
 
-        for date_str in reminder.reminder_dates:
 
-            reminder_time = parse_datetime(date_str)
+@shared_task(bind=True, max_retries=5)
+def send_reminder_batch(self, fire_ids, token):
 
-            if not reminder_time:
-                continue
+    sent, error = send_claimed_fires(fire_ids, token)
 
-            if timezone.is_naive(reminder_time):
-                reminder_time = timezone.make_aware(
-                    reminder_time,
-                    timezone.get_default_timezone()
-                )
+    if error is not None:
+        logger.warning(
+            f"Reminder batch {token} failed (try {self.request.retries + 1}): {error}"
+        )
+        # 30s, 60s, 120s, ... — well inside REMINDER_CLAIM_LEASE
+        raise self.retry(countdown=30 * 2 ** self.request.retries)
 
-            if reminder_time <= now and date_str not in reminder.triggered_dates:
+    logger.info(f"Reminder batch {token}: sent {sent}")
 
-                try:
-
-                    send_reminder(
-                        phone=phone,
-                        message=reminder.message,
-                    )
-
-                    logger.info(
-                        f"Reminder sent to {phone}"
-                    )
-
-                    reminder.triggered_dates.append(date_str)
-                    reminder.save(update_fields=["triggered_dates"])
-
-                except Exception as e:
-
-                    logger.exception(
-                        f"Failed to send reminder {reminder.id}: {e}"
-                    )
-                    raise
\ No newline at end of file
+    return sent
@@ -1,3 +1,119 @@
+from datetime import timedelta
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from .models import AdminReminder, ReminderFire
+from .queue import CLAIM_LEASE, REMINDER_MAX_ATTEMPTS, claim_due_fires, send_claimed_fires
+
+
+def sent_ok(messages, batch_size=None):
+    return {key: None for key, _, _ in messages}
+
+
+def provider_down(messages, batch_size=None):
+    return {key: RuntimeError("provider down") for key, _, _ in messages}
+
+
+def reject_bad_number(template_id, recipients):
+    # MSG91 rejects the whole call for one bad recipient
+    if any(r["mobiles"] == "910000000000" for r in recipients):
+        raise RuntimeError("invalid mobile")
+
+
+class ReminderQueueTests(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.reminder = AdminReminder.objects.create(
+            phone="9000000011",
+            message="filter change due",
+            reminder_dates=[
+                (self.now - timedelta(hours=1)).isoformat(),
+                (self.now + timedelta(days=1)).isoformat(),
+            ],
+        )
+
+    def test_claim_takes_due_rows_once_until_the_lease_runs_out(self):
+        [(token, fire_ids)] = claim_due_fires(self.now)
+        self.assertEqual(len(fire_ids), 1)
+
+        # held by the first claim
+        self.assertEqual(claim_due_fires(self.now), [])
+
+        # the send task was lost: claimed again after the lease, with a new token
+        later = self.now + CLAIM_LEASE + timedelta(seconds=1)
+        [(new_token, new_ids)] = claim_due_fires(later)
+        self.assertEqual(new_ids, fire_ids)
+        self.assertNotEqual(new_token, token)
+
+        # the old task can no longer send them
+        with mock.patch("reminder.queue.send_reminders", side_effect=sent_ok) as send:
+            self.assertEqual(send_claimed_fires(fire_ids, token), (0, None))
+            send.assert_not_called()
+
+    @mock.patch("reminder.queue.send_reminders", side_effect=sent_ok)
+    def test_fire_is_sent_once(self, send):
+        [(token, fire_ids)] = claim_due_fires(self.now)
+
+        self.assertEqual(send_claimed_fires(fire_ids, token), (1, None))
+        # a retried / duplicated task
+        self.assertEqual(send_claimed_fires(fire_ids, token), (0, None))
+
+        self.assertEqual(send.call_count, 1)
+        self.reminder.refresh_from_db()
+        self.assertEqual(len(self.reminder.triggered_dates), 1)
+        self.assertEqual(claim_due_fires(self.now + CLAIM_LEASE * 2), [])
+
+        # re-saving the reminder keeps the fired row fired
+        self.reminder.save()
+        self.assertEqual(claim_due_fires(self.now + CLAIM_LEASE * 2), [])
+
+    @mock.patch("reminder.queue.send_reminders", side_effect=provider_down)
+    def test_row_given_up_after_max_attempts(self, send):
+        [(token, fire_ids)] = claim_due_fires(self.now)
+
+        for _ in range(REMINDER_MAX_ATTEMPTS - 1):
+            sent, error = send_claimed_fires(fire_ids, token)
+            self.assertEqual(sent, 0)
+            self.assertIsNotNone(error)
+
+        # last attempt: nothing left worth retrying
+        self.assertEqual(send_claimed_fires(fire_ids, token), (0, None))
+
+        fire = ReminderFire.objects.get(pk=fire_ids[0])
+        self.assertEqual(fire.attempts, REMINDER_MAX_ATTEMPTS)
+        self.assertIsNotNone(fire.failed_at)
+        self.assertIsNone(fire.fired_at)
+        self.assertEqual(fire.last_error, "provider down")
+
+        self.assertEqual(claim_due_fires(self.now + CLAIM_LEASE * 2), [])
+
+    @mock.patch("utils.msg91.send_flow", side_effect=reject_bad_number)
+    def test_retry_isolates_the_failing_recipient(self, send_flow):
+        AdminReminder.objects.create(
+            phone="0000000000",
+            message="filter change due",
+            reminder_dates=[(self.now - timedelta(hours=1)).isoformat()],
+        )
+        [(token, fire_ids)] = claim_due_fires(self.now)
+
+        # one call for the batch, failed for both
+        sent, error = send_claimed_fires(fire_ids, token)
+        self.assertEqual((sent, str(error)), (0, "invalid mobile"))
+        self.assertEqual(send_flow.call_count, 1)
+
+        # the retry sends per recipient: the good one goes out
+        sent, error = send_claimed_fires(fire_ids, token)
+        self.assertEqual((sent, str(error)), (1, "invalid mobile"))
+        self.assertEqual(send_flow.call_count, 3)
+
+        good = ReminderFire.objects.get(reminder=self.reminder, fired_at__isnull=False)
+        bad = ReminderFire.objects.get(id__in=fire_ids, fired_at__isnull=True)
+        self.assertEqual((good.attempts, good.last_error), (2, ""))
+        self.assertEqual((bad.attempts, bad.last_error), (2, "invalid mobile"))
 
-# Create your tests here.
+        # only the failing row is sent again
+        send_claimed_fires(fire_ids, token)
+        self.assertEqual(send_flow.call_count, 4)
@@ -0,0 +1,94 @@
+# user/authentication.py
+"""
+JWT authentication that builds request.user without a query.
+
+The user's row (every field but the password hash) is kept in a small
+in-process cache for AUTH_USER_CACHE_TTL seconds, so hot endpoints
+authenticate without a query. A token is refused when its version is not
+the user's current one (revoked, e.g. password changed), or when its role
+/ region / is_industrial claims no longer match the user: clients read
+those claims, so a stale token is refused (code `token_stale`) and the
+client refreshes to get current ones. Saving a User drops it from this
+process' cache at once; other processes notice within the TTL.
+
+request.user is a User built from the cached row; only `password` is
+deferred and loaded on first access.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+from .tokens import CLAIM_FIELDS, VERSION_CLAIM
+
+USER_CACHE_TTL = getattr(settings, "AUTH_USER_CACHE_TTL", 30)
+USER_CACHE_MAX = 10000
+
+# the whole row but the password hash, so views reading request.user
+# (e.g. /api/auth/me/) do not load deferred fields one query at a time
+STATE_FIELDS = tuple(
+    f.attname for f in User._meta.concrete_fields if f.attname != "password"
+)
+
+_users = {}
+_users_lock = threading.Lock()
+
+
+def user_state(user_id):
+    """
+    {field: value} of STATE_FIELDS for the user, or None when it is gone.
+    """
+    now = time.monotonic()
+
+    cached = _users.get(user_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    state = User.objects.filter(pk=user_id).values(*STATE_FIELDS).first()
+
+    with _users_lock:
+        if len(_users) >= USER_CACHE_MAX:
+            _users.clear()
+        _users[user_id] = (now + USER_CACHE_TTL, state)
+
+    return state
+
+
+def forget_user(user_id):
+    with _users_lock:
+        _users.pop(user_id, None)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        if VERSION_CLAIM not in validated_token:
+            # issued before the claims existed
+            return super().get_user(validated_token)
+
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidToken("Token contained no recognizable user identification") from e
+
+        state = user_state(user_id)
+
+        if state is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+
+        if not state["is_active"]:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        if validated_token[VERSION_CLAIM] != state["token_version"]:
+            raise AuthenticationFailed("Token has been revoked", code="token_revoked")
+
+        if any(validated_token.get(field) != state[field] for field in CLAIM_FIELDS):
+            raise AuthenticationFailed("Token claims are out of date, refresh it", code="token_stale")
+
+        # from_db() takes the loaded values in model field order
+        return User.from_db(DEFAULT_DB_ALIAS, STATE_FIELDS, [state[f] for f in STATE_FIELDS])
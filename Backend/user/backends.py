@@ -0,0 +1,27 @@
+# user/backends.py
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .lockout import clear_failures, is_locked_out, record_failure
+
+
+class LockoutModelBackend(ModelBackend):
+    """
+    ModelBackend that skips locked-out phones (no query, no hashing) and
+    counts failed attempts. Used by the login, token and admin logins.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        phone = username or kwargs.get(get_user_model().USERNAME_FIELD)
+
+        if is_locked_out(phone):
+            return None
+
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+
+        if user is None:
+            record_failure(phone)
+        else:
+            clear_failures(phone)
+
+        return user
@@ -0,0 +1,26 @@
+# user/hashers.py
+"""
+Password hashers whose cost comes from settings.
+
+They keep Django's algorithm names, so existing hashes verify as before.
+When a stored hash was made with another cost (or algorithm) than the
+preferred hasher, check_password() re-hashes it on the next successful
+login (must_update), without changing token_version.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class TunedPBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = getattr(settings, "PASSWORD_PBKDF2_ITERATIONS", hashers.PBKDF2PasswordHasher.iterations)
+
+
+class TunedArgon2PasswordHasher(hashers.Argon2PasswordHasher):
+    time_cost = getattr(settings, "PASSWORD_ARGON2_TIME_COST", hashers.Argon2PasswordHasher.time_cost)
+    memory_cost = getattr(settings, "PASSWORD_ARGON2_MEMORY_COST", hashers.Argon2PasswordHasher.memory_cost)
+    parallelism = getattr(settings, "PASSWORD_ARGON2_PARALLELISM", hashers.Argon2PasswordHasher.parallelism)
+
+
+class TunedBCryptSHA256PasswordHasher(hashers.BCryptSHA256PasswordHasher):
+    rounds = getattr(settings, "PASSWORD_BCRYPT_ROUNDS", hashers.BCryptSHA256PasswordHasher.rounds)
+
@@ -0,0 +1,49 @@
+# user/lockout.py
+"""
+Failed login attempts per phone number.
+
+After LOGIN_MAX_FAILURES failed attempts for a phone, every login for it
+is refused for the rest of LOGIN_LOCKOUT_SECONDS (counted from the first
+failure) before any user lookup or password hashing. The counters live
+in the LOGIN_CACHE_ALIAS cache; it must be shared (Redis) for the limit
+to hold across app servers.
+"""
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+
+LOGIN_CACHE_ALIAS = getattr(settings, "LOGIN_CACHE_ALIAS", "default")
+LOGIN_MAX_FAILURES = getattr(settings, "LOGIN_MAX_FAILURES", 5)
+LOGIN_LOCKOUT_SECONDS = getattr(settings, "LOGIN_LOCKOUT_SECONDS", 15 * 60)
+
+
+def failures_key(phone):
+    # "+919876543210", "919876543210" and "9876543210" share one counter
+    return "login-failures:" + re.sub(r"\D", "", phone or "")[-10:]
+
+
+def is_locked_out(phone):
+    if not phone:
+        return False
+    return caches[LOGIN_CACHE_ALIAS].get(failures_key(phone), 0) >= LOGIN_MAX_FAILURES
+
+
+def record_failure(phone):
+    if not phone:
+        return
+
+    cache = caches[LOGIN_CACHE_ALIAS]
+    key = failures_key(phone)
+
+    # add() only starts the window, incr() keeps its expiry
+    cache.add(key, 0, LOGIN_LOCKOUT_SECONDS)
+    try:
+        cache.incr(key)
+    except ValueError:  # expired in between
+        cache.set(key, 1, LOGIN_LOCKOUT_SECONDS)
+
+
+def clear_failures(phone):
+    if phone:
+        caches[LOGIN_CACHE_ALIAS].delete(failures_key(phone))
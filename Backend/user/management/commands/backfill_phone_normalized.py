@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from user.models import User, normalize_phone
+
+
+class Command(BaseCommand):
+    help = (
+        "Set User.phone_normalized / phone_last10 from phone. Users whose number "
+        "is already taken by another user in another spelling are reported and "
+        "left without phone_normalized."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **kwargs):
+
+        chunk_size = kwargs["chunk_size"]
+        last_id = 0
+        updated = 0
+        conflicts = []
+
+        while True:
+            rows = list(
+                User.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "phone", "phone_normalized", "phone_last10")[:chunk_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            batch = []
+            for pk, phone, current, current_last10 in rows:
+                normalized = normalize_phone(phone)
+                last10 = normalized[-10:] if normalized else None
+
+                if (normalized, last10) != (current, current_last10):
+                    batch.append(User(id=pk, phone_normalized=normalized, phone_last10=last10))
+
+            updated += self.flush(batch, conflicts)
+            self.stdout.write(f"… {updated} users updated")
+
+        self.stdout.write(self.style.SUCCESS("🎉 Phone normalization backfill completed"))
+        self.stdout.write(f"✔ Users updated: {updated}")
+        self.stdout.write(f"✔ Duplicate numbers skipped: {len(conflicts)}")
+
+        for user in conflicts:
+            self.stderr.write(f"⚠️ User {user.id}: {user.phone_normalized} belongs to another user")
+
+    def flush(self, batch, conflicts):
+        if not batch:
+            return 0
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_update(batch, ["phone_normalized", "phone_last10"])
+            return len(batch)
+        except IntegrityError:
+            pass
+
+        # one row at a time to find the duplicates
+        done = 0
+        for user in batch:
+            try:
+                with transaction.atomic():
+                    User.objects.filter(pk=user.id).update(
+                        phone_normalized=user.phone_normalized,
+                        phone_last10=user.phone_last10,
+                    )
+                done += 1
+            except IntegrityError:
+                User.objects.filter(pk=user.id).update(phone_normalized=None, phone_last10=user.phone_last10)
+                conflicts.append(user)
+        return done
@@ -0,0 +1,95 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import get_hasher, get_hashers
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from user.lockout import LOGIN_MAX_FAILURES, clear_failures
+from user.models import User
+
+BENCH_PHONE = "+910000000000"
+BENCH_PASSWORD = "bench-12345"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark password hashing and the login path: hash / verify time of every "
+        "configured hasher, authenticate() throughput with the preferred hasher, "
+        "locked-out rejections and rehash-on-login. The fixture user is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=20)
+
+    def timed(self, fn, n):
+        started = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return (time.perf_counter() - started) / n
+
+    # -----------------------------
+    # Hashers
+    # -----------------------------
+    def measure_hashers(self, n):
+        for hasher in get_hashers():
+            try:
+                encoded = hasher.encode(BENCH_PASSWORD, hasher.salt())
+            except ValueError as e:  # library not installed
+                self.stdout.write(f"{hasher.algorithm:<14} skipped ({e})")
+                continue
+
+            encode = self.timed(lambda: hasher.encode(BENCH_PASSWORD, hasher.salt()), n)
+            verify = self.timed(lambda: hasher.verify(BENCH_PASSWORD, encoded), n)
+
+            self.stdout.write(
+                f"{hasher.algorithm:<14} hash={encode * 1000:8.1f} ms  verify={verify * 1000:8.1f} ms  "
+                f"max={1 / verify:7.1f} logins/s per core"
+            )
+
+    # -----------------------------
+    # Login path
+    # -----------------------------
+    def measure_logins(self, n):
+        user = User.objects.create_user(phone=BENCH_PHONE, name="Bench", password=BENCH_PASSWORD)
+        clear_failures(BENCH_PHONE)
+
+        ok = self.timed(lambda: authenticate(phone=BENCH_PHONE, password=BENCH_PASSWORD), n)
+        bad = self.timed(lambda: authenticate(phone=BENCH_PHONE, password="wrong"), LOGIN_MAX_FAILURES)
+        locked = self.timed(lambda: authenticate(phone=BENCH_PHONE, password="wrong"), n)
+        clear_failures(BENCH_PHONE)
+
+        self.stdout.write(f"login ok       {ok * 1000:8.1f} ms  ({1 / ok:7.1f} /s)")
+        self.stdout.write(f"login failed   {bad * 1000:8.1f} ms")
+        self.stdout.write(f"locked out     {locked * 1000:8.3f} ms  (no hashing)")
+
+        # a hash with another cost is upgraded by the next successful login
+        preferred = get_hasher()
+        legacy = get_hasher("pbkdf2_sha256")
+        legacy_iterations = max(legacy.iterations // 2, 1)
+
+        user.password = legacy.encode(BENCH_PASSWORD, legacy.salt(), iterations=legacy_iterations)
+        user.save(update_fields=["password"])
+
+        authenticate(phone=BENCH_PHONE, password=BENCH_PASSWORD)
+        user.refresh_from_db(fields=["password"])
+
+        self.stdout.write(
+            f"rehash         pbkdf2_sha256 ({legacy_iterations} iterations) -> "
+            f"{preferred.safe_summary(user.password)}"
+        )
+
+    # -----------------------------
+    # Main
+    # -----------------------------
+    def handle(self, *args, **kwargs):
+
+        self.stdout.write(f"Preferred hasher: {settings.PASSWORD_HASHERS[0]}")
+        self.measure_hashers(max(kwargs["logins"] // 4, 1))
+
+        with transaction.atomic():
+            self.measure_logins(kwargs["logins"])
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("🎉 Benchmark completed (fixture rolled back)"))
@@ -2,17 +2,62 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
 from django.utils import timezone
-from django.db import transaction
-from django.db.models import Max
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+import logging
 import re
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTRY_CODE = "91"
+
+
+def normalize_phone(phone):
+    """
+    E.164 form of a phone number ("+919876543210"), or None when it has no
+    digits. Numbers without a country code get DEFAULT_COUNTRY_CODE.
+    """
+    raw = str(phone or "").strip()
+    digits = re.sub(r"\D", "", raw)
+
+    if raw.startswith("00"):
+        digits = digits[2:].lstrip("0")  # international prefix
+    elif not raw.startswith("+"):
+        digits = digits.lstrip("0")
+        if len(digits) <= 10 or not digits.startswith(DEFAULT_COUNTRY_CODE):
+            digits = DEFAULT_COUNTRY_CODE + digits if digits else ""
+
+    return "+" + digits if digits else None
+
+
+def phone_lookup(phone, prefix=""):
+    """
+    Q on the indexed phone_last10 of users (`prefix` e.g. "customer__"):
+    the number itself for 10+ digits, else a prefix of the national number.
+    """
+    digits = re.sub(r"\D", "", str(phone))
+
+    if not digits:
+        return Q(pk__in=[])
+    if len(digits) >= 10:
+        return Q(**{f"{prefix}phone_last10": digits[-10:]})
+    return Q(**{f"{prefix}phone_last10__startswith": digits})
+
+
 class UserManager(BaseUserManager):
     def normalize_phone(self, phone: str) -> str:
-        p = str(phone).strip()
-        p = p.lstrip("0")
-        if not p.startswith("+"):
-            p = "+91" + p  # adjust default country if needed
-        return p
+        return normalize_phone(phone)
+
+    def get_by_natural_key(self, phone):
+        # login by any spelling of the number, through the unique index
+        normalized = normalize_phone(phone)
+        if not normalized:
+            raise self.model.DoesNotExist
+
+        try:
+            return self.get(phone_normalized=normalized)
+        except self.model.DoesNotExist:
+            return self.get(phone=phone)  # row saved before phone_normalized existed
 
     def create_user(self, phone, password=None, **extra_fields):
         if phone:
@@ -28,6 +73,79 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault("is_superuser", True)
         return self.create_user(phone, password, **extra_fields)
 
+class CustomerCodeSequence(models.Model):
+    """
+    Last customer_code number handed out per prefix (VSTC / VSTI / VSTS /
+    VSTA). The row is bumped with one locking UPDATE, so concurrent sign-ups
+    and imports never pick the same number and never scan the user table.
+    A user saved with an explicit code moves the sequence past it.
+    """
+
+    prefix = models.CharField(max_length=10, primary_key=True)
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.prefix}: {self.last_number}"
+
+    @staticmethod
+    def highest(prefix):
+        codes = User.objects.filter(
+            customer_code__startswith=prefix
+        ).values_list("customer_code", flat=True)
+
+        numbers = [
+            int(m.group(1)) for m in
+            (re.fullmatch(rf"{prefix}(\d+)", code) for code in codes) if m
+        ]
+        return max(numbers, default=0)
+
+    @classmethod
+    def seed(cls, prefix):
+        # first use of a prefix: continue after the highest existing code
+        try:
+            with transaction.atomic():
+                cls.objects.create(prefix=prefix, last_number=cls.highest(prefix))
+        except IntegrityError:
+            pass  # seeded by a concurrent save
+
+    @classmethod
+    def skip_past(cls, code):
+        """
+        Keep the sequence of the code's prefix from handing out `code`.
+        """
+        match = re.fullmatch(r"(\D+)(\d+)", code)
+        if match:
+            prefix, number = match.group(1), int(match.group(2))
+            cls.objects.filter(prefix=prefix, last_number__lt=number).update(last_number=number)
+
+    @classmethod
+    def allocate(cls, prefix, count=1):
+        """
+        Reserve `count` consecutive codes for `prefix` and return them.
+        """
+        with transaction.atomic():
+
+            bumped = cls.objects.filter(prefix=prefix).update(
+                last_number=F("last_number") + count
+            )
+            if not bumped:
+                cls.seed(prefix)
+                cls.objects.filter(prefix=prefix).update(
+                    last_number=F("last_number") + count
+                )
+
+            # row stays locked by the UPDATE until commit
+            last = cls.objects.get(prefix=prefix).last_number
+            codes = [f"{prefix}{n:04d}" for n in range(last - count + 1, last + 1)]
+
+            # a code set explicitly before skip_past existed: resync and retry
+            if User.objects.filter(customer_code__in=codes).exists():
+                cls.objects.filter(prefix=prefix).update(last_number=max(last, cls.highest(prefix)))
+                return cls.allocate(prefix, count)
+
+        return codes
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     ROLE_CHOICES = [
         ("customer", "Customer"),
@@ -57,6 +175,10 @@ class User(AbstractBaseUser, PermissionsMixin):
         null=True,
         blank=True
     )
+    # E.164 form of phone and its last 10 digits, set on save; logins and
+    # admin phone searches use these indexes instead of scanning `phone`
+    phone_normalized = models.CharField(max_length=20, unique=True, null=True, blank=True, editable=False)
+    phone_last10 = models.CharField(max_length=10, db_index=True, null=True, blank=True, editable=False)
     address = models.TextField(blank=True, null=True)
     city = models.CharField(max_length=120, blank=True, null=True)
     postal_code = models.CharField(max_length=20, blank=True, null=True)
@@ -67,6 +189,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_available = models.BooleanField(default=True)  # worker availability
+    # bumped to revoke every JWT of the user (see user.authentication)
+    token_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -92,35 +216,47 @@ class User(AbstractBaseUser, PermissionsMixin):
     def save(self, *args, **kwargs):
 
         if not self.customer_code:
+            self.customer_code = CustomerCodeSequence.allocate(self.get_prefix())[0]
+        elif self._state.adding:
+            CustomerCodeSequence.skip_past(self.customer_code)
 
-            prefix = self.get_prefix()
-
-            with transaction.atomic():
-
-                last_code = (
-                    User.objects
-                    .filter(customer_code__startswith=prefix)
-                    .aggregate(max_code=Max("customer_code"))
-                    .get("max_code")
-                )
+        normalized = normalize_phone(self.phone)
+        self.phone_last10 = normalized[-10:] if normalized else None
 
-                if last_code:
-                    last_num = int(re.findall(r'\d+', last_code)[0])
-                    next_num = last_num + 1
-                else:
-                    next_num = 1
+        # an existing user whose number another user has in another spelling
+        # (left NULL by backfill_phone_normalized) keeps NULL instead of
+        # failing every save on the unique index
+        if (
+            self.pk
+            and normalized
+            and normalized != self.phone_normalized
+            and User.objects.filter(phone_normalized=normalized).exclude(pk=self.pk).exists()
+        ):
+            logger.warning(
+                "User %s: %s belongs to another user, phone_normalized left empty",
+                self.pk, normalized,
+            )
+            normalized = None
+        self.phone_normalized = normalized
 
-                while True:
-                    new_code = f"{prefix}{next_num:04d}"
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "phone" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "phone_normalized", "phone_last10"}
 
-                    if not User.objects.filter(customer_code=new_code).exists():
-                        self.customer_code = new_code
-                        break
+        # a new password revokes the tokens issued with the old one
+        if self.pk and self._password is not None:
+            self.token_version += 1
 
-                    next_num += 1
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "token_version"}
 
         super().save(*args, **kwargs)
 
+        if self.pk:
+            from .authentication import forget_user
+            forget_user(self.pk)
+
 
 
 
@@ -1,11 +1,36 @@
 # user/serializers.py
 from rest_framework import serializers
+from rest_framework.exceptions import Throttled
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.password_validation import validate_password
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .lockout import is_locked_out
+from .models import normalize_phone
+from .tokens import VERSION_CLAIM, UserRefreshToken, set_user_claims
 
 User = get_user_model()
 
 
+def unique_phone(value, instance=None):
+    """
+    `value` in E.164 form, refused when another user has the same number
+    in any spelling.
+    """
+    phone = normalize_phone(value)
+    if not phone:
+        return None
+
+    others = User.objects.filter(phone_normalized=phone)
+    if instance is not None:
+        others = others.exclude(pk=instance.pk)
+
+    if others.exists():
+        raise serializers.ValidationError("A user with this phone already exists")
+    return phone
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -39,6 +64,9 @@ class RegisterSerializer(serializers.ModelSerializer):
         fields = ["id","customer_code", "name", "address", "city", "postal_code", "phone", "password", "region", "is_industrial"]
         extra_kwargs = {"password": {"write_only": True}}
 
+    def validate_phone(self, value):
+        return unique_phone(value)
+
     def create(self, validated_data):
         password = validated_data.pop("password")
         user = User(**validated_data)
@@ -55,6 +83,9 @@ class LoginSerializer(serializers.Serializer):
         phone = attrs.get("phone")
         password = attrs.get("password")
 
+        if is_locked_out(phone):
+            raise Throttled(detail="Too many failed login attempts, try again later")
+
         user = authenticate(phone=phone, password=password)
         if not user:
             raise serializers.ValidationError("Invalid phone or password")
@@ -69,6 +100,34 @@ class LoginSerializer(serializers.Serializer):
         return attrs
 
 
+class UserTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = UserRefreshToken
+
+
+class UserTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refuses revoked refresh tokens and gives the new access token the
+    user's current claims.
+    """
+    token_class = UserRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+
+        user = User.objects.filter(pk=refresh.get(api_settings.USER_ID_CLAIM)).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(
+                self.error_messages["no_active_account"],
+                "no_active_account",
+            )
+
+        if VERSION_CLAIM in refresh and refresh[VERSION_CLAIM] != user.token_version:
+            raise AuthenticationFailed("Token has been revoked", "token_revoked")
+
+        set_user_claims(refresh, user)
+        return super().validate({**attrs, "refresh": str(refresh)})
+
+
 class ChangePasswordSerializer(serializers.Serializer):
     old_password = serializers.CharField(write_only=True)
     new_password = serializers.CharField(write_only=True, validators=[validate_password])
@@ -80,9 +139,10 @@ class ChangePasswordSerializer(serializers.Serializer):
         return attrs
 
     def save(self, **kwargs):
-        user = self.context["request"].user
+        # fresh row, not the cached request.user (see ProfileView)
+        user = User.objects.get(pk=self.context["request"].user.pk)
         user.set_password(self.validated_data["new_password"])
-        user.save()
+        user.save(update_fields=["password"])
         return user
 
 
@@ -128,6 +188,9 @@ class AdminCreateUserSerializer(serializers.ModelSerializer):
             "region",
         ]
 
+    def validate_phone(self, value):
+        return unique_phone(value)
+
     def create(self, validated_data):
         password = validated_data.pop("password")
 
@@ -157,3 +220,6 @@ class AdminUserUpdateSerializer(serializers.ModelSerializer):
             "is_available",
             "fcm_token",
         ]
+
+    def validate_phone(self, value):
+        return unique_phone(value, self.instance)
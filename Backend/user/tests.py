@@ -1,3 +1,235 @@
+from django.contrib.auth.hashers import get_hasher
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .lockout import LOGIN_CACHE_ALIAS, LOGIN_MAX_FAILURES
+from .models import CustomerCodeSequence, User
+
+
+class CustomerCodeTests(TestCase):
+
+    def test_codes_follow_prefix_sequence(self):
+        a = User.objects.create_user(phone="9000000001", name="a")
+        b = User.objects.create_user(phone="9000000002", name="b", is_industrial=True)
+        c = User.objects.create_user(phone="9000000003", name="c")
+
+        self.assertEqual(a.customer_code, "VSTC0001")
+        self.assertEqual(b.customer_code, "VSTI0001")
+        self.assertEqual(c.customer_code, "VSTC0002")
+
+    def test_sequence_seeds_numerically_from_existing_codes(self):
+        # lexicographically "VSTC9999" > "VSTC10000"
+        User.objects.create_user(phone="9000000001", name="a", customer_code="VSTC9999")
+        User.objects.create_user(phone="9000000002", name="b", customer_code="VSTC10000")
+        CustomerCodeSequence.objects.filter(prefix="VSTC").delete()
+
+        user = User.objects.create_user(phone="9000000003", name="c")
+
+        self.assertEqual(user.customer_code, "VSTC10001")
+        self.assertEqual(
+            CustomerCodeSequence.allocate("VSTC", 3),
+            ["VSTC10002", "VSTC10003", "VSTC10004"],
+        )
+
+    def test_explicit_code_is_never_handed_out_again(self):
+        User.objects.create_user(phone="9000000001", name="a")
+        User.objects.create_user(phone="9000000002", name="b", customer_code="VSTC0002")
+
+        self.assertEqual(User.objects.create_user(phone="9000000003", name="c").customer_code, "VSTC0003")
+
+        # taken behind the sequence's back (bulk insert, older code)
+        User.objects.bulk_create([User(phone="9000000004", name="d", customer_code="VSTC0004")])
+        self.assertEqual(User.objects.create_user(phone="9000000005", name="e").customer_code, "VSTC0005")
+
+
+class TokenClaimsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            phone="9000000001", name="admin", role="admin", region="tenkasi", password="pass-12345"
+        )
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post(
+            "/api/auth/login/", {"phone": "+919000000001", "password": "pass-12345"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_delivery(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        return self.client.get("/api/crm/notifications/999/")
+
+    def test_cached_user_and_revocation_on_password_change(self):
+        tokens = self.login()
+        self.assertEqual(AccessToken(tokens["access"])["region"], "tenkasi")
+
+        self.assertEqual(self.get_delivery(tokens["access"]).status_code, 404)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_delivery(tokens["access"]).status_code, 404)
+        # only the NotificationOutbox lookup, no user row
+        self.assertEqual(len(queries), 1)
+
+        self.user.set_password("pass-67890")
+        self.user.save()
+
+        self.assertEqual(self.get_delivery(tokens["access"]).status_code, 401)
+        refresh = self.client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]}, format="json")
+        self.assertEqual(refresh.status_code, 401)
+
+    def test_refresh_brings_claims_up_to_date(self):
+        tokens = self.login()
+
+        self.user.region = "chennai"
+        self.user.save(update_fields=["region"])
+
+        self.client.credentials()
+        response = self.client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.data["access"])["region"], "chennai")
+
+    def test_profile_served_from_the_cached_row(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+
+        self.assertEqual(self.client.get("/api/auth/me/").status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/auth/me/")
+
+        self.assertEqual(response.data["customer_code"], self.user.customer_code)
+        self.assertEqual(response.data["region"], "tenkasi")
+        self.assertEqual(len(queries), 0)
+
+    def test_writes_never_save_the_cached_row_back(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get("/api/auth/me/").status_code, 200)
+
+        # changed by another process: this one still has the old row cached
+        User.objects.filter(pk=self.user.pk).update(token_version=5, city="Tenkasi")
+
+        response = self.client.patch("/api/auth/me/", {"name": "renamed"}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.name, self.user.city, self.user.token_version), ("renamed", "Tenkasi", 5))
+
+        # the password change bumps the current version, not the cached one
+        User.objects.filter(pk=self.user.pk).update(token_version=0)
+        self.assertEqual(self.client.get("/api/auth/me/").status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(token_version=5)
+
+        response = self.client.put(
+            "/api/auth/change-password/",
+            {"old_password": "pass-12345", "new_password": "Zq!long-pass-9"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_version, 6)
+        self.assertTrue(self.user.check_password("Zq!long-pass-9"))
+
+    def test_stale_claims_are_refused_until_refreshed(self):
+        tokens = self.login()
+
+        self.user.role = "worker"
+        self.user.save(update_fields=["role"])
+
+        response = self.get_delivery(tokens["access"])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data["code"], "token_stale")
+
+        self.client.credentials()
+        refresh = self.client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]}, format="json")
+        self.assertEqual(AccessToken(refresh.data["access"])["role"], "worker")
+        self.assertEqual(self.get_delivery(refresh.data["access"]).status_code, 404)
+
+
+class LoginHashingTests(TestCase):
+
+    def setUp(self):
+        caches[LOGIN_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(phone="9000000001", name="staff", password="pass-12345")
+        self.client = APIClient()
+
+    def login(self, password, phone="+919000000001"):
+        return self.client.post("/api/auth/login/", {"phone": phone, "password": password}, format="json")
+
+    def test_failed_attempts_lock_out_the_phone(self):
+        for _ in range(LOGIN_MAX_FAILURES):
+            self.assertEqual(self.login("wrong").status_code, 400)
+
+        # the right password is refused too, without hashing
+        self.assertEqual(self.login("pass-12345").status_code, 429)
+        self.assertEqual(self.login("pass-12345", phone="9000000001").status_code, 429)
+
+        caches[LOGIN_CACHE_ALIAS].clear()
+        self.assertEqual(self.login("pass-12345").status_code, 200)
+
+    def test_login_rehashes_with_configured_cost(self):
+        hasher = get_hasher()
+        self.user.password = get_hasher("pbkdf2_sha256").encode("pass-12345", "saltsalt", iterations=1000)
+        self.user.save(update_fields=["password"])
+        version = self.user.token_version
+
+        self.assertEqual(self.login("pass-12345").status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertFalse(hasher.must_update(self.user.password))
+        self.assertEqual(self.user.token_version, version)
+
+
+class PhoneNormalizationTests(TestCase):
+
+    def setUp(self):
+        caches[LOGIN_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(phone="98765 43210", name="cust", password="pass-12345")
+        self.client = APIClient()
+
+    def test_any_spelling_logs_in_and_registers_once(self):
+        self.assertEqual(self.user.phone_normalized, "+919876543210")
+        self.assertEqual(self.user.phone_last10, "9876543210")
+
+        for phone in ("9876543210", "+91 98765 43210", "09876543210", "919876543210"):
+            response = self.client.post("/api/auth/login/", {"phone": phone, "password": "pass-12345"}, format="json")
+            self.assertEqual(response.status_code, 200, phone)
+
+        response = self.client.post(
+            "/api/auth/register/", {"name": "dup", "phone": "+91-9876543210", "password": "Zq!long-pass-9"}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_phone_search_uses_last_10_digits(self):
+        admin = User.objects.create_user(phone="9000000001", name="admin", role="admin")
+        self.client.force_authenticate(admin)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/auth/admin/users/", {"phone": "+91 98765 43210"})
+
+        self.assertEqual([u["id"] for u in response.data], [self.user.id])
+        self.assertIn("phone_last10", queries.captured_queries[-1]["sql"])
+
+    def test_number_clash_keeps_null_on_save(self):
+        # an older row with the same number in another spelling, left NULL by the backfill
+        other = User.objects.create_user(phone="9000000002", name="dup")
+        User.objects.filter(pk=other.pk).update(phone="09876543210", phone_normalized=None)
+        other.refresh_from_db()
+
+        other.name = "dup renamed"
+        with self.assertLogs("user.models", "WARNING"):
+            other.save()
+
+        other.refresh_from_db()
+        self.assertEqual(other.name, "dup renamed")
+        self.assertIsNone(other.phone_normalized)
+        self.assertEqual(other.phone_last10, "9876543210")
+
+        # the owner of the number is unaffected
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.phone_normalized, "+919876543210")
@@ -0,0 +1,28 @@
+# user/tokens.py
+"""
+JWTs that carry what the views branch on (role, region, is_industrial)
+and the user's token_version, so a request can be authenticated without
+loading the user row (see user.authentication).
+"""
+from rest_framework_simplejwt.tokens import RefreshToken
+
+CLAIM_FIELDS = ("role", "region", "is_industrial")
+VERSION_CLAIM = "ver"
+
+
+def set_user_claims(token, user):
+    for field in CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+    token[VERSION_CLAIM] = user.token_version
+
+
+class UserRefreshToken(RefreshToken):
+    """
+    Refresh token with the user claims; its access tokens copy them.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        set_user_claims(token, user)
+        return token
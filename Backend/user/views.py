@@ -7,7 +7,8 @@ from rest_framework.views import APIView
 
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import User
+from .models import User, phone_lookup
+from .tokens import UserRefreshToken
 from .serializers import (
     RegisterSerializer,
     LoginSerializer,
@@ -43,7 +44,7 @@ class LoginView(APIView):
         serializer.is_valid(raise_exception=True)
 
         user = serializer.validated_data["user"]
-        refresh = RefreshToken.for_user(user)
+        refresh = UserRefreshToken.for_user(user)
 
         return Response(
             {
@@ -101,6 +102,10 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
+        # request.user comes from the auth cache and may be up to
+        # AUTH_USER_CACHE_TTL old: never save() it back over newer values
+        if self.request.method in ("PUT", "PATCH"):
+            return User.objects.get(pk=self.request.user.pk)
         return self.request.user
 
 
@@ -127,9 +132,7 @@ class AdminUserListView(generics.ListAPIView):
         customer_code = self.request.query_params.get("customer_code")
 
         if phone:
-            queryset = queryset.filter(
-                phone__icontains=phone
-            )
+            queryset = queryset.filter(phone_lookup(phone))
 
         if role:
             queryset = queryset.filter(
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class UtilsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'utils'
+
+    def ready(self):
+        from celery.signals import task_prerun
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+
+        from .db import count_connection, count_request, count_task
+
+        request_started.connect(count_request, dispatch_uid="utils.db.count_request")
+        task_prerun.connect(count_task, dispatch_uid="utils.db.count_task")
+        connection_created.connect(count_connection, dispatch_uid="utils.db.count_connection")
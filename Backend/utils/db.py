@@ -0,0 +1,59 @@
+# utils/db.py
+"""
+Per-process database connection metrics.
+
+Counts the HTTP requests and Celery tasks a process handled and the
+database connections it opened, per alias. With persistent connections
+(CONN_MAX_AGE) or the pooled backend (utils.mysqlpool), connections opened
+per request / task drops from 1 towards 0. See db_metrics().
+
+The signal receivers are connected in UtilsConfig.ready().
+"""
+import threading
+
+from django.db import connections
+
+_counts = {"requests": 0, "tasks": 0}
+_opened = {}
+_lock = threading.Lock()
+
+
+def count_request(sender=None, **kwargs):
+    with _lock:
+        _counts["requests"] += 1
+
+
+def count_task(sender=None, **kwargs):
+    with _lock:
+        _counts["tasks"] += 1
+
+
+def count_connection(sender, connection, **kwargs):
+    with _lock:
+        _opened[connection.alias] = _opened.get(connection.alias, 0) + 1
+
+
+def db_metrics():
+    with _lock:
+        counts = dict(_counts)
+        opened = dict(_opened)
+
+    units = counts["requests"] + counts["tasks"]
+    databases = {}
+
+    for alias in connections:
+        connection = connections[alias]
+        settings_dict = connection.settings_dict
+
+        databases[alias] = {
+            "engine": settings_dict["ENGINE"],
+            "conn_max_age": settings_dict["CONN_MAX_AGE"],
+            "health_checks": settings_dict["CONN_HEALTH_CHECKS"],
+            "opened": opened.get(alias, 0),
+            "opened_per_unit": round(opened.get(alias, 0) / units, 3) if units else None,
+        }
+
+        if hasattr(connection, "pool_metrics"):
+            databases[alias]["pool"] = connection.pool_metrics()
+
+    return {**counts, "databases": databases}
@@ -0,0 +1,147 @@
+# utils/gateway.py
+"""
+Shared HTTP clients for the messaging gateways (MSG91, Chatinfy).
+
+Each provider gets one pooled keep-alive `requests.Session` per process, so
+OTP bursts and reminder runs reuse TLS connections instead of opening one
+per message. Pool size, timeouts and retries come from settings.GATEWAYS.
+
+Sends are not idempotent, so by default only failures that happen before
+the request reaches the provider (connect errors) and explicit "try again"
+statuses (429 / 503) are retried.
+
+Per-provider request / error counts and latencies are kept in-process,
+see gateway_metrics().
+"""
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "base_url": "",
+    "pool_size": 10,
+    "connect_timeout": 3.05,
+    "read_timeout": 15,
+    "retries": 2,
+    "backoff": 0.5,
+    "retry_statuses": (429, 503),
+}
+
+
+class GatewayClient:
+
+    def __init__(self, name, **options):
+        self.name = name
+        self.options = {**DEFAULTS, **options}
+
+        self._session = None
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self.build_session()
+        return self._session
+
+    def build_session(self):
+        opts = self.options
+
+        retry = Retry(
+            total=opts["retries"],
+            connect=opts["retries"],
+            read=0,
+            status=opts["retries"],
+            status_forcelist=opts["retry_statuses"],
+            allowed_methods=None,  # POST too: only connect errors / 429 / 503 are retried
+            backoff_factor=opts["backoff"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=opts["pool_size"],
+            max_retries=retry,
+        )
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault(
+            "timeout",
+            (self.options["connect_timeout"], self.options["read_timeout"]),
+        )
+        url = self.options["base_url"] + path
+
+        started = time.perf_counter()
+        failed = True
+
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            self.record((time.perf_counter() - started) * 1000, failed)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def record(self, elapsed_ms, failed):
+        with self._lock:
+            self.requests += 1
+            self.errors += failed
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+        if failed:
+            logger.warning("%s gateway call failed after %.0f ms", self.name, elapsed_ms)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+                "max_ms": round(self.max_ms, 1),
+            }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def gateway(name):
+    """
+    Process-wide client of a provider configured in settings.GATEWAYS.
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                options = getattr(settings, "GATEWAYS", {}).get(name, {})
+                client = _clients[name] = GatewayClient(name, **options)
+    return client
+
+
+def gateway_metrics():
+    return {name: client.metrics() for name, client in _clients.items()}
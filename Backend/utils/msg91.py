@@ -1,70 +1,87 @@
-import requests
 from django.conf import settings
 
+from utils.gateway import gateway
 
-def send_otp(phone: str, otp: str):
-    url = "https://control.msg91.com/api/v5/flow/"
+FLOW_PATH = "/api/v5/flow/"
+
+# recipients per flow call when sending in bulk
+FLOW_BATCH_SIZE = getattr(settings, "MSG91_FLOW_BATCH_SIZE", 100)
+
+
+def flow_mobile(phone):
+    """
+    MSG91 mobile: country code + 10 digit number, whatever the stored format.
+    """
+    digits = "".join(ch for ch in str(phone) if ch.isdigit())
+    return f"91{digits[-10:]}"
 
+
+def send_flow(template_id, recipients):
+    """
+    One flow call for many recipients, each a dict with `mobiles` and the
+    template variables.
+    """
     payload = {
-        "template_id": settings.MSG91_TEMPLATE_ID,
+        "template_id": template_id,
         "short_url": "0",
-        "recipients": [
-            {
-                "mobiles": f"91{phone}",
-                "number": str(otp)
-            }
-        ]
+        "recipients": recipients,
     }
 
     headers = {
         "authkey": settings.MSG91_AUTH_KEY,
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
     }
 
-    response = requests.post(
-        url,
+    response = gateway("msg91").post(
+        FLOW_PATH,
         json=payload,
         headers=headers,
-        timeout=15
     )
 
     response.raise_for_status()
-
     return response.json()
 
 
-import requests
-from django.conf import settings
+def send_otp(phone: str, otp: str):
+    return send_flow(
+        settings.MSG91_TEMPLATE_ID,
+        [{"mobiles": flow_mobile(phone), "number": str(otp)}],
+    )
 
 
 def send_reminder(phone, message):
-    url = "https://control.msg91.com/api/v5/flow/"
+    return send_flow(
+        settings.MSG91_REMINDER_TEMPLATE_ID,
+        [{"mobiles": flow_mobile(phone), "var1": message}],
+    )
 
-    payload = {
-        "template_id": settings.MSG91_REMINDER_TEMPLATE_ID,
-        "short_url": "0",
-        "recipients": [
-            {
-                "mobiles": f"91{phone}",
-                "var1": message
-            }
-        ]
-    }
 
-    headers = {
-        "authkey": settings.MSG91_AUTH_KEY,
-        "Content-Type": "application/json",
-    }
+def send_reminders(messages, batch_size=FLOW_BATCH_SIZE):
+    """
+    Send many reminder SMS with as few flow calls as possible.
 
-    response = requests.post(
-        url,
-        json=payload,
-        headers=headers,
-        timeout=15
-    )
+    `messages` is a list of (key, phone, message); the message goes in the
+    per-recipient template variable, so different messages share a call.
+    Returns {key: None on success, or the error of its batch}. MSG91 answers
+    per request, so every recipient of a batch shares its outcome.
+    """
+    results = {}
 
-    print("Status:", response.status_code)
-    print("Response:", response.text)
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
 
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+        recipients = [
+            {"mobiles": flow_mobile(phone), "var1": message}
+            for _, phone, message in batch
+        ]
+
+        try:
+            send_flow(settings.MSG91_REMINDER_TEMPLATE_ID, recipients)
+            error = None
+        except Exception as e:
+            error = e
+
+        for key, _, _ in batch:
+            results[key] = error
+
+    return results
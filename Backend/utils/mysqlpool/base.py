@@ -0,0 +1,108 @@
+# utils/mysqlpool/base.py
+"""
+MySQL backend whose connections come from a per-process SQLAlchemy
+QueuePool (ENGINE = "utils.mysqlpool", needs `pip install SQLAlchemy`).
+
+Django "closes" the connection at the end of each request / task as usual
+(CONN_MAX_AGE = 0); close() hands it back to the pool, which rolls back
+whatever was left open. The next request checks one out, pinged first
+when PRE_PING is on, instead of connecting again. Pool size and recycle
+time come from DATABASES[alias]["POOL_OPTIONS"].
+"""
+import os
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.mysql import base as mysql
+
+try:
+    from sqlalchemy import event as sa_event
+    from sqlalchemy import exc as sa_exc
+    from sqlalchemy import pool as sa_pool
+except ImportError:
+    sa_pool = None
+
+POOL_DEFAULTS = {
+    "POOL_SIZE": 10,
+    "MAX_OVERFLOW": 10,
+    "TIMEOUT": 30,
+    "RECYCLE": 3600,  # below MySQL's wait_timeout
+    "PRE_PING": True,
+}
+
+# (pid, alias) -> QueuePool / real connections made; a forked worker builds its own
+_pools = {}
+_connects = {}
+_pools_lock = threading.Lock()
+
+
+def connect(key, conn_params):
+    with _pools_lock:
+        _connects[key] = _connects.get(key, 0) + 1
+
+    connection = mysql.Database.connect(**conn_params)
+    # same workaround as django.db.backends.mysql
+    if connection.encoders.get(bytes) is bytes:
+        connection.encoders.pop(bytes)
+    return connection
+
+
+def ping_on_checkout(dbapi_connection, connection_record, connection_proxy):
+    # QueuePool(pre_ping=True) needs a SQLAlchemy dialect; a DisconnectionError
+    # raised here makes the pool drop the dead connection and hand out another
+    try:
+        dbapi_connection.ping()
+    except mysql.Database.OperationalError as e:
+        raise sa_exc.DisconnectionError(str(e)) from e
+
+
+def build_pool(creator, options):
+    pool = sa_pool.QueuePool(
+        creator,
+        pool_size=options["POOL_SIZE"],
+        max_overflow=options["MAX_OVERFLOW"],
+        timeout=options["TIMEOUT"],
+        recycle=options["RECYCLE"],
+    )
+    if options["PRE_PING"]:
+        sa_event.listen(pool, "checkout", ping_on_checkout)
+    return pool
+
+
+class DatabaseWrapper(mysql.DatabaseWrapper):
+
+    def connection_pool(self, conn_params):
+        key = (os.getpid(), self.alias)
+
+        pool = _pools.get(key)
+        if pool is None:
+            with _pools_lock:
+                pool = _pools.get(key)
+                if pool is None:
+                    if sa_pool is None:
+                        raise ImproperlyConfigured(
+                            "utils.mysqlpool needs SQLAlchemy: pip install SQLAlchemy"
+                        )
+
+                    options = {**POOL_DEFAULTS, **self.settings_dict.get("POOL_OPTIONS", {})}
+                    pool = _pools[key] = build_pool(lambda: connect(key, conn_params), options)
+        return pool
+
+    def get_new_connection(self, conn_params):
+        # a pooled connection proxy; its close() returns it to the pool
+        return self.connection_pool(conn_params).connect()
+
+    def pool_metrics(self):
+        # connection_created fires on every checkout, "connects" are the real ones
+        key = (os.getpid(), self.alias)
+        pool = _pools.get(key)
+        if pool is None:
+            return None
+
+        return {
+            "connects": _connects.get(key, 0),
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+        }
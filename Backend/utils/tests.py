@@ -1,3 +1,175 @@
-from django.test import TestCase
+import io
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.response import HTTPResponse
+
+from utils.gateway import GatewayClient, gateway, gateway_metrics
+
+try:
+    from utils.mysqlpool import base as mysqlpool
+except ImproperlyConfigured:  # mysqlclient not installed
+    mysqlpool = None
+
+
+class FakeConnection:
+    # the parts of a MySQLdb connection the pool touches
+
+    def __init__(self):
+        self.alive = True
+        self.pings = 0
+        self.closed = False
+
+    def ping(self):
+        self.pings += 1
+        if not self.alive:
+            raise mysqlpool.mysql.Database.OperationalError(2006, "MySQL server has gone away")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@skipUnless(mysqlpool and mysqlpool.sa_pool, "needs mysqlclient and SQLAlchemy")
+class ConnectionPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def test_checkout_reuses_and_pings_the_connection(self):
+        pool = mysqlpool.build_pool(self.connect, mysqlpool.POOL_DEFAULTS)
+
+        for _ in range(2):
+            connection = pool.connect()
+            connection.close()
+
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(self.opened[0].pings, 2)
+
+    def test_dead_connection_is_replaced_on_checkout(self):
+        pool = mysqlpool.build_pool(self.connect, mysqlpool.POOL_DEFAULTS)
+
+        pool.connect().close()
+        self.opened[0].alive = False
+
+        connection = pool.connect()
+
+        self.assertEqual(len(self.opened), 2)
+        self.assertTrue(self.opened[0].closed)
+        self.assertIs(connection.dbapi_connection, self.opened[1])
+        connection.close()
+
+    def test_no_ping_without_pre_ping(self):
+        pool = mysqlpool.build_pool(self.connect, {**mysqlpool.POOL_DEFAULTS, "PRE_PING": False})
+
+        for _ in range(2):
+            pool.connect().close()
+
+        self.assertEqual(self.opened[0].pings, 0)
+
+
+def gateway_response(status, url):
+    return HTTPResponse(
+        body=io.BytesIO(b"{}"),
+        status=status,
+        headers={},
+        preload_content=False,
+        request_url=url,
+    )
+
+
+class GatewayClientTests(SimpleTestCase):
+    # the pooled session runs for real, only the wire (one urllib3 round
+    # trip per attempt) and the backoff sleeps are mocked
+
+    def setUp(self):
+        self.client = GatewayClient("test", base_url="https://gateway.test", retries=2, backoff=0.5)
+
+        sleep = mock.patch("urllib3.util.retry.time.sleep")
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+        logger = mock.patch("utils.gateway.logger")
+        self.logger = logger.start()
+        self.addCleanup(logger.stop)
+
+    def wire(self, *outcomes):
+        """
+        Patch the round trip to answer each attempt with the next outcome: a
+        status code, or an exception raised before the request is sent.
+        """
+        outcomes = iter(outcomes)
+
+        def make_request(pool, conn, method, url, **kwargs):
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return gateway_response(outcome, url)
+
+        patcher = mock.patch.object(HTTPConnectionPool, "_make_request", autospec=True, side_effect=make_request)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_retry_statuses_are_retried_with_backoff(self):
+        wire = self.wire(503, 429, 200)
+
+        response = self.client.post("/send", json={"to": "9000000001"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(wire.call_count, 3)
+        # no wait before the first retry, backoff * 2 before the second
+        self.assertEqual([c.args[0] for c in self.sleep.call_args_list], [1.0])
+        self.assertEqual(self.client.metrics()["errors"], 0)
+
+    def test_connect_errors_are_retried_until_the_budget_runs_out(self):
+        refused = NewConnectionError(None, "connection refused")
+        wire = self.wire(refused, refused, refused)
+
+        with self.assertRaises(requests.ConnectionError):
+            self.client.post("/send")
+
+        self.assertEqual(wire.call_count, 3)
+        self.assertEqual(self.client.metrics()["errors"], 1)
+
+    def test_other_statuses_are_not_retried(self):
+        wire = self.wire(400, 500, 502)
+
+        statuses = [self.client.post("/send").status_code for _ in range(3)]
+        self.assertEqual(statuses, [400, 500, 502])
+        self.assertEqual(wire.call_count, 3)
+
+    def test_retry_status_is_handed_back_once_the_budget_runs_out(self):
+        wire = self.wire(503, 503, 503, 200)
+
+        self.assertEqual(self.client.post("/send").status_code, 503)
+        self.assertEqual(wire.call_count, 3)
+        self.assertEqual(self.client.metrics()["errors"], 1)
+
+    def test_metrics_count_requests_and_errors(self):
+        self.wire(200, 400, 200)
+
+        self.client.get("/balance")
+        self.client.post("/send")
+        self.client.post("/send")
+
+        metrics = self.client.metrics()
+        self.assertEqual((metrics["requests"], metrics["errors"]), (3, 1))
+        self.assertGreaterEqual(metrics["max_ms"], metrics["avg_ms"])
+        self.assertEqual(self.logger.warning.call_count, 1)
+
+    def test_one_client_per_provider(self):
+        with mock.patch.dict("utils.gateway._clients", clear=True):
+            self.assertIs(gateway("msg91"), gateway("msg91"))
+            self.assertIsNot(gateway("msg91"), gateway("chatinfy"))
+            self.assertEqual(set(gateway_metrics()), {"msg91", "chatinfy"})
@@ -0,0 +1,149 @@
+# vstcrm/pagination.py
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Lists stay plain arrays unless the client asks for a page with `?page_size=`
+or `?cursor=`; then the response is `{"next": <url or null>, "results": [...]}`.
+The cursor holds the ordering values of the last row, so the next page is a
+`WHERE (ordering) > (last row)` range instead of an OFFSET, and a deep page
+costs the same as the first one.
+
+Views choose the order with `keyset_ordering` (default latest first). It must
+end with a unique field; a nullable field has to be preceded by an
+annotation that sorts its NULLs (see ServiceViewSet.scheduled_is_null).
+"""
+import base64
+import json
+from datetime import date, datetime
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+PAGE_SIZE = getattr(settings, "CRM_PAGE_SIZE", 50)
+MAX_PAGE_SIZE = getattr(settings, "CRM_MAX_PAGE_SIZE", 500)
+
+
+def keyset_filter(ordering, position):
+    """
+    Q matching the rows that come after `position` in `ordering`.
+    """
+    branches = []
+    prefix = Q()
+
+    for field, value in zip(ordering, position):
+        name = field.lstrip("-")
+
+        if value is None:
+            # NULLs sort together, nothing of this field comes "after" them
+            prefix &= Q(**{f"{name}__isnull": True})
+            continue
+
+        lookup = "lt" if field.startswith("-") else "gt"
+        branches.append(prefix & Q(**{f"{name}__{lookup}": value}))
+        prefix &= Q(**{name: value})
+
+    return reduce(or_, branches)
+
+
+def position_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class KeysetPagination(BasePagination):
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    default_ordering = ("-id",)
+
+    def wants_page(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, "keyset_ordering", self.default_ordering))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, PAGE_SIZE))
+        except ValueError:
+            size = PAGE_SIZE
+        return max(1, min(size, MAX_PAGE_SIZE))
+
+    def decode_cursor(self, request, length):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(position, list) or len(position) != length:
+                raise ValueError
+            return position
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise ValidationError({"cursor": "Invalid cursor"})
+
+    def encode_cursor(self, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.wants_page(request):
+            return None
+
+        self.request = request
+        ordering = self.get_ordering(view)
+
+        queryset = queryset.order_by(*ordering)
+
+        position = self.decode_cursor(request, len(ordering))
+        if position is not None:
+            try:
+                queryset = queryset.filter(keyset_filter(ordering, position))
+            except (TypeError, ValueError, DjangoValidationError):
+                # well-formed, but its values do not fit the ordering fields
+                raise ValidationError({"cursor": "Invalid cursor"})
+
+        size = self.get_page_size(request)
+        rows = list(queryset[:size + 1])
+
+        self.next_position = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            self.next_position = [
+                position_value(getattr(last, field.lstrip("-")))
+                for field in ordering
+            ]
+
+        return rows
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
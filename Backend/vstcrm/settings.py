@@ -21,6 +21,24 @@ MSG91_REMINDER_TEMPLATE_ID = config("MSG91_REMINDER_TEMPLATE_ID")
 if not all([CHATINFY_LICENSE_NUMBER, CHATINFY_API_KEY, CHATINFY_CONTACT]):
     raise RuntimeError("Missing Chatinfy environment variables")
 
+# Pooled HTTP clients of the messaging gateways (utils/gateway.py)
+GATEWAYS = {
+    "msg91": {
+        "base_url": "https://control.msg91.com",
+        "pool_size": config("MSG91_POOL_SIZE", default=10, cast=int),
+        "connect_timeout": config("MSG91_CONNECT_TIMEOUT", default=3.05, cast=float),
+        "read_timeout": config("MSG91_READ_TIMEOUT", default=15, cast=float),
+        "retries": config("MSG91_RETRIES", default=2, cast=int),
+    },
+    "chatinfy": {
+        "base_url": "https://web.chatinfy.in",
+        "pool_size": config("CHATINFY_POOL_SIZE", default=5, cast=int),
+        "connect_timeout": config("CHATINFY_CONNECT_TIMEOUT", default=3.05, cast=float),
+        "read_timeout": config("CHATINFY_READ_TIMEOUT", default=10, cast=float),
+        "retries": config("CHATINFY_RETRIES", default=2, cast=int),
+    },
+}
+
 # Firebase credential path (do NOT commit credential json to repo)
 FIREBASE_CRED_PATH = config('FIREBASE_CRED_PATH', default='')  # set in .env if using Firebase
 
@@ -90,14 +108,36 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'vstcrm.wsgi.application'
 
+# Database connections
+# Each web thread / Celery worker keeps its connection for DATABASE_CONN_MAX_AGE
+# seconds and pings it before reuse (CONN_HEALTH_CHECKS), instead of connecting
+# for every request and task. DATABASE_POOL=True uses utils/mysqlpool instead
+# (needs SQLAlchemy): connections go back to a per-process pool after every
+# request / task. Behind ProxySQL, point DATABASE_HOST / DATABASE_PORT at it
+# (usually 6033) and keep DATABASE_CONN_MAX_AGE below its idle timeout.
+# Per-process counters: utils/db.py, GET /api/crm/admin/metrics/.
+DATABASE_POOL = config('DATABASE_POOL', default=False, cast=bool)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'utils.mysqlpool' if DATABASE_POOL else 'django.db.backends.mysql',
         'NAME': config('DATABASE_NAME'),
         'USER': config('DATABASE_USER'),
         'PASSWORD': config('DATABASE_PASSWORD'),
         'HOST': config('DATABASE_HOST', default='localhost'),
         'PORT': config('DATABASE_PORT', default='3306'),
+        # the pool keeps the connections, Django hands them back after each request
+        'CONN_MAX_AGE': 0 if DATABASE_POOL else config('DATABASE_CONN_MAX_AGE', default=300, cast=int),
+        'CONN_HEALTH_CHECKS': config('DATABASE_CONN_HEALTH_CHECKS', default=True, cast=bool),
+        'OPTIONS': {
+            'connect_timeout': config('DATABASE_CONNECT_TIMEOUT', default=5, cast=int),
+        },
+        'POOL_OPTIONS': {
+            'POOL_SIZE': config('DATABASE_POOL_SIZE', default=10, cast=int),
+            'MAX_OVERFLOW': config('DATABASE_POOL_MAX_OVERFLOW', default=10, cast=int),
+            'RECYCLE': config('DATABASE_POOL_RECYCLE', default=3600, cast=int),
+            'PRE_PING': True,
+        },
     }
 }
 
@@ -107,6 +147,33 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',},
 ]
 
+# Password hashing (user/hashers.py). PASSWORD_HASHER picks the hasher for new
+# and re-hashed passwords: pbkdf2 | argon2 (pip install argon2-cffi) |
+# bcrypt (pip install bcrypt). The others stay listed so existing hashes keep
+# verifying; they are re-hashed with the preferred hasher / cost on login.
+PASSWORD_HASHER = config('PASSWORD_HASHER', default='pbkdf2')
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'user.hashers.TunedPBKDF2PasswordHasher',
+    'argon2': 'user.hashers.TunedArgon2PasswordHasher',
+    'bcrypt': 'user.hashers.TunedBCryptSHA256PasswordHasher',
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', default=600_000, cast=int)
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', default=2, cast=int)
+PASSWORD_ARGON2_MEMORY_COST = config('PASSWORD_ARGON2_MEMORY_COST', default=19 * 1024, cast=int)  # KiB
+PASSWORD_ARGON2_PARALLELISM = config('PASSWORD_ARGON2_PARALLELISM', default=1, cast=int)
+PASSWORD_BCRYPT_ROUNDS = config('PASSWORD_BCRYPT_ROUNDS', default=12, cast=int)
+
+AUTHENTICATION_BACKENDS = [
+    # ModelBackend + per-phone failed-attempt lockout (user/lockout.py)
+    'user.backends.LockoutModelBackend',
+]
+
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'Asia/Kolkata'
 USE_I18N = True
@@ -120,6 +187,34 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Caches
+# "reports" holds the monthly report snapshots (crm/reports.py). Writes are
+# checked against ReportSnapshot in the database, so a local cache stays
+# correct, but use Redis in production so workers share the cached reports, e.g.
+# REPORT_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# REPORT_CACHE_LOCATION=redis://127.0.0.1:6379/1
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': {
+        'BACKEND': config('REPORT_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('REPORT_CACHE_LOCATION', default='crm-reports'),
+    },
+    # failed login counters (user/lockout.py), shared across servers in production
+    'logins': {
+        'BACKEND': config('LOGIN_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('LOGIN_CACHE_LOCATION', default='user-logins'),
+    },
+}
+
+CRM_REPORT_CACHE_ALIAS = 'reports'
+CRM_REPORT_CACHE_TIMEOUT = config('REPORT_CACHE_TIMEOUT', default=5 * 60, cast=int)
+
+LOGIN_CACHE_ALIAS = 'logins'
+LOGIN_MAX_FAILURES = config('LOGIN_MAX_FAILURES', default=5, cast=int)
+LOGIN_LOCKOUT_SECONDS = config('LOGIN_LOCKOUT_SECONDS', default=15 * 60, cast=int)
+
 # CORS
 CORS_ALLOW_ALL_ORIGINS = config('CORS_ALLOW_ALL_ORIGINS', default='True') == 'True'
 if not CORS_ALLOW_ALL_ORIGINS:
@@ -128,16 +223,22 @@ if not CORS_ALLOW_ALL_ORIGINS:
 # DRF + JWT
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWT with role / region claims, no user query per request
+        'user.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
-    )
+    ),
+    # opt-in: lists are paged only with ?page_size= / ?cursor=
+    'DEFAULT_PAGINATION_CLASS': 'vstcrm.pagination.KeysetPagination',
 }
 
+CRM_PAGE_SIZE = config('CRM_PAGE_SIZE', default=50, cast=int)
+CRM_MAX_PAGE_SIZE = config('CRM_MAX_PAGE_SIZE', default=500, cast=int)
+
 from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=config('JWT_ACCESS_MINUTES', default=30, cast=int)),
@@ -145,8 +246,13 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': False,
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'user.serializers.UserTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'user.serializers.UserTokenRefreshSerializer',
 }
 
+# seconds a process trusts its cached copy of a token's user (user/authentication.py)
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=30, cast=int)
+
 AUTH_USER_MODEL = 'user.User'
 
 # Optional production security (enable via env)
@@ -176,5 +282,17 @@ CELERY_BEAT_SCHEDULE = {
     "send-reminders": {
         "task": "reminder.tasks.process_admin_reminders",
         "schedule": 60.0,
-    }
+    },
+    "precompute-monthly-reports": {
+        "task": "crm.tasks.precompute_monthly_reports",
+        "schedule": crontab(hour=2, minute=0),
+    },
+    "drain-notification-outbox": {
+        "task": "crm.tasks.drain_notification_outbox",
+        "schedule": 60.0,
+    },
+    "sweep-export-jobs": {
+        "task": "crm.tasks.sweep_export_jobs",
+        "schedule": crontab(minute="*/15"),
+    },
 }
\ No newline at end of file